@@ -1,14 +1,17 @@
 import os
 import time
-import shutil
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from datetime import datetime
+from fastapi import FastAPI, HTTPException, Form, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import asyncio
 import json
-import google.generativeai as genai
+import hashlib
 from dotenv import load_dotenv
 from services.context_manager import process_sop_context
+from services.job_manager import create_job, get_job, start_job, stream_job_events, key_lock
+from services.gemini_scheduler import generate_content, generate_content_stream, set_request_owner
 
 load_dotenv()
 
@@ -24,166 +27,471 @@ app.add_middleware(
 )
 
 UPLOAD_DIR = "uploads"
+MAX_DOCUMENTS_PAGE = 500
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 @app.get("/")
 def read_root():
     return {"status": "active", "service": "Process Miner AI"}
 
-from services.storage_service import list_all_documents, read_document, load_latest_sop, save_next_version
+from services.storage_service import (
+    query_documents, read_document, document_fingerprint, load_latest_sop, save_next_version,
+)
+from services.version_store import version_of
+from services.http_cache import (
+    cached_response, not_modified, not_modified_response, make_etag,
+    IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL,
+)
 
 # ... existing code ...
 
+DOCUMENT_FIELDS = ("id", "company", "filename", "name", "version", "date", "processing_time")
+
 @app.get("/documents")
-async def get_history():
-    """Returns the list of all generated SOPs."""
-    return {"documents": list_all_documents()}
+def get_history(request: Request, company: str = None, process: str = None, date_from: str = None, date_to: str = None,
+                latest_only: bool = False, sort: str = "newest", limit: int = 100, cursor: str = None, fields: str = None):
+    """
+    Returns one page of generated SOPs, newest first by default.
+    Filters: company, process, date_from/date_to (YYYY-MM-DD), latest_only (one version per process).
+    `fields` is a comma-separated projection; follow `next_cursor` for more.
+    """
+    if sort not in ("newest", "oldest"):
+        raise HTTPException(status_code=400, detail="sort must be 'newest' or 'oldest'")
+    try:
+        for day in (date_from, date_to):
+            if day:
+                datetime.strptime(day, "%Y-%m-%d")
+        page = query_documents(company, process, date_from, date_to, latest_only, sort,
+                               max(1, min(limit, MAX_DOCUMENTS_PAGE)), cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if fields:
+        wanted = [f for f in fields.split(",") if f in DOCUMENT_FIELDS]
+        page["documents"] = [{f: doc[f] for f in wanted} for doc in page["documents"]]
+    # The listing changes with every save: revalidate, but skip the body when it hasn't
+    return cached_response(request, json.dumps(page).encode("utf-8"), "application/json")
 
-@app.get("/document")
-async def get_document(path: str):
-    """Returns the content of a specific SOP."""
+def _document_response(request: Request, path: str, variant: str, render):
+    """Conditional, compressed response for a stored SOP; `render(content)` builds the body."""
+    immutable = version_of(path) is not None
+    cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    fingerprint = document_fingerprint(path)
+    if fingerprint:
+        # Answer revalidations from the index without reading the version
+        etag = make_etag(fingerprint["sha256"], variant)
+        if not_modified(request, etag):
+            return not_modified_response(etag, cache_control, fingerprint["created"])
     content = read_document(path)
     if not content:
         raise HTTPException(status_code=404, detail="Document not found")
-    return {"content": content}
+    data = content.encode("utf-8")
+    etag = make_etag(hashlib.sha256(data).hexdigest(), variant)
+    body, media_type = render(content)
+    return cached_response(request, body, media_type, etag=etag, immutable=immutable,
+                           last_modified=fingerprint["created"] if fingerprint else None)
 
-from typing import List
-from services.multimodal_service import process_and_upload_files, upload_to_gemini, wait_for_files_active, get_mime_type
+@app.get("/document")
+def get_document(path: str, request: Request):
+    """Returns the content of a specific SOP (cacheable: ETag, 304, gzip/br)."""
+    return _document_response(request, path, "json",
+                              lambda content: (json.dumps({"content": content}).encode("utf-8"), "application/json"))
+
+@app.get("/document/raw")
+def get_document_raw(path: str, request: Request):
+    """The SOP's markdown as is, without the JSON wrapper."""
+    return _document_response(request, path, "md",
+                              lambda content: (content.encode("utf-8"), "text/markdown; charset=utf-8"))
+
+from services.gemini_files import upload_file_cached, release_file_async
+from services.gemini_files import get_readiness_coordinator
+from services.gemini_scheduler import scheduler
+from services.prompt_cache import prompt_cache
+from services.upload_cache import file_cache, sha256_file
+from services.upload_ingest import ingest_multipart, new_request_dir, discard_request_dir, UploadTooLarge, MalformedUpload
+from services.resumable_upload import (
+    create_upload, get_upload, parse_content_range, UploadError, RESUMABLE_PART_SIZE,
+)
+from services.response_cache import response_cache, make_key, RESPONSE_CACHE_ENABLED
 from services.sop_generator import SOP_MULTIMODAL_PROMPT
-from services.video_splitter import split_video
-from services.ai_service import analyze_video_chunks
+from services.video_splitter import split_videos_async, transcode_proxies_async
+from services.idle_trimmer import trim_videos_async, remap_timestamps
 from services.sop_aggregator import merge_partial_sops
+from services.sop_sections import merge_session_sop
+from services.sop_document import document_cache
+from services.process_index import process_index
+from services import resilience, model_policy
+
+@app.get("/stats")
+def get_stats():
+    """Runtime counters: upload cache, file readiness polling and the generate scheduler."""
+    return {
+        "upload_cache": file_cache.stats(),
+        "file_readiness": get_readiness_coordinator().stats(),
+        "scheduler": scheduler.stats(),
+        "response_cache": response_cache.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "document_cache": document_cache.stats(),
+        "process_index": process_index.stats(),
+        "model_calls": resilience.stats(),
+        "model_policy": model_policy.stats(),
+    }
+
+_ANALYZE_FORM = {
+    "requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["files"],
+        "properties": {
+            "files": {"type": "array", "items": {"type": "string", "format": "binary"}},
+            "file_contexts": {"type": "string", "default": "{}"},
+            "session_id": {"type": "string"},
+            "bypass_cache": {"type": "boolean", "default": False},
+        },
+    }}}},
+}
+
+@app.post("/analyze", openapi_extra=_ANALYZE_FORM)
+async def analyze_multimodal(request: Request):
+    """Saves the evidence, queues the analysis as a background job and returns its ID immediately."""
+    # The form is parsed here, not by FastAPI: it would spool the whole body
+    # before the size limits get a say, and then we'd copy every file again
+    request_dir = new_request_dir(UPLOAD_DIR)
+    try:
+        saved_files, form = await ingest_multipart(request, request_dir)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except MalformedUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not saved_files:
+        discard_request_dir(request_dir, force=True)
+        raise HTTPException(status_code=422, detail="No files uploaded")
+    session_id = form.get("session_id") or None
+    bypass_cache = form.get("bypass_cache", "").lower() in ("1", "true", "on", "yes")
+    print(f"Received {len(saved_files)} files for analysis. Hybrid Mode.")
+
+    # Parse context mapping
+    try:
+        context_mapping = json.loads(form.get("file_contexts") or "{}")
+    except json.JSONDecodeError:
+        context_mapping = {}
+
+    job = create_job("analyze", meta={"files": [f.filename for f in saved_files], "session_id": session_id})
+    job.emit("saved", f"Saved {len(saved_files)} files", files=len(saved_files),
+             bytes=sum(f.size for f in saved_files))
+    start_job(job, lambda j: run_analysis(j, saved_files, context_mapping, session_id, bypass_cache, request_dir))
+
+    return {"job_id": job.id, "status": "queued", "events_url": f"/jobs/{job.id}/events"}
 
-@app.post("/analyze")
-async def analyze_multimodal(files: List[UploadFile] = File(...), file_contexts: str = Form(default="{}"), session_id: str = Form(None)):
+# Resumable uploads (extension recordings): create -> PUT parts -> finalize
+RESUMABLE_MAX_PART_BYTES = 4 * RESUMABLE_PART_SIZE
+
+def _upload_error(e: UploadError) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail={"message": str(e), "offset": e.offset})
+
+@app.post("/uploads")
+async def create_resumable_upload(filename: str = Form(...), size: int = Form(...), content_type: str = Form(None),
+                                  session_id: str = Form(None), file_context: str = Form(""), bypass_cache: bool = Form(False)):
+    """Starts a resumable upload. Returns its ID and the part size to use."""
+    try:
+        upload = await asyncio.to_thread(create_upload, filename, size, content_type, {
+            "session_id": session_id,
+            "file_context": file_context,
+            "bypass_cache": bypass_cache,
+        })
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadError as e:
+        raise _upload_error(e)
+    return upload.to_dict()
+
+@app.get("/uploads/{upload_id}")
+async def get_resumable_upload(upload_id: str):
+    """Upload state; `offset` is where the client should resume."""
+    upload = await asyncio.to_thread(get_upload, upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload.to_dict()
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_part(upload_id: str, request: Request):
+    """
+    Appends one part. The body is the raw bytes, placed by `Content-Range: bytes start-end/total`;
+    an optional `X-Part-SHA256` header is verified before anything is written.
+    """
+    upload = await asyncio.to_thread(get_upload, upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    too_large = HTTPException(status_code=413, detail=f"Parts are limited to {RESUMABLE_MAX_PART_BYTES} bytes")
+    if int(request.headers.get("content-length") or 0) > RESUMABLE_MAX_PART_BYTES:
+        raise too_large
+    # Content-Length may be missing (chunked) or wrong: count what actually arrives
+    received = bytearray()
+    async for piece in request.stream():
+        received += piece
+        if len(received) > RESUMABLE_MAX_PART_BYTES:
+            raise too_large
+    data = bytes(received)
+    try:
+        start = parse_content_range(request.headers.get("content-range"), len(data), upload.size)
+        offset = await upload.write_part(start, data, request.headers.get("x-part-sha256"))
+    except UploadError as e:
+        raise _upload_error(e)
+    return {"upload_id": upload.id, "offset": offset, "size": upload.size}
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, sha256: str = Form(None)):
+    """
+    Verifies the complete file and queues its analysis. Safe to repeat: a
+    retry gets the same job, or a new one if that job was lost (restart).
+    """
+    upload = await asyncio.to_thread(get_upload, upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if upload.job_id and get_job(upload.job_id):
+        # Retried finalize (the first response got lost): same job
+        return {"job_id": upload.job_id, "status": "queued", "events_url": f"/jobs/{upload.job_id}/events"}
+    try:
+        saved = await upload.finalize(sha256)
+    except UploadError as e:
+        raise _upload_error(e)
+    if upload.job_id and get_job(upload.job_id):
+        # A concurrent finalize got there first
+        return {"job_id": upload.job_id, "status": "queued", "events_url": f"/jobs/{upload.job_id}/events"}
+
+    meta = upload.meta
+    context_mapping = {upload.filename: meta["file_context"]} if meta.get("file_context") else {}
+    job = create_job("analyze", meta={"files": [saved.filename], "session_id": meta.get("session_id"), "upload_id": upload.id})
+    job.emit("saved", f"Received {saved.filename}", files=1, bytes=saved.size)
+    upload.attach_job(job.id)
+    # The assembled file is analysed in place; its directory goes away with the job
+    start_job(job, lambda j: run_analysis(j, [saved], context_mapping, meta.get("session_id"),
+                                          meta.get("bypass_cache", False), upload.directory))
+    return {"job_id": job.id, "status": "queued", "events_url": f"/jobs/{job.id}/events"}
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Returns the current state (and the result, once finished) of an analysis job."""
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str, request: Request):
+    """Server-sent event stream of per-stage / per-chunk progress for a job."""
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    try:
+        last_event_id = int(request.headers.get("last-event-id", -1))
+    except ValueError:
+        last_event_id = -1
+    return StreamingResponse(
+        stream_job_events(job, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def run_analysis(job, saved_files, context_mapping: dict, session_id: str = None, bypass_cache: bool = False,
+                       request_dir: str = None):
+    """
+    The full analysis pipeline: classify, split, upload, generate, merge, route and save.
+    `saved_files` are IngestedFile descriptors; everything derived from them
+    (trims, chunks, proxies) lives in `request_dir`, which is removed at the end.
+    """
+    try:
+        return await _run_analysis(job, saved_files, context_mapping, session_id, bypass_cache, request_dir or UPLOAD_DIR)
+    finally:
+        if request_dir:
+            await asyncio.to_thread(discard_request_dir, request_dir)
+
+async def _run_analysis(job, saved_files, context_mapping: dict, session_id, bypass_cache, work_dir: str):
     start_time = time.time()
+    # All Gemini calls made by this job share one fair-queue slot in the scheduler
+    set_request_owner(job.id)
+
+    # 1. Classification
+    long_videos_local_paths = []
+    context_files_local_paths = []
+    content_hashes = {}
+
+    for saved in saved_files:
+        file_location, mime = saved.path, saved.mime_type
+        content_hashes[file_location] = saved.sha256
+        # For simplicity: If Video > 200MB or explicitly treated as 'main video', we split.
+        # But here user said "20 min batches". We should use split_video to check duration.
+        # Let's treat ALL videos as "Main" for now, or just picking the longest one?
+        # User's request: "If any videos are attached... flow is 20 min batches"
+        if "video" in mime:
+            long_videos_local_paths.append(file_location)
+        else:
+            context_files_local_paths.append(file_location)
+
+    # 2. Upload Context Files (PDFs, Images, Audio) to Gemini (concurrently, deduplicated by content)
+    gemini_context_files = []
+    if context_files_local_paths:
+        job.emit("uploading_context", f"Uploading {len(context_files_local_paths)} context files", context_total=len(context_files_local_paths))
+        gemini_context_files = list(await asyncio.gather(*(
+            upload_file_cached(path, sha256=content_hashes.get(path)) for path in context_files_local_paths
+        )))
+
     try:
-        print(f"Received {len(files)} files for analysis. Hybrid Mode.")
-        
-        # Parse context mapping
-        try:
-            context_mapping = json.loads(file_contexts)
-        except json.JSONDecodeError:
-            context_mapping = {}
-        
-        # 1. Classification
-        long_videos_local_paths = []
-        context_files_local_paths = []
-        
-        # We need to save them all to disk first to check/split
-        for file in files:
-            file_location = os.path.join(UPLOAD_DIR, file.filename)
-            with open(file_location, "wb+") as file_object:
-                shutil.copyfileobj(file.file, file_object)
-            
-            # Simple check: Is it MP4?
-            mime = file.content_type or get_mime_type(file.filename)
-            
-            # For simplicity: If Video > 200MB or explicitly treated as 'main video', we split.
-            # But here user said "20 min batches". We should use split_video to check duration.
-            # Let's treat ALL videos as "Main" for now, or just picking the longest one?
-            # User's request: "If any videos are attached... flow is 20 min batches"
-            if "video" in mime:
-                long_videos_local_paths.append(file_location)
-            else:
-                context_files_local_paths.append(file_location)
-                
-        # 2. Upload Context Files (PDFs, Images, Audio) to Gemini
-        gemini_context_files = []
-        for path in context_files_local_paths:
-             g_file = upload_to_gemini(path)
-             gemini_context_files.append(g_file)
-             
-        wait_for_files_active(gemini_context_files)
-        
         raw_sop = ""
 
         # Prepare Context String for AI
         context_description_lines = []
         for filename, context in context_mapping.items():
             if context and context.strip():
-                 context_description_lines.append(f"- File '{filename}': {context}")
-        
+                context_description_lines.append(f"- File '{filename}': {context}")
+
         context_description = "\n".join(context_description_lines)
 
         # 3. Process Videos (Parallel Orchestrator Flow)
         video_sops = []
-        
-        # SPLIT LOGIC: Ensure large videos are chunked (Manual Uploads)
+        missing_chunks = []
+        preprocessing = None
+
+        # IDLE TRIM: Drop long frozen + silent stretches before anything is uploaded
         final_video_chunks = []
         if long_videos_local_paths:
-            for v_path in long_videos_local_paths:
-                # split_video returns a list of paths (or just [v_path] if small)
-                chunks = split_video(v_path, UPLOAD_DIR)
-                final_video_chunks.extend(chunks)
+            job.emit("trimming", f"Detecting idle stretches in {len(long_videos_local_paths)} video(s)")
+            trims = await trim_videos_async(long_videos_local_paths, work_dir)
+            removed = round(sum(t["removed_seconds"] for t in trims), 1)
+            if removed:
+                job.emit("trimmed", f"Removed {removed}s of idle screen time", idle_seconds_removed=removed)
+
+            # SPLIT LOGIC: Ensure large videos are chunked (Manual Uploads)
+            job.emit("splitting", f"Splitting {len(long_videos_local_paths)} video(s)", videos_total=len(long_videos_local_paths))
+            # All videos are split concurrently; each returns its segments (or just itself if small)
+            split_results = await split_videos_async([t["path"] for t in trims], work_dir)
+            for trim, segments in zip(trims, split_results):
+                for seg in segments:
+                    final_video_chunks.append({"path": seg["path"], "offset": seg["start"], "time_map": trim["time_map"]})
+
+            # PROXY: Smaller, UI-legible renditions where they pay off
+            job.emit("transcoding", f"Preparing upload proxies for {len(final_video_chunks)} chunks")
+            proxy_reports = await transcode_proxies_async([c["path"] for c in final_video_chunks])
+            for chunk, report in zip(final_video_chunks, proxy_reports):
+                chunk["path"] = report["path"]
+
+            bytes_saved = sum(r["original_bytes"] - r["proxy_bytes"] for r in proxy_reports if r["used"])
+            preprocessing = {
+                "idle_seconds_removed": removed,
+                "proxy_profile": next((r["profile"] for r in proxy_reports if r["used"]), None),
+                "proxy_chunks_used": sum(1 for r in proxy_reports if r["used"]),
+                "original_bytes": sum(r["original_bytes"] for r in proxy_reports),
+                "upload_bytes": sum(r["proxy_bytes"] if r["used"] else r["original_bytes"] for r in proxy_reports),
+                "bytes_saved": bytes_saved,
+            }
+            if bytes_saved:
+                job.emit("transcoded", f"Proxies saved {bytes_saved / 1e6:.1f}MB of upload", bytes_saved=bytes_saved)
 
         if final_video_chunks:
-            print(f"Orchestrator: Found {len(final_video_chunks)} chunks (from {len(long_videos_local_paths)} uploaded videos). Processing in PARALLEL...")
-            
+            total = len(final_video_chunks)
+            print(f"Orchestrator: Found {total} chunks (from {len(long_videos_local_paths)} uploaded videos). Processing in PARALLEL...")
+            job.emit("chunks_ready", f"Processing {total} chunks", chunks_total=total, chunks_done=0)
+            chunks_done = 0
+            # One model for all chunks of the job, so their cached extractions stay comparable
+            extraction_model = model_policy.model_for("extraction", evidence="video", chunks=total)
+
             # Helper function for single video flow
-            async def process_single_video_flow(path, index, total, context_str=""):
+            async def process_single_video_flow(chunk, index, total, context_str=""):
+                nonlocal chunks_done
+                path = chunk["path"]
                 try:
-                        print(f"Processing chunk {index+1}/{total}...")
-                        g_vid = upload_to_gemini(path)
-                        wait_for_files_active([g_vid])
-                        
-                        model = genai.GenerativeModel(model_name="gemini-2.5-pro")
-                        prompt = SOP_MULTIMODAL_PROMPT
-                        if context_str:
-                             prompt += f"\n\nUSER PROVIDED CONTEXT:\n{context_str}"
-                             
-                        response = await model.generate_content_async([prompt, g_vid])
-                        text = response.text
-                        
-                        # Cleanup
+                    print(f"Processing chunk {index+1}/{total}...")
+                    prompt = SOP_MULTIMODAL_PROMPT
+                    context_part = f"\n\nUSER PROVIDED CONTEXT:\n{context_str}" if context_str else ""
+                    prompt += context_part
+
+                    # Same chunk bytes + same prompt + same model -> reuse the earlier extraction
+                    sha256 = content_hashes.get(path) or await asyncio.to_thread(sha256_file, path)
+                    cache_key = make_key(sha256, prompt, extraction_model)
+                    raw_text = None
+                    if RESPONSE_CACHE_ENABLED and not bypass_cache:
+                        raw_text = await asyncio.to_thread(response_cache.get, cache_key)
+
+                    if raw_text is not None:
+                        print(f"Response cache hit for chunk {index+1}/{total}")
+                    else:
+                        job.emit("uploading", f"Uploading chunk {index+1}/{total}", chunk=index + 1)
+                        g_vid = await upload_file_cached(path, sha256=sha256)
+
                         try:
-                             genai.delete_file(g_vid.name)
-                        except:
-                             pass
-                        return text
-                        
+                            job.emit("generating", f"Extracting SOP from chunk {index+1}/{total}", chunk=index + 1)
+                            # The static SOP prompt comes from the model-side prompt cache
+                            # Hedged: a straggler chunk gets a duplicate request instead of holding up the gather
+                            response = await generate_content(
+                                extraction_model,
+                                ([context_part] if context_part else []) + [g_vid],
+                                cached_prefix=[SOP_MULTIMODAL_PROMPT],
+                                hedge=True,
+                            )
+                            raw_text = response.text
+                        finally:
+                            # Cleanup, also when generation failed (an evicted file waits for this)
+                            await release_file_async(g_vid)
+                        if RESPONSE_CACHE_ENABLED:
+                            await asyncio.to_thread(response_cache.put, cache_key, raw_text)
+
+                    # Chunk-relative (and idle-trimmed) timestamps -> original recording time
+                    text = remap_timestamps(raw_text, chunk["offset"], chunk["time_map"])
+
+                    chunks_done += 1
+                    job.emit("chunk_done", f"Chunk {index+1}/{total} done", chunk=index + 1, chunks_done=chunks_done)
+                    return text
+
                 except Exception as e:
+                    # Transient errors were already retried by the call layer; record the gap and keep going
                     print(f"❌ ERROR processing video {os.path.basename(path)}: {e}")
-                    return None # Return None to signal failure but keep going
+                    job.emit("chunk_failed", f"Chunk {index+1}/{total} failed: {e}", chunk=index + 1)
+                    missing_chunks.append({"chunk": index + 1, "offset_seconds": chunk["offset"], "error": str(e)})
+                    return None
 
             # Create tasks for all videos
             tasks = [
-                process_single_video_flow(path, idx, len(final_video_chunks))
-                for idx, path in enumerate(final_video_chunks)
+                process_single_video_flow(chunk, idx, total)
+                for idx, chunk in enumerate(final_video_chunks)
             ]
-            
+
             # Execute in parallel
             results = await asyncio.gather(*tasks)
-            
-            # Filter out failures (None)
+
             video_sops = [res for res in results if res is not None]
-            
-            print(f"\nOrchestrator: {len(video_sops)}/{len(final_video_chunks)} videos processed successfully.")
+
+            print(f"\nOrchestrator: {len(video_sops)}/{total} videos processed successfully.")
+            if not video_sops:
+                raise RuntimeError(f"None of the {total} video chunks could be processed: {missing_chunks[0]['error']}")
+            if missing_chunks:
+                missing_chunks.sort(key=lambda m: m["chunk"])
+                job.emit("chunks_missing", f"SOP is incomplete: {len(missing_chunks)}/{total} chunks could not be processed",
+                         missing_chunks=missing_chunks)
 
             # If multiple successful videos, perform Master Merge
             if len(video_sops) > 1:
                 print(f"\n--- Master Merge: Consolidating {len(video_sops)} Video SOPs ---")
-                from services.sop_aggregator import merge_partial_sops
-                raw_sop = await merge_partial_sops(video_sops)
-            elif video_sops:
-                raw_sop = video_sops[0]
+                job.emit("merging", f"Merging {len(video_sops)} chunk SOPs")
+                raw_sop = await merge_partial_sops(video_sops, on_text=job.stream_text)
             else:
-                raw_sop = "No videos were successfully processed. Check server logs."
-                
+                raw_sop = video_sops[0]
+
         else:
-             # No Video, just Documents?
-             print("No Video found. Document-only analysis.")
-             model = genai.GenerativeModel(model_name="gemini-2.5-pro")
-             
-             # Inject context into prompt if exists
-             prompt_with_context = SOP_MULTIMODAL_PROMPT
-             if context_description:
-                 prompt_with_context += f"\n\nUSER PROVIDED CONTEXT FOR ATTACHMENTS:\n{context_description}\n"
-                 prompt_with_context += "\nINSTRUCTION: Please add a final section '## Context Acknowledgement' explaining how this context was utilized."
-
-             request_content = [prompt_with_context] + gemini_context_files
-             response = await model.generate_content_async(request_content)
-             raw_sop = response.text
+            # No Video, just Documents?
+            print("No Video found. Document-only analysis.")
+            job.emit("generating", "Generating SOP from documents")
+
+            # Inject context into prompt if exists
+            context_instructions = []
+            if context_description:
+                context_instructions.append(
+                    f"\n\nUSER PROVIDED CONTEXT FOR ATTACHMENTS:\n{context_description}\n"
+                    "\nINSTRUCTION: Please add a final section '## Context Acknowledgement' explaining how this context was utilized."
+                )
+
+            request_content = context_instructions + gemini_context_files
+            # Streamed so the client can render the SOP while it is written
+            raw_sop = await generate_content_stream(model_policy.model_for("extraction", evidence="document"),
+                                                    request_content, cached_prefix=[SOP_MULTIMODAL_PROMPT],
+                                                    hedge=True, on_text=job.stream_text)
 
         # 4. Context Processing / Saving
         # Calculate time
@@ -193,41 +501,48 @@ async def analyze_multimodal(files: List[UploadFile] = File(...), file_contexts:
         # EXTENSION LOGIC: If session_id is present, handle iterative update
         if session_id:
             print(f"Extension Mode: Handling Session {session_id}")
-            # 1. Try to load previous SOP
-            prev_sop = load_latest_sop("Shadow_Sessions", f"Session_{session_id}")
-            
-            final_result = raw_sop
-            
-            if prev_sop:
-                print("Found previous SOP version. Merging...")
-                # Merge Previous + New
-                merged_sop = await merge_partial_sops([prev_sop, raw_sop], model_name="gemini-2.5-pro", context_str=context_description)
-                final_result = merged_sop
-            else:
-                print("No previous SOP found. Starting new session.")
-                final_result = raw_sop # First chunk
+            # Chunks of one session load, merge and save the same SOP: one at a time,
+            # or the later save would drop the other chunk's steps
+            async with key_lock(f"session:{session_id}"):
+                # 1. Try to load previous SOP
+                prev_sop = await asyncio.to_thread(load_latest_sop, "Shadow_Sessions", f"Session_{session_id}")
+
+                final_result = raw_sop
+
+                if prev_sop:
+                    print("Found previous SOP version. Merging...")
+                    job.emit("merging", "Merging with previous session SOP")
+                    job.stream_text(reset=True)  # Preview now shows the merged session SOP
+                    # Merge Previous + New
+                    # Only the sections this chunk touched are re-generated
+                    merged_sop = await merge_session_sop(prev_sop, raw_sop, context_str=context_description,
+                                                         on_text=job.stream_text)
+                    final_result = merged_sop
+                else:
+                    print("No previous SOP found. Starting new session.")
+                    final_result = raw_sop # First chunk
+
+                # 2. Save new version (Shadow_Sessions/Session_X_vN.md)
+                saved_path = await asyncio.to_thread(save_next_version, "Shadow_Sessions", f"Session_{session_id}",
+                                                     final_result, processing_time=duration)
+                print(f"Saved updated SOP to: {saved_path}")
+                job.emit("saved", f"Saved to {saved_path}", path=saved_path)
 
-            # 2. Save new version (Shadow_Sessions/Session_X_vN.md)
-            saved_path = save_next_version("Shadow_Sessions", f"Session_{session_id}", final_result, processing_time=duration)
-            print(f"Saved updated SOP to: {saved_path}")
-            
-            return {"sop": final_result, "status": "updated", "path": saved_path}
+            return {"sop": final_result, "status": "updated", "path": saved_path, "video_preprocessing": preprocessing,
+                    "missing_chunks": missing_chunks}
 
         # STANDARD FLOW (Drag & Drop)
+        job.emit("routing", "Routing SOP into the knowledge base")
         result = await process_sop_context(raw_sop, processing_time=duration)
-        
-        # Cleanup Context Files
-        for g_file in gemini_context_files:
-            try:
-                genai.delete_file(g_file.name)
-            except:
-                pass
-        
+        result["video_preprocessing"] = preprocessing
+        result["missing_chunks"] = missing_chunks
+        job.emit("saved", f"Saved to {result.get('file_path')}", path=result.get("file_path"))
+
         return result
-        
-    except Exception as e:
-        print(f"Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+
+    finally:
+        # Cleanup Context Files
+        await asyncio.gather(*(release_file_async(g_file) for g_file in gemini_context_files))
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -7,7 +7,6 @@ from fastapi import UploadFile
 # Enusre GEMINI_API_KEY is set in environment
 genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
 
-model_name = "gemini-2.5-pro"
 
 def upload_to_gemini(path, mime_type=None):
     """Uploads the given file to Gemini."""
@@ -30,21 +29,19 @@ def wait_for_files_active(files):
 
 import asyncio
 from .sop_aggregator import merge_partial_sops
+from .gemini_files import upload_file_cached, release_file_async
+from .gemini_scheduler import generate_content
+from . import model_policy
 
 async def generate_sop_for_chunk(chunk_path: str, chunk_index: int, total_chunks: int, prompt: str, context_files: list = [], context_str: str = ""):
     """Processes a single video chunk with additional context files."""
     print(f"Processing chunk {chunk_index + 1}/{total_chunks}: {chunk_path}")
     
-    # Upload
-    video_file = upload_to_gemini(chunk_path, mime_type="video/mp4")
-    
-    # Wait
-    wait_for_files_active([video_file])
+    # Upload + Wait (off the event loop)
+    video_file = await upload_file_cached(chunk_path, mime_type="video/mp4")
     
     # Generate
     chunk_prompt = f"""
-    {prompt}
-    
     IMPORTANT: This is PART {chunk_index + 1} of {total_chunks} of the video. 
     Focus on extracting the steps shown IN THIS VIDEO SEGMENT.
     
@@ -56,19 +53,19 @@ async def generate_sop_for_chunk(chunk_path: str, chunk_index: int, total_chunks
     {context_str}
     """
     
-    # Construct Multimodal Request: [Video, *ContextFiles, Prompt]
-    request_content = [video_file] + context_files + [chunk_prompt]
+    # Construct Multimodal Request: [Prompt, *ContextFiles] + [Video, Chunk instructions]
+    # The prompt + context files are identical for every chunk, so they are
+    # served from one shared model-side cache entry.
+    request_content = [video_file, chunk_prompt]
     
-    model = genai.GenerativeModel(model_name=model_name)
-    response = await model.generate_content_async(request_content)
+    model_name = model_policy.model_for("extraction", evidence="video", chunks=total_chunks)
+    try:
+        response = await generate_content(model_name, request_content, cached_prefix=[prompt] + list(context_files))
+    finally:
+        # Cleanup chunk video from Gemini to save space (Context files remain for other chunks)
+        await release_file_async(video_file)
     
     print(f"Chunk {chunk_index + 1} complete.")
-    
-    # Cleanup chunk video from Gemini to save space (Context files remain for other chunks)
-    try:
-        genai.delete_file(video_file.name)
-    except:
-        pass
         
     return response.text
 
@@ -85,7 +82,7 @@ async def analyze_video_chunks(chunk_paths: list[str], prompt: str, context_file
     print("All chunks processed. Merging...")
     
     # Merge
-    final_sop = await merge_partial_sops(partial_sops, model_name, context_str)
+    final_sop = await merge_partial_sops(partial_sops, context_str=context_str)
     
     return final_sop
 
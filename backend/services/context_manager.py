@@ -1,7 +1,11 @@
 import json
 import re
-import google.generativeai as genai
+import asyncio
+from .gemini_scheduler import generate_content
+from .sop_document import SOPDocument
 from .storage_service import save_next_version, load_latest_sop, init_knowledge_base, get_all_process_identifiers
+from .process_index import process_index
+from . import model_policy
 
 MERGE_UPDATE_PROMPT = """
 You are an intelligent SOP Manager. 
@@ -51,27 +55,24 @@ Constraints:
 def extract_metadata(sop_text: str):
     """Extracts the JSON metadata block from the SOP text."""
     try:
-        match = re.search(r"```json\n(.*?)\n```", sop_text, re.DOTALL)
-        if match:
-            json_str = match.group(1)
-            metadata = json.loads(json_str)
+        doc = SOPDocument.parse(sop_text)
+        if doc.metadata:
             # Remove the metadata block from the text so it doesn't duplicate
-            clean_text = re.sub(r"```json\n(.*?)\n```", "", sop_text, flags=re.DOTALL).strip()
-            return metadata, clean_text
+            return doc.metadata, doc.to_markdown(storage_meta=False, metadata=False).strip()
     except Exception as e:
         print(f"Metadata extraction failed: {e}")
     
     # Fallback
     return {"company_name": "General", "process_name": "New Process"}, sop_text
 
-async def process_sop_context(raw_sop: str, processing_time: float = 0.0, model_name="gemini-2.5-pro"):
+async def process_sop_context(raw_sop: str, processing_time: float = 0.0, model_name: str = None):
     """
     1. Extracts metadata.
     2. ROUTER: Checks identity against DB.
     3. Merges or Saves.
     4. Saves with processing time metadata.
     """
-    init_knowledge_base()
+    await asyncio.to_thread(init_knowledge_base)
     
     # 1. Initial Extraction
     extracted_metadata, clean_text = extract_metadata(raw_sop)
@@ -79,18 +80,28 @@ async def process_sop_context(raw_sop: str, processing_time: float = 0.0, model_
     draft_process = extracted_metadata.get("process_name", "New Process")
     
     # 2. Router: Check against existing DB
-    existing_processes = get_all_process_identifiers()
+    existing_processes = await asyncio.to_thread(get_all_process_identifiers)
     print(f"Router Check: Checking '{draft_process}' against {len(existing_processes)} existing files.")
     
-    model = genai.GenerativeModel(model_name=model_name)
-    
+    match = None
     if existing_processes:
-        router_response = await model.generate_content_async([
-            ROUTER_PROMPT, 
+        match = await asyncio.to_thread(process_index.match, draft_company, draft_process, clean_text,
+                                        existing_processes, load_latest_sop)
+        print(f"Router Index: {match.reason}.")
+        if match.identifier:
+            # Same process as an existing one: no need to ask the model
+            draft_company, draft_process = match.identifier.split("/", 1)
+            print(f"Routing to UPDATE: {draft_company} / {draft_process}")
+        elif not match.candidates:
+            print(f"Routing to CREATE: {draft_company} / {draft_process}")
+
+    if match and not match.decided:
+        router_model = model_name or model_policy.model_for("routing")
+        router_response = await generate_content(router_model, [
             f"NEW SOP METADATA: {json.dumps(extracted_metadata)}",
             f"NEW SOP CONTENT SNIPPET: {clean_text[:500]}...",
-            f"EXISTING PROCESSES: {json.dumps(existing_processes)}"
-        ])
+            f"EXISTING PROCESSES: {json.dumps(match.candidates)}"
+        ], cached_prefix=[ROUTER_PROMPT], fallback_model=model_policy.fallback_for("routing", router_model))
         
         try:
             # Extract JSON from Router Response
@@ -147,19 +158,21 @@ async def process_sop_context(raw_sop: str, processing_time: float = 0.0, model_
 
     print(f"Final Context: Company='{company}', Process='{process}'")
     
-    existing_sop = load_latest_sop(company, process)
+    existing_sop = await asyncio.to_thread(load_latest_sop, company, process)
     
     final_sop = clean_text
     status = "created"
     
     if existing_sop:
         print("Existing SOP found (Confirmed by context). Merging...")
-        response = await model.generate_content_async([MERGE_UPDATE_PROMPT, f"EXISTING SOP:\n{existing_sop}", f"NEW INFO:\n{clean_text}"])
+        merge_model = model_name or model_policy.model_for("update_merge")
+        response = await generate_content(merge_model, [f"EXISTING SOP:\n{existing_sop}", f"NEW INFO:\n{clean_text}"], cached_prefix=[MERGE_UPDATE_PROMPT],
+                                          fallback_model=model_policy.fallback_for("update_merge", merge_model))
         final_sop = response.text
         status = "updated"
     
     # Save the final version with timing
-    file_path = save_next_version(company, process, final_sop, processing_time)
+    file_path = await asyncio.to_thread(save_next_version, company, process, final_sop, processing_time)
     
     return {
         "sop": final_sop,
@@ -0,0 +1,266 @@
+import os
+import random
+import asyncio
+import functools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import google.generativeai as genai
+from .multimodal_service import upload_to_gemini
+from .upload_cache import file_cache, sha256_file, GEMINI_FILE_CACHE_ENABLED
+
+# The google.generativeai file API is blocking (HTTP upload + polling).
+# Every call goes through this pool so the event loop stays free and
+# uploads of different chunks really run side by side.
+GEMINI_FILE_WORKERS = int(os.environ.get("GEMINI_FILE_WORKERS", "8"))
+# Readiness polling: per-file exponential backoff between these bounds.
+FILE_POLL_INITIAL_DELAY = float(os.environ.get("FILE_POLL_INITIAL_DELAY", "1.0"))
+FILE_POLL_MAX_DELAY = float(os.environ.get("FILE_POLL_MAX_DELAY", "15.0"))
+FILE_READY_TIMEOUT = float(os.environ.get("FILE_READY_TIMEOUT", "1800"))
+FILE_POLL_MAX_ERRORS = 5
+
+_file_executor = ThreadPoolExecutor(max_workers=GEMINI_FILE_WORKERS, thread_name_prefix="gemini-files")
+
+
+async def _run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_file_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def upload_file_async(path: str, mime_type: str = None):
+    """Uploads a local file to Gemini without blocking the event loop."""
+    return await _run_blocking(upload_to_gemini, path, mime_type)
+
+
+async def get_file_async(name: str):
+    return await _run_blocking(genai.get_file, name)
+
+
+class FileReadinessCoordinator:
+    """
+    Tracks every remote file that is still PROCESSING (across all in-flight
+    requests) and polls them from one shared loop. Files are polled
+    concurrently, each on its own jittered exponential backoff, and every
+    waiter gets a future that resolves when its file turns ACTIVE or FAILED.
+    Several waiters on the same file share a single `get_file` stream.
+    """
+
+    def __init__(self, initial_delay: float = FILE_POLL_INITIAL_DELAY, max_delay: float = FILE_POLL_MAX_DELAY,
+                 factor: float = 1.6, jitter: float = 0.25, timeout: float = FILE_READY_TIMEOUT):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.timeout = timeout
+        self.poll_count = 0
+        self._pending = {}
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def _jittered(self, delay: float) -> float:
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def wait(self, name: str) -> asyncio.Future:
+        """Returns a future resolving to the ACTIVE file (or raising if it failed)."""
+        loop = asyncio.get_running_loop()
+        entry = self._pending.get(name)
+        if entry is None:
+            now = loop.time()
+            entry = {
+                "futures": [],
+                "delay": self.initial_delay,
+                "next_poll": now + self._jittered(self.initial_delay),
+                "deadline": now + self.timeout,
+                "errors": 0,
+            }
+            self._pending[name] = entry
+        future = loop.create_future()
+        entry["futures"].append(future)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wake.set()
+        return future
+
+    def stats(self) -> dict:
+        return {"pending_files": len(self._pending), "get_file_calls": self.poll_count}
+
+    def _resolve(self, name: str, file=None, error: Exception = None):
+        entry = self._pending.pop(name, None)
+        if not entry:
+            return
+        for future in entry["futures"]:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(file)
+
+    async def _poll(self, name: str):
+        entry = self._pending[name]
+        loop = asyncio.get_running_loop()
+        self.poll_count += 1
+        try:
+            file = await get_file_async(name)
+        except Exception as e:
+            entry["errors"] += 1
+            if entry["errors"] >= FILE_POLL_MAX_ERRORS:
+                self._resolve(name, error=Exception(f"File {name} could not be polled: {e}"))
+                return
+            file = None
+
+        if file is not None:
+            state = file.state.name
+            if state == "ACTIVE":
+                self._resolve(name, file=file)
+                return
+            if state != "PROCESSING":
+                self._resolve(name, error=Exception(f"File {file.name} failed to process"))
+                return
+
+        now = loop.time()
+        if now >= entry["deadline"]:
+            self._resolve(name, error=Exception(f"File {name} was not ready after {self.timeout}s"))
+            return
+        entry["delay"] = min(self.max_delay, entry["delay"] * self.factor)
+        entry["next_poll"] = now + self._jittered(entry["delay"])
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            # Drop files nobody is waiting for anymore (cancelled requests)
+            for name in [n for n, e in self._pending.items() if all(f.done() for f in e["futures"])]:
+                del self._pending[name]
+
+            now = loop.time()
+            due = [name for name, entry in self._pending.items() if entry["next_poll"] <= now]
+            if due:
+                await asyncio.gather(*(self._poll(name) for name in due))
+            if not self._pending:
+                break
+
+            sleep_for = min(entry["next_poll"] for entry in self._pending.values()) - loop.time()
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, sleep_for))
+            except asyncio.TimeoutError:
+                pass
+
+
+_readiness_coordinator = None
+
+
+def get_readiness_coordinator() -> FileReadinessCoordinator:
+    global _readiness_coordinator
+    if _readiness_coordinator is None:
+        _readiness_coordinator = FileReadinessCoordinator()
+    return _readiness_coordinator
+
+
+async def wait_for_files_active_async(files):
+    """Waits until all given Gemini files are ACTIVE; total time is the slowest file, not the sum."""
+    pending = [f for f in files if getattr(getattr(f, "state", None), "name", None) != "ACTIVE"]
+    if not pending:
+        return
+    print(f"Waiting for processing of {len(pending)} file(s)...")
+    coordinator = get_readiness_coordinator()
+    await asyncio.gather(*(coordinator.wait(f.name) for f in pending))
+    print("...all files ready")
+
+
+async def upload_and_wait_async(path: str, mime_type: str = None):
+    """Uploads a file and returns it once Gemini has finished processing it."""
+    g_file = await upload_file_async(path, mime_type)
+    await wait_for_files_active_async([g_file])
+    return g_file
+
+
+_inflight_uploads = {}
+# Remote file name -> requests using it (between upload_file_cached and release_file_async)
+_in_use = Counter()
+
+
+def _unuse(name: str) -> int:
+    """Drops one use of `name`; returns how many remain."""
+    _in_use[name] -= 1
+    if _in_use[name] <= 0:
+        del _in_use[name]
+        return 0
+    return _in_use[name]
+
+
+async def _upload_and_register(path: str, mime_type: str, sha256: str):
+    g_file = await upload_and_wait_async(path, mime_type)
+    for name in file_cache.put(sha256, g_file):
+        if _in_use[name]:
+            # No longer cached, so the last release_file_async deletes it
+            print(f"Upload cache: evicted remote file {name}; deleting it once it is released")
+            continue
+        print(f"Upload cache: evicting remote file {name}")
+        await delete_file_async(name)
+    return g_file
+
+
+async def upload_file_cached(path: str, mime_type: str = None, sha256: str = None):
+    """
+    Content-addressed upload: returns an ACTIVE Gemini file for the bytes at
+    `path`, reusing a still-valid remote copy of identical content when one
+    exists. Concurrent requests for the same content share one upload.
+    Pair every call with `release_file_async`: a file in use is never
+    deleted by a cache eviction.
+    """
+    if not GEMINI_FILE_CACHE_ENABLED:
+        g_file = await upload_and_wait_async(path, mime_type)
+        _in_use[g_file.name] += 1
+        return g_file
+
+    if sha256 is None:
+        sha256 = await _run_blocking(sha256_file, path)
+
+    if sha256 in _inflight_uploads:
+        g_file = await asyncio.shield(_inflight_uploads[sha256])
+        _in_use[g_file.name] += 1
+        return g_file
+
+    entry = file_cache.get(sha256)
+    if entry:
+        # Taken before the lookup, so an eviction meanwhile leaves it alone
+        _in_use[entry["name"]] += 1
+        try:
+            g_file = await get_file_async(entry["name"])
+            if g_file.state.name == "ACTIVE":
+                print(f"Upload cache hit: {os.path.basename(path)} -> {g_file.name}")
+                return g_file
+        except Exception as e:
+            print(f"Upload cache: remote file {entry['name']} is gone ({e})")
+        _unuse(entry["name"])
+        file_cache.discard(sha256)
+
+    task = asyncio.create_task(_upload_and_register(path, mime_type, sha256))
+    _inflight_uploads[sha256] = task
+    try:
+        g_file = await asyncio.shield(task)
+        _in_use[g_file.name] += 1
+        return g_file
+    finally:
+        if task.done():
+            _inflight_uploads.pop(sha256, None)
+        else:
+            task.add_done_callback(lambda _: _inflight_uploads.pop(sha256, None))
+
+
+async def release_file_async(g_file):
+    """Done with a file: deletes it once no request uses it, unless the upload cache keeps it for reuse."""
+    if _unuse(g_file.name):
+        return
+    if GEMINI_FILE_CACHE_ENABLED and file_cache.owns(g_file.name):
+        return
+    await delete_file_async(g_file.name)
+
+
+async def delete_file_async(name: str):
+    """Best-effort delete of a remote Gemini file."""
+    try:
+        await _run_blocking(genai.delete_file, name)
+    except Exception as e:
+        print(f"⚠️ Failed to delete Gemini file {name}: {e}")
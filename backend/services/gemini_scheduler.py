@@ -0,0 +1,399 @@
+import os
+import time
+import asyncio
+import contextvars
+from collections import OrderedDict, deque
+import google.generativeai as genai
+from .prompt_cache import prompt_cache
+from .video_splitter import VIDEO_TOKENS_PER_FRAME, VIDEO_TOKENS_PER_SECOND, AUDIO_TOKENS_PER_SECOND
+from . import resilience
+from .resilience import RATE_LIMITED, TRANSIENT, CALL_TIMEOUT, TRANSIENT_RETRIES, CircuitOpenError
+
+# Per-model quotas. Override with e.g.
+#   GEMINI_RPM_LIMITS="gemini-2.5-pro=150,gemini-2.5-flash=1000"
+#   GEMINI_TPM_LIMITS="gemini-2.5-pro=2000000"
+DEFAULT_RPM_LIMITS = {"gemini-2.5-pro": 150, "gemini-2.5-flash": 1000, "gemini-2.5-flash-lite": 4000}
+DEFAULT_TPM_LIMITS = {"gemini-2.5-pro": 2_000_000, "gemini-2.5-flash": 1_000_000, "gemini-2.5-flash-lite": 4_000_000}
+FALLBACK_RPM = 60
+FALLBACK_TPM = 1_000_000
+
+# How often a 429 is re-queued before it is surfaced to the caller
+RATE_LIMIT_RETRIES = int(os.environ.get("GEMINI_RATE_LIMIT_RETRIES", "4"))
+RATE_LIMIT_COOLDOWN = 20.0
+
+# Rough media token costs used to pre-charge the TPM bucket before the call.
+# The real usage from the response is settled afterwards. Video and audio
+# rates come from services/video_splitter.py; an image costs one frame.
+IMAGE_TOKENS = VIDEO_TOKENS_PER_FRAME
+DEFAULT_FILE_TOKENS = 2000
+
+# Which request (job) a generate call belongs to, for round-robin fairness
+request_owner = contextvars.ContextVar("request_owner", default="default")
+
+
+def _parse_limits(env_name: str, defaults: dict) -> dict:
+    limits = dict(defaults)
+    for item in os.environ.get(env_name, "").split(","):
+        if "=" in item:
+            model, value = item.split("=", 1)
+            try:
+                limits[model.strip()] = int(value)
+            except ValueError:
+                print(f"⚠️ Ignoring invalid {env_name} entry: {item}")
+    return limits
+
+
+RPM_LIMITS = _parse_limits("GEMINI_RPM_LIMITS", DEFAULT_RPM_LIMITS)
+TPM_LIMITS = _parse_limits("GEMINI_TPM_LIMITS", DEFAULT_TPM_LIMITS)
+
+
+def set_request_owner(owner: str):
+    """Tags all generate calls made from the current task (and its children) with `owner`."""
+    request_owner.set(owner)
+
+
+class TokenBucket:
+    """Continuous-refill token bucket. `level` may go negative after settling an underestimate."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        self._refill()
+        self.level = min(self.capacity, self.level - delta)
+
+
+class _ModelLane:
+    """Queue + buckets for one model. Waiters are served round-robin across owners."""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.rpm = TokenBucket(RPM_LIMITS.get(model_name, FALLBACK_RPM))
+        self.tpm = TokenBucket(TPM_LIMITS.get(model_name, FALLBACK_TPM))
+        self.queues = OrderedDict()
+        self.cooldown_until = 0.0
+        self.dispatcher = None
+        self.wake = asyncio.Event()
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def _next_waiter(self):
+        while self.queues:
+            owner, queue = next(iter(self.queues.items()))
+            future, tokens = queue.popleft()
+            if queue:
+                self.queues.move_to_end(owner)
+            else:
+                del self.queues[owner]
+            if not future.done():
+                return future, tokens
+        return None
+
+    async def _dispatch(self):
+        while True:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            future, tokens = waiter
+            while True:
+                delay = max(
+                    self.rpm.time_until(1),
+                    self.tpm.time_until(tokens),
+                    self.cooldown_until - time.monotonic(),
+                )
+                if delay <= 0:
+                    break
+                # A 429 elsewhere may extend the cooldown, so re-check after waking
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            if future.done():
+                continue
+            self.rpm.consume(1)
+            self.tpm.consume(tokens)
+            future.set_result(None)
+
+    async def acquire(self, owner: str, tokens: int):
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(owner, deque()).append((future, tokens))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+
+class GenerationScheduler:
+    """Process-wide admission control for Gemini generate calls (RPM + TPM per model)."""
+
+    def __init__(self):
+        self.lanes = {}
+
+    def lane(self, model_name: str) -> _ModelLane:
+        if model_name not in self.lanes:
+            self.lanes[model_name] = _ModelLane(model_name)
+        return self.lanes[model_name]
+
+    async def acquire(self, model_name: str, tokens: int):
+        await self.lane(model_name).acquire(request_owner.get(), tokens)
+
+    def settle(self, model_name: str, estimated: int, actual: int):
+        """Corrects the TPM bucket once the real token usage is known."""
+        self.lane(model_name).tpm.adjust(actual - estimated)
+
+    def penalize(self, model_name: str, seconds: float):
+        """Pauses a model lane after the API reported quota exhaustion."""
+        lane = self.lane(model_name)
+        lane.cooldown_until = max(lane.cooldown_until, time.monotonic() + seconds)
+        lane.wake.set()
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "queued": lane.queued(),
+                "rpm_available": round(lane.rpm.level, 1),
+                "tpm_available": int(lane.tpm.level),
+                "cooling_down": lane.cooldown_until > time.monotonic(),
+            }
+            for name, lane in self.lanes.items()
+        }
+
+
+scheduler = GenerationScheduler()
+
+
+def _file_tokens(part) -> int:
+    mime = getattr(part, "mime_type", "") or ""
+    video_metadata = getattr(part, "video_metadata", None)
+    duration = getattr(video_metadata, "video_duration", None) if video_metadata else None
+    seconds = getattr(duration, "seconds", None) if duration is not None else None
+    if mime.startswith("video/") and seconds:
+        return int(seconds * VIDEO_TOKENS_PER_SECOND)
+    if mime.startswith("image/"):
+        return IMAGE_TOKENS
+    size = getattr(part, "size_bytes", 0) or 0
+    if mime.startswith("audio/") and size:
+        # ~16 kB per second of compressed speech
+        return int(size / 16000 * AUDIO_TOKENS_PER_SECOND)
+    if mime.startswith("video/") and size:
+        # ~250 kB per second of screen recording
+        return int(size / 250000 * VIDEO_TOKENS_PER_SECOND)
+    return DEFAULT_FILE_TOKENS
+
+
+def estimate_tokens(contents) -> int:
+    """Cheap local estimate of the input tokens of a generate request."""
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    total = 0
+    for part in contents:
+        if isinstance(part, str):
+            total += len(part) // 4
+        else:
+            total += _file_tokens(part)
+    return max(total, 1)
+
+
+async def _rate_limit_cooldown(model_name: str, attempt: int):
+    cooldown = RATE_LIMIT_COOLDOWN * attempt
+    print(f"⚠️ {model_name} rate limited (attempt {attempt}/{RATE_LIMIT_RETRIES}). Cooling down {cooldown}s.")
+    scheduler.penalize(model_name, cooldown)
+
+
+async def _transient_backoff(model_name: str, attempt: int, error: Exception):
+    delay = resilience.backoff_delay(attempt)
+    print(f"⚠️ {model_name} call failed ({str(error) or type(error).__name__}); retry {attempt + 1}/{TRANSIENT_RETRIES} in {delay:.1f}s.")
+    await asyncio.sleep(delay)
+
+
+async def _call_with_policy(model_name: str, contents: list, prefix: list, attempt, timeout: float,
+                            hedge: bool, fall_back=None):
+    """
+    Runs `attempt(model, request, hedge_after, paid)` until it succeeds, under
+    the shared policy: budget from the scheduler, a deadline per attempt,
+    429s re-queued, transient failures retried with backoff behind the
+    circuit breaker. `paid(call)` runs `call` after paying for one more
+    request (for hedged duplicates). `attempt` returns (response, result).
+    `fall_back(reason)`, when given, is awaited instead of waiting out a
+    model that can't serve.
+    """
+    estimated = estimate_tokens(prefix + contents)
+    model = await prompt_cache.get_model(model_name, prefix) if prefix else None
+    using_cache = model is not None
+    if not using_cache:
+        model = genai.GenerativeModel(model_name=model_name)
+
+    async def paid(call):
+        await scheduler.acquire(model_name, estimated)
+        return await call()
+
+    circuit = resilience.breaker(model_name)
+    rate_attempt = transient_attempt = 0
+    while True:
+        try:
+            circuit.check()
+        except CircuitOpenError:
+            if fall_back:
+                return await fall_back("circuit is open")
+            raise
+        await scheduler.acquire(model_name, estimated)
+        request = contents if using_cache else prefix + contents
+        hedge_after = resilience.latency(model_name).percentile(resilience.HEDGE_PERCENTILE) \
+            if hedge and resilience.HEDGING_ENABLED else None
+        started = time.monotonic()
+        try:
+            response, result = await asyncio.wait_for(attempt(model, request, hedge_after, paid), timeout)
+        except asyncio.CancelledError:
+            circuit.release_probe()
+            raise
+        except Exception as e:
+            kind = resilience.classify(e)
+            if kind == TRANSIENT:
+                circuit.record_failure()
+                if transient_attempt >= TRANSIENT_RETRIES:
+                    if fall_back:
+                        return await fall_back("keeps failing")
+                    raise
+                await _transient_backoff(model_name, transient_attempt, e)
+                transient_attempt += 1
+                continue
+            circuit.release_probe()
+            if kind == RATE_LIMITED:
+                if fall_back:
+                    # Still cool the lane down so other callers move as well
+                    scheduler.penalize(model_name, RATE_LIMIT_COOLDOWN)
+                    return await fall_back("is out of quota")
+                if rate_attempt >= RATE_LIMIT_RETRIES:
+                    raise
+                rate_attempt += 1
+                await _rate_limit_cooldown(model_name, rate_attempt)
+                continue
+            if using_cache:
+                # Cached handle rejected (expired/deleted server-side): fall back to inline
+                print(f"⚠️ Cached prompt rejected for {model_name} ({e}). Retrying inline.")
+                prompt_cache.invalidate(model_name, prefix)
+                model = genai.GenerativeModel(model_name=model_name)
+                using_cache = False
+                continue
+            raise
+
+        circuit.record_success()
+        resilience.latency(model_name).record(time.monotonic() - started)
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "prompt_token_count", 0) if usage else 0
+        if actual:
+            scheduler.settle(model_name, estimated, actual)
+        return result
+
+
+async def generate_content(model_name: str, contents, cached_prefix: list = None, timeout: float = CALL_TIMEOUT,
+                           hedge: bool = False, fallback_model: str = None, **kwargs):
+    """
+    Drop-in replacement for `GenerativeModel(model_name).generate_content_async(contents)`
+    that waits for RPM/TPM budget first, re-queues on 429 and retries
+    transient failures with backoff (see services/resilience.py).
+
+    `cached_prefix` holds the static leading parts of the request (big
+    prompts, shared context files). They are served from a model-side
+    context cache when possible and sent inline otherwise.
+    `timeout` bounds each attempt; with `hedge`, an attempt running past the
+    model's usual latency gets a duplicate racing it. With `fallback_model`,
+    quota exhaustion or an unavailable model moves the call there instead of
+    waiting (see services/model_policy.py).
+    """
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    contents = list(contents)
+
+    async def attempt(model, request, hedge_after, paid):
+        call = lambda: model.generate_content_async(request, **kwargs)
+        response = await resilience.hedged(call, hedge_after, lambda: paid(call))
+        return response, response
+
+    def fall_back(reason: str):
+        print(f"⚠️ {model_name} {reason}. Falling back to {fallback_model}.")
+        return generate_content(fallback_model, contents, cached_prefix, timeout=timeout, hedge=hedge, **kwargs)
+
+    return await _call_with_policy(model_name, contents, list(cached_prefix or []), attempt, timeout, hedge,
+                                   fall_back if fallback_model else None)
+
+
+def _chunk_text(chunk) -> str:
+    try:
+        return chunk.text
+    except ValueError:
+        return ""  # Chunk with only finish/safety metadata
+
+
+async def generate_content_stream(model_name: str, contents, cached_prefix: list = None, on_text=None,
+                                  timeout: float = CALL_TIMEOUT, hedge: bool = False, fallback_model: str = None,
+                                  **kwargs) -> str:
+    """
+    Streaming variant of `generate_content`, with the same retries, deadline,
+    breaker and fallback: `on_text(delta)` is called for every piece of text
+    as the model produces it, and the full text is returned at the end. When
+    an attempt fails after forwarding text, `on_text("", reset=True)` tells
+    the receiver to drop it before the retry streams again. With `hedge`, a
+    stream slow to produce its first piece gets a duplicate racing it.
+    """
+    if not isinstance(contents, (list, tuple)):
+        contents = [contents]
+    contents = list(contents)
+    forwarded = False
+
+    def reset_preview():
+        nonlocal forwarded
+        if forwarded:
+            on_text("", reset=True)
+            forwarded = False
+
+    async def attempt(model, request, hedge_after, paid):
+        nonlocal forwarded
+        reset_preview()
+
+        async def open_stream():
+            response = await model.generate_content_async(request, stream=True, **kwargs)
+            chunks = response.__aiter__()
+            return response, chunks, await anext(chunks, None)
+
+        # Only the wait for the first piece is hedged; the winner streams alone
+        response, chunks, chunk = await resilience.hedged(open_stream, hedge_after, lambda: paid(open_stream))
+        pieces = []
+        while chunk is not None:
+            text = _chunk_text(chunk)
+            if text:
+                pieces.append(text)
+                if on_text:
+                    forwarded = True
+                    on_text(text)
+            chunk = await anext(chunks, None)
+        return response, "".join(pieces)
+
+    def fall_back(reason: str):
+        reset_preview()
+        print(f"⚠️ {model_name} {reason}. Falling back to {fallback_model}.")
+        return generate_content_stream(fallback_model, contents, cached_prefix, on_text=on_text, timeout=timeout,
+                                       hedge=hedge, **kwargs)
+
+    return await _call_with_policy(model_name, contents, list(cached_prefix or []), attempt, timeout, hedge,
+                                   fall_back if fallback_model else None)
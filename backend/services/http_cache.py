@@ -0,0 +1,126 @@
+import os
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Optional
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli  # Optional: `pip install brotli` adds br to the negotiated encodings
+except ImportError:
+    brotli = None
+
+# Conditional requests and compression for the document endpoints. Stored
+# versions (Company_Process_vN.md) never change once written, so they get a
+# strong ETag from their content hash and `immutable`; the browser keeps
+# them and revalidates (304) everything else. Compressed bodies of
+# immutable versions are kept in a small LRU, so each is compressed once.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+MIN_COMPRESS_BYTES = int(os.environ.get("HTTP_MIN_COMPRESS_BYTES", "1024"))
+COMPRESSED_CACHE_ENTRIES = int(os.environ.get("HTTP_COMPRESSED_CACHE_ENTRIES", "128"))
+
+
+def make_etag(digest: str, variant: str = "") -> str:
+    """Strong ETag from a hex content hash; `variant` tells representations of the same content apart."""
+    return f'"{digest[:32]}{"-" + variant if variant else ""}"'
+
+
+def etag_for(body: bytes, variant: str = "") -> str:
+    return make_etag(hashlib.sha256(body).hexdigest(), variant)
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """True when the client's If-None-Match already names this ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in tags
+
+
+def negotiate_encoding(request: Request) -> Optional[str]:
+    accepted = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, 0) > 0:
+            return encoding
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class _CompressedCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+_compressed = _CompressedCache(COMPRESSED_CACHE_ENTRIES)
+
+
+def _headers(etag: str, cache_control: str, last_modified: Optional[float]) -> dict:
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if last_modified:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def not_modified_response(etag: str, cache_control: str, last_modified: Optional[float] = None) -> Response:
+    return Response(status_code=304, headers=_headers(etag, cache_control, last_modified))
+
+
+def cached_response(request: Request, body: bytes, media_type: str, etag: str = None,
+                    immutable: bool = False, last_modified: Optional[float] = None) -> Response:
+    """
+    `body` as a cacheable response: 304 when the client has it, otherwise
+    compressed with the best encoding the client accepts.
+    """
+    etag = etag or etag_for(body)
+    cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    if not_modified(request, etag):
+        return not_modified_response(etag, cache_control, last_modified)
+
+    headers = _headers(etag, cache_control, last_modified)
+    encoding = negotiate_encoding(request) if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding:
+        if immutable:
+            body = _compressed.get((etag, encoding), lambda: _compress(body, encoding))
+        else:
+            body = _compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
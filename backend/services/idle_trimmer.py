@@ -0,0 +1,220 @@
+import os
+import re
+import json
+import asyncio
+import subprocess
+from .video_splitter import probe_video, get_keyframe_times
+
+# Screen recordings spend long stretches on a static screen while the
+# operator reads or waits. Those stretches are cut out before upload; a
+# time map keeps evidence timestamps traceable to the original recording.
+IDLE_TRIM_ENABLED = os.environ.get("IDLE_TRIM_ENABLED", "1") == "1"
+IDLE_MIN_SECONDS = float(os.environ.get("IDLE_MIN_SECONDS", "20"))
+# Frame difference below this counts as "frozen" (freezedetect noise level)
+IDLE_FREEZE_NOISE = os.environ.get("IDLE_FREEZE_NOISE", "-60dB")
+# Audio below this counts as silence; frozen-but-talking stretches are kept
+IDLE_SILENCE_NOISE = os.environ.get("IDLE_SILENCE_NOISE", "-45dB")
+# Seconds of every idle stretch that stay in, so the model still sees the screen
+IDLE_KEEP_SECONDS = float(os.environ.get("IDLE_KEEP_SECONDS", "2"))
+# Skip the rewrite when it would remove less than this share of the video
+IDLE_MIN_SAVINGS = float(os.environ.get("IDLE_MIN_SAVINGS", "0.1"))
+
+_FREEZE_RE = re.compile(r"freeze_(start|end): ([\d.]+)")
+_SILENCE_RE = re.compile(r"silence_(start|end): ([\d.]+)")
+# The SOP prompt asks for video positions as "[video m:ss]" / "[video h:mm:ss]"
+_TIMESTAMP_RE = re.compile(r"\[video (?:(\d{1,2}):)?(\d{1,2}):(\d{2})\]", re.IGNORECASE)
+
+
+def _parse_spans(pattern, stderr: str, duration: float) -> list[tuple[float, float]]:
+    spans = []
+    start = None
+    for kind, value in pattern.findall(stderr):
+        if kind == "start":
+            start = float(value)
+        elif start is not None:
+            spans.append((start, float(value)))
+            start = None
+    if start is not None:
+        # Still frozen / silent at end of file
+        spans.append((start, duration))
+    return spans
+
+
+def _intersect(a: list[tuple[float, float]], b: list[tuple[float, float]]) -> list[tuple[float, float]]:
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if end > start:
+            result.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def detect_idle_spans(video_path: str, info: dict = None) -> list[tuple[float, float]]:
+    """
+    Returns (start, end) spans of at least IDLE_MIN_SECONDS where the picture
+    is frozen and (if the video has audio) nobody is speaking.
+    Both detectors run in a single decode pass.
+    """
+    info = info or probe_video(video_path)
+    cmd = [
+        "ffmpeg", "-hide_banner", "-nostats",
+        "-i", video_path,
+        "-map", "0:v:0",
+        "-vf", f"freezedetect=n={IDLE_FREEZE_NOISE}:d={IDLE_MIN_SECONDS}",
+    ]
+    if info["has_audio"]:
+        cmd += ["-map", "0:a:0", "-af", f"silencedetect=n={IDLE_SILENCE_NOISE}:d={IDLE_MIN_SECONDS}"]
+    cmd += ["-f", "null", "-"]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    frozen = _parse_spans(_FREEZE_RE, result.stderr, info["duration"])
+    if not info["has_audio"]:
+        return frozen
+    silent = _parse_spans(_SILENCE_RE, result.stderr, info["duration"])
+    return [(s, e) for s, e in _intersect(frozen, silent) if e - s >= IDLE_MIN_SECONDS]
+
+
+def build_keep_segments(duration: float, idle_spans: list[tuple[float, float]], keyframes: list[float]) -> list[tuple[float, float]]:
+    """Complement of the idle spans, starting every kept segment on a keyframe so stream copy is exact."""
+    keep = []
+    cursor = 0.0
+    for start, end in idle_spans:
+        # Keep the first moments of the idle stretch
+        cut_start = max(cursor, start + IDLE_KEEP_SECONDS)
+        # Resume on the last keyframe before activity starts again
+        resume_points = [k for k in keyframes if cut_start < k <= end] if keyframes else [end]
+        if not resume_points:
+            continue  # No keyframe to resume on: leave this stretch in
+        keep.append((cursor, cut_start))
+        cursor = resume_points[-1]
+    if cursor < duration:
+        keep.append((cursor, duration))
+    return [(s, e) for s, e in keep if e - s > 0.05]
+
+
+def build_time_map(keep: list[tuple[float, float]]) -> list[dict]:
+    """Maps positions in the trimmed video back to the original one."""
+    time_map = []
+    trimmed = 0.0
+    for start, end in keep:
+        time_map.append({"trimmed_start": round(trimmed, 3), "original_start": round(start, 3), "duration": round(end - start, 3)})
+        trimmed += end - start
+    return time_map
+
+
+def to_original_time(t: float, time_map: list[dict]) -> float:
+    """Converts a time in the trimmed video to the matching time in the original recording."""
+    if not time_map:
+        return t
+    for entry in time_map:
+        if t < entry["trimmed_start"] + entry["duration"]:
+            return entry["original_start"] + max(0.0, t - entry["trimmed_start"])
+    last = time_map[-1]
+    return last["original_start"] + (t - last["trimmed_start"])
+
+
+def _format_timestamp(seconds: float) -> str:
+    seconds = int(round(seconds))
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m}:{s:02d}"
+
+
+def remap_timestamps(text: str, offset: float = 0.0, time_map: list[dict] = None) -> str:
+    """
+    Rewrites video timestamps in a chunk's SOP (relative to the chunk) into
+    positions in the original recording: chunk offset first, then the idle
+    trim map. Only the explicit "[video m:ss]" markers are touched, so times
+    of day, cut-offs and durations stay as they are.
+    """
+    if not offset and not time_map:
+        return text
+
+    def replace(match):
+        hours, minutes, secs = match.groups()
+        t = int(hours or 0) * 3600 + int(minutes) * 60 + int(secs)
+        return f"[video {_format_timestamp(to_original_time(offset + t, time_map or []))}]"
+
+    return _TIMESTAMP_RE.sub(replace, text)
+
+
+def _concat_keep_segments(video_path: str, keep: list[tuple[float, float]], output_path: str):
+    list_path = output_path + ".ffconcat"
+    escaped = os.path.abspath(video_path).replace("'", "'\\''")
+    with open(list_path, "w") as f:
+        f.write("ffconcat version 1.0\n")
+        for start, end in keep:
+            f.write(f"file '{escaped}'\ninpoint {start:.3f}\noutpoint {end:.3f}\n")
+    try:
+        cmd = [
+            "ffmpeg",
+            "-f", "concat", "-safe", "0",
+            "-i", list_path,
+            "-map", "0",
+            "-c", "copy",  # No re-encode; segments start on keyframes
+            "-y",
+            output_path
+        ]
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    finally:
+        os.remove(list_path)
+
+
+def trim_idle_segments(video_path: str, output_dir: str) -> dict:
+    """
+    Removes long frozen + silent stretches from a recording.
+    Returns {"path", "time_map", "original_duration", "trimmed_duration", "removed_seconds"};
+    "path" is the input itself (and "time_map" empty) when nothing worth trimming was found.
+    """
+    info = probe_video(video_path)
+    result = {
+        "path": video_path,
+        "time_map": [],
+        "original_duration": info["duration"],
+        "trimmed_duration": info["duration"],
+        "removed_seconds": 0.0,
+    }
+    if not IDLE_TRIM_ENABLED or info["duration"] < IDLE_MIN_SECONDS * 2:
+        return result
+
+    idle_spans = detect_idle_spans(video_path, info)
+    if not idle_spans:
+        return result
+
+    keep = build_keep_segments(info["duration"], idle_spans, get_keyframe_times(video_path))
+    kept = sum(e - s for s, e in keep)
+    removed = info["duration"] - kept
+    if removed < info["duration"] * IDLE_MIN_SAVINGS:
+        print(f"Idle trim: only {removed:.0f}s idle in {os.path.basename(video_path)}, keeping as is.")
+        return result
+
+    os.makedirs(output_dir, exist_ok=True)
+    base_name, ext = os.path.splitext(os.path.basename(video_path))
+    output_path = os.path.join(output_dir, f"{base_name}_active{ext}")
+    _concat_keep_segments(video_path, keep, output_path)
+
+    time_map = build_time_map(keep)
+    with open(output_path + ".timemap.json", "w") as f:
+        json.dump({"source": video_path, "time_map": time_map}, f)
+
+    print(f"Idle trim: removed {removed:.0f}s of {info['duration']:.0f}s from {os.path.basename(video_path)}.")
+    result.update({
+        "path": output_path,
+        "time_map": time_map,
+        "trimmed_duration": kept,
+        "removed_seconds": round(removed, 2),
+    })
+    return result
+
+
+async def trim_videos_async(video_paths: list[str], output_dir: str) -> list[dict]:
+    """Runs idle trimming for several videos concurrently, outside the event loop."""
+    return list(await asyncio.gather(*(
+        asyncio.to_thread(trim_idle_segments, path, output_dir) for path in video_paths
+    )))
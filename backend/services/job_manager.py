@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import weakref
+from typing import Optional
+
+# How many analyses may run their pipeline at the same time on this worker.
+# Extra jobs wait in "queued" state instead of piling onto Gemini at once.
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", "4"))
+# Finished jobs are kept around so clients can still poll the result.
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))
+SSE_KEEPALIVE_SECONDS = 15
+
+TERMINAL_STATES = ("completed", "failed")
+
+_jobs: dict = {}
+_job_slots: Optional[asyncio.Semaphore] = None
+
+
+class Job:
+    """In-memory record of one background analysis and its progress events."""
+
+    def __init__(self, kind: str = "analyze", meta: Optional[dict] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = "queued"
+        self.stage = "queued"
+        self.message = "Waiting for a free worker slot"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.events = []
+        self.partial_text = ""
+        self.task = None
+        self._subscribers = []
+
+    def emit(self, stage: str, message: str = "", **data):
+        """Records a progress event and fans it out to live SSE subscribers."""
+        self.stage = stage
+        if message:
+            self.message = message
+        if data:
+            self.progress.update(data)
+        self.updated_at = time.time()
+
+        event = {
+            "type": "progress",
+            "stage": stage,
+            "message": message,
+            "data": data,
+            "ts": self.updated_at,
+        }
+        self._publish(event)
+
+    def stream_text(self, delta: str = "", reset: bool = False):
+        """
+        Appends model output to the live preview and pushes it to subscribers.
+        Deltas are not kept in the replay log; a reconnecting client gets one
+        snapshot of `partial_text` instead.
+        """
+        if reset:
+            self.partial_text = ""
+        event = {"type": "delta", "offset": len(self.partial_text), "text": delta, "reset": reset}
+        self.partial_text += delta
+        for queue in list(self._subscribers):
+            queue.put_nowait(event)
+
+    def _publish(self, event: dict):
+        event["seq"] = len(self.events)
+        self.events.append(event)
+        for queue in list(self._subscribers):
+            queue.put_nowait(event)
+
+    def _finish(self, status: str, result=None, error: Optional[str] = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.stage = status
+        self.updated_at = time.time()
+        self._publish({
+            "type": status,
+            "stage": status,
+            "message": error or "",
+            "data": {"result": result} if result is not None else {},
+            "ts": self.updated_at,
+        })
+
+    def to_dict(self, include_events: bool = False) -> dict:
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "message": self.message,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "partial_text": self.partial_text if self.status not in TERMINAL_STATES else "",
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+        if include_events:
+            data["events"] = self.events
+        return data
+
+
+def _slots() -> asyncio.Semaphore:
+    # Created lazily so it binds to the running event loop.
+    global _job_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+    return _job_slots
+
+
+def _prune_jobs():
+    now = time.time()
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job.status in TERMINAL_STATES and now - job.updated_at > JOB_TTL_SECONDS
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def create_job(kind: str = "analyze", meta: Optional[dict] = None) -> Job:
+    _prune_jobs()
+    job = Job(kind, meta)
+    _jobs[job.id] = job
+    return job
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    return _jobs.get(job_id)
+
+
+def start_job(job: Job, coro_factory) -> asyncio.Task:
+    """
+    Runs `coro_factory(job)` in the background once a worker slot is free.
+    The coroutine's return value becomes the job result.
+    """
+    async def runner():
+        async with _slots():
+            job.status = "running"
+            job.emit("started", "Analysis started")
+            try:
+                result = await coro_factory(job)
+                job._finish("completed", result=result)
+            except Exception as e:
+                print(f"❌ Job {job.id} failed: {e}")
+                job._finish("failed", error=str(e))
+
+    # The event loop only keeps weak references to tasks
+    job.task = asyncio.create_task(runner())
+    _running.add(job.task)
+    job.task.add_done_callback(_running.discard)
+    return job.task
+
+
+_running = set()
+# One lock per key, alive while some job holds or waits for it
+_key_locks = weakref.WeakValueDictionary()
+
+
+def key_lock(key: str) -> asyncio.Lock:
+    """
+    Serializes the jobs that share `key` (e.g. the chunks of one extension
+    session, which load, merge and save the same SOP). Waiters run in order.
+    """
+    lock = _key_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _key_locks[key] = lock
+    return lock
+
+
+def _format_sse(event: dict) -> str:
+    if event["type"] == "delta":
+        # No id: text deltas must not move the client's Last-Event-ID
+        return f"event: delta\ndata: {json.dumps(event)}\n\n"
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+
+async def stream_job_events(job: Job, last_event_id: int = -1):
+    """Async generator of SSE frames: replays past events, then follows live ones."""
+    queue: asyncio.Queue = asyncio.Queue()
+    job._subscribers.append(queue)
+    try:
+        for event in list(job.events):
+            if event["seq"] > last_event_id:
+                last_event_id = event["seq"]
+                yield _format_sse(event)
+        if job.status in TERMINAL_STATES:
+            return
+        # Text streamed so far, as one snapshot; queued deltas it already covers are skipped
+        text_pos = len(job.partial_text)
+        if text_pos:
+            yield _format_sse({"type": "delta", "offset": 0, "text": job.partial_text, "reset": True})
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event["type"] == "delta":
+                if not event["reset"] and event["offset"] < text_pos:
+                    continue
+                text_pos = event["offset"] + len(event["text"])
+                yield _format_sse(event)
+                continue
+            if event["seq"] <= last_event_id:
+                continue
+            last_event_id = event["seq"]
+            yield _format_sse(event)
+            if event["type"] in TERMINAL_STATES:
+                return
+    finally:
+        job._subscribers.remove(queue)
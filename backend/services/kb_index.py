@@ -0,0 +1,250 @@
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from typing import Optional
+
+# SQLite index over the local knowledge base, so "latest version of X",
+# the document list and the process identifiers are indexed queries
+# instead of walking (and opening) every stored version. It is updated in
+# the same step as each save and can be rebuilt from the files at any time:
+#   python -m services.kb_index rebuild
+KB_DIR = "knowledge_base"
+KB_INDEX_ENABLED = os.environ.get("KB_INDEX_ENABLED", "1") == "1"
+KB_INDEX_PATH = os.environ.get("KB_INDEX_PATH", os.path.join(KB_DIR, "kb_index.sqlite"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    company TEXT NOT NULL,
+    process TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    filename TEXT NOT NULL,
+    created REAL NOT NULL,
+    processing_time REAL NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    sha256 TEXT,
+    PRIMARY KEY (company, process, version)
+);
+CREATE INDEX IF NOT EXISTS versions_created ON versions (created DESC);
+"""
+
+
+def parse_version_filename(company: str, filename: str):
+    """'Acme_Billing_v3.md' in folder 'Acme' -> ('Billing', 3); None for anything else."""
+    if not filename.endswith(".md") or "_v" not in filename:
+        return None
+    base, version = filename[:-3].rsplit("_v", 1)
+    try:
+        version = int(version)
+    except ValueError:
+        return None
+    process = base[len(company) + 1:] if base.startswith(f"{company}_") else base
+    return process, version
+
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+class KBIndex:
+    """One SQLite file; a single connection guarded by a lock (writes are tiny and rare)."""
+
+    def __init__(self, kb_dir: str = KB_DIR, path: str = KB_INDEX_PATH):
+        self.kb_dir = kb_dir
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            is_new = not os.path.exists(self.path)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            if is_new and os.path.isdir(self.kb_dir):
+                # First use on an existing tree: index what is already there
+                self._rebuild_locked(self.kb_dir)
+        return self._conn
+
+    def latest(self, company: str, process: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT * FROM versions WHERE company = ? AND process = ? ORDER BY version DESC LIMIT 1",
+                (company, process),
+            ).fetchone()
+            return dict(row) if row else None
+
+    def get(self, path: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM versions WHERE path = ?", (path,)).fetchone()
+            return dict(row) if row else None
+
+    def save_version(self, company: str, process: str, company_dir: str, content: str, processing_time: float) -> str:
+        """
+        Allocates the next version number, writes the file and records it in
+        one transaction, so concurrent saves never pick the same version.
+        """
+        data = content.encode("utf-8")
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT MAX(version) FROM versions WHERE company = ? AND process = ?", (company, process)
+                ).fetchone()
+                version = (row[0] or 0) + 1
+                filename = f"{company}_{process}_v{version}.md"
+                file_path = os.path.join(company_dir, filename)
+                while os.path.exists(file_path):
+                    # A version written behind the index's back; never overwrite it
+                    version += 1
+                    filename = f"{company}_{process}_v{version}.md"
+                    file_path = os.path.join(company_dir, filename)
+                with open(file_path, "wb") as f:
+                    f.write(data)
+                conn.execute(
+                    "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (company, process, version, file_path, filename, time.time(), processing_time,
+                     len(data), hashlib.sha256(data).hexdigest()),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return file_path
+
+    def set_stored_size(self, path: str, size: int):
+        """After a version is rewritten as a delta; its content (and hash) are unchanged."""
+        with self._lock:
+            self._connect().execute("UPDATE versions SET size = ? WHERE path = ?", (size, path))
+
+    def list_documents(self) -> list[dict]:
+        """Same shape as the filesystem listing, newest first."""
+        with self._lock:
+            rows = self._connect().execute("SELECT * FROM versions ORDER BY created DESC").fetchall()
+        return [self._document(row) for row in rows]
+
+    def query(self, company: str = None, process: str = None, created_from: float = None, created_to: float = None,
+              latest_only: bool = False, newest_first: bool = True, limit: int = 50, after: tuple = None):
+        """
+        One page of documents. `after` is the (created, path) of the last row of
+        the previous page (keyset pagination, so deep pages cost the same as
+        the first). Returns (documents, last key or None when there is no more).
+        """
+        clauses, params = [], []
+        if company:
+            clauses.append("company = ?")
+            params.append(company)
+        if process:
+            clauses.append("process = ?")
+            params.append(process)
+        if created_from is not None:
+            clauses.append("created >= ?")
+            params.append(created_from)
+        if created_to is not None:
+            clauses.append("created < ?")
+            params.append(created_to)
+        if latest_only:
+            clauses.append("version = (SELECT MAX(v.version) FROM versions v WHERE v.company = versions.company AND v.process = versions.process)")
+        if after:
+            clauses.append(f"(created, path) {'<' if newest_first else '>'} (?, ?)")
+            params.extend(after)
+        order = "DESC" if newest_first else "ASC"
+        sql = (f"SELECT * FROM versions {'WHERE ' + ' AND '.join(clauses) if clauses else ''} "
+               f"ORDER BY created {order}, path {order} LIMIT ?")
+        with self._lock:
+            rows = self._connect().execute(sql, params + [limit + 1]).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        last = (rows[-1]["created"], rows[-1]["path"]) if more and rows else None
+        return [self._document(row) for row in rows], last
+
+    @staticmethod
+    def _document(row) -> dict:
+        return {
+            "id": row["path"],
+            "company": row["company"],
+            "filename": row["filename"],
+            "name": row["process"],
+            "version": f"v{row['version']}",
+            "date": datetime.fromtimestamp(row["created"]).strftime("%Y-%m-%d %H:%M"),
+            "processing_time": row["processing_time"],
+        }
+
+    def process_identifiers(self) -> list[str]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT DISTINCT company, process FROM versions WHERE substr(filename, 1, length(company) + 1) = company || '_'"
+            ).fetchall()
+        return [f"{row['company']}/{row['process']}" for row in rows]
+
+    def _rebuild_locked(self, kb_dir: str) -> int:
+        from .sop_document import parse_storage_header
+        from .version_store import resolve
+
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM versions")
+            count = 0
+            for company in sorted(os.listdir(kb_dir)):
+                company_dir = os.path.join(kb_dir, company)
+                if not os.path.isdir(company_dir):
+                    continue
+                for filename in os.listdir(company_dir):
+                    parsed = parse_version_filename(company, filename)
+                    if not parsed:
+                        continue
+                    path = os.path.join(company_dir, filename)
+                    try:
+                        with open(path, "rb") as f:
+                            data = f.read()
+                        first_line = data.split(b"\n", 1)[0].decode("utf-8", errors="replace")
+                        header = parse_storage_header(first_line)
+                        processing_time = float(header[1]) if header and header[0] == "processing_time" else 0
+                        # The hash is of the version's content, also when it is stored as a delta
+                        content = resolve(path, data.decode("utf-8"), _read_text) or ""
+                    except (OSError, ValueError, LookupError) as e:
+                        # One unreadable file (not UTF-8, broken delta) shouldn't cost the whole index
+                        print(f"⚠️ KB index: skipping {path}: {e}")
+                        continue
+                    conn.execute(
+                        "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (company, parsed[0], parsed[1], path, filename, os.stat(path).st_mtime, processing_time,
+                         len(data), hashlib.sha256(content.encode("utf-8")).hexdigest()),
+                    )
+                    count += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return count
+
+    def rebuild(self, kb_dir: str) -> int:
+        """Re-indexes every version file under `kb_dir`. Returns the number of versions indexed."""
+        with self._lock:
+            self._connect()
+            return self._rebuild_locked(kb_dir)
+
+
+kb_index = KBIndex()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python -m services.kb_index rebuild")
+        sys.exit(1)
+    if not os.path.isdir(KB_DIR):
+        print(f"No knowledge base at {KB_DIR}")
+        sys.exit(1)
+    print(f"Indexed {kb_index.rebuild(KB_DIR)} versions into {KB_INDEX_PATH}")
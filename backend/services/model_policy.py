@@ -0,0 +1,114 @@
+import os
+import time
+from typing import Optional
+from .gemini_scheduler import scheduler
+from . import resilience
+
+# Which model each pipeline stage uses, in one place. Rules are looked up
+# most specific first:
+#   "<stage>:<evidence>"  evidence is "video" or "document"
+#   "<stage>:small"       jobs with at most SMALL_JOB_CHUNKS chunks / partials
+#                         (a merge always has two or more)
+#   "<stage>"
+# Override or add rules with e.g.
+#   GEMINI_STAGE_MODELS="routing=gemini-2.5-flash-lite,merge:small=gemini-2.5-flash"
+#   GEMINI_SMALL_JOB_CHUNKS=3
+# When a model can't serve (quota cooldown after a 429, open circuit) the
+# stage moves to the next faster tier; stages in LOAD_FALLBACK_STAGES also
+# move when the model's queue is backed up. Extraction only falls back when
+# the model is unavailable, so its quality isn't traded for latency.
+DEFAULT_STAGE_MODELS = {
+    "extraction": "gemini-2.5-pro",
+    # A recording of one or two chunks, or a document that's already text,
+    # doesn't need pro's long-context reasoning
+    "extraction:small": "gemini-2.5-flash",
+    "extraction:document": "gemini-2.5-flash",
+    "merge": "gemini-2.5-pro",
+    "merge:small": "gemini-2.5-flash",
+    "section_merge": "gemini-2.5-pro",
+    "update_merge": "gemini-2.5-pro",
+    # Picks a file name from metadata and a short snippet
+    "routing": "gemini-2.5-flash",
+}
+DEFAULT_FALLBACKS = {"gemini-2.5-pro": "gemini-2.5-flash", "gemini-2.5-flash": "gemini-2.5-flash-lite"}
+SMALL_JOB_CHUNKS = int(os.environ.get("GEMINI_SMALL_JOB_CHUNKS", "2"))
+LOAD_QUEUE_DEPTH = int(os.environ.get("GEMINI_LOAD_QUEUE_DEPTH", "8"))
+LOAD_FALLBACK_STAGES = set(filter(None, os.environ.get(
+    "GEMINI_LOAD_FALLBACK_STAGES", "merge,section_merge,update_merge,routing").split(",")))
+
+
+def _parse_models(env_name: str, defaults: dict) -> dict:
+    models = dict(defaults)
+    for item in os.environ.get(env_name, "").split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            models[key.strip()] = value.strip()
+        elif item.strip():
+            print(f"⚠️ Ignoring invalid {env_name} entry: {item}")
+    return models
+
+
+STAGE_MODELS = _parse_models("GEMINI_STAGE_MODELS", DEFAULT_STAGE_MODELS)
+FALLBACKS = _parse_models("GEMINI_MODEL_FALLBACKS", DEFAULT_FALLBACKS)
+
+
+def unavailable(model_name: str) -> bool:
+    """Quota cooldown after a 429, or the circuit is open."""
+    lane = scheduler.lanes.get(model_name)
+    if lane and lane.cooldown_until > time.monotonic():
+        return True
+    return resilience.breaker(model_name).state == "open"
+
+
+def overloaded(model_name: str) -> bool:
+    lane = scheduler.lanes.get(model_name)
+    return bool(lane) and lane.queued() >= LOAD_QUEUE_DEPTH
+
+
+def primary_model(stage: str, evidence: str = None, chunks: int = None) -> str:
+    keys = []
+    if evidence:
+        keys.append(f"{stage}:{evidence}")
+    if chunks is not None and chunks <= SMALL_JOB_CHUNKS:
+        keys.append(f"{stage}:small")
+    keys.append(stage)
+    for key in keys:
+        if key in STAGE_MODELS:
+            return STAGE_MODELS[key]
+    raise KeyError(f"No model configured for stage '{stage}'")
+
+
+def model_for(stage: str, evidence: str = None, chunks: int = None) -> str:
+    """The model to use for `stage` right now (the configured one, or a faster tier when it can't keep up)."""
+    model_name = primary_model(stage, evidence, chunks)
+    seen = {model_name}
+    while True:
+        fallback = FALLBACKS.get(model_name)
+        if not fallback or fallback in seen:
+            return model_name
+        if unavailable(model_name):
+            reason = "unavailable"
+        elif stage in LOAD_FALLBACK_STAGES and overloaded(model_name):
+            reason = "overloaded"
+        else:
+            return model_name
+        print(f"Model policy: {model_name} {reason}, using {fallback} for {stage}.")
+        seen.add(fallback)
+        model_name = fallback
+
+
+def fallback_for(stage: str, model_name: str) -> Optional[str]:
+    """Where a call of `stage` goes when `model_name` runs out of quota mid-call (None: stay and wait)."""
+    if stage not in LOAD_FALLBACK_STAGES:
+        return None
+    return FALLBACKS.get(model_name)
+
+
+def stats() -> dict:
+    return {
+        "stages": dict(STAGE_MODELS),
+        "models": {
+            model_name: {"unavailable": unavailable(model_name), "overloaded": overloaded(model_name)}
+            for model_name in sorted(set(STAGE_MODELS.values()))
+        },
+    }
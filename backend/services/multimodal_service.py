@@ -1,5 +1,6 @@
 import os
 import shutil
+import asyncio
 import time
 import mimetypes
 from typing import List
@@ -39,25 +40,23 @@ def wait_for_files_active(files):
 async def process_and_upload_files(files: List[UploadFile], upload_dir: str):
     """
     Saves UploadFiles to disk, uploads them to Gemini, and returns the Gemini File objects.
+    Files are spooled into their own directory under `upload_dir`, which is removed afterwards.
     """
-    gemini_files = []
-    
-    for file in files:
-        # Save to disk first
-        file_location = os.path.join(upload_dir, file.filename)
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
-        
-        # Determine MIME type (or let Gemini guess, but explicit is better)
-        mime_type = file.content_type
-        if not mime_type:
-            mime_type = get_mime_type(file.filename)
-            
-        # Upload to Gemini
-        g_file = upload_to_gemini(file_location, mime_type=mime_type)
-        gemini_files.append(g_file)
+    from .gemini_files import upload_file_async, wait_for_files_active_async
+    from .upload_ingest import ingest_uploads, new_request_dir, discard_request_dir
+
+    request_dir = new_request_dir(upload_dir)
+    try:
+        saved_files = await ingest_uploads(files, request_dir)
+
+        # Upload to Gemini (all files in parallel, off the event loop)
+        gemini_files = list(await asyncio.gather(*(
+            upload_file_async(saved.path, mime_type=saved.mime_type) for saved in saved_files
+        )))
+    finally:
+        await asyncio.to_thread(discard_request_dir, request_dir)
         
     # Wait for all to be ready
-    wait_for_files_active(gemini_files)
+    await wait_for_files_active_async(gemini_files)
     
     return gemini_files
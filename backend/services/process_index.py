@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import zlib
+import atexit
+import difflib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+# Local similarity index over the processes in the knowledge base, used by
+# the router before it asks the model. Each process is described by its
+# normalized name tokens and a MinHash signature of its latest SOP's text.
+# An exact (normalized) name match in the same company is routed without a
+# model call; otherwise only the top-k candidates go into the router prompt,
+# so its size no longer grows with the knowledge base. Signatures are
+# updated on every save and kept in a small JSON file, written in batches
+# from a background thread; processes saved before the index existed are
+# loaded (concurrently) on the first match.
+PROCESS_INDEX_PATH = os.environ.get("PROCESS_INDEX_PATH", os.path.join("knowledge_base", "process_index.json"))
+ROUTER_TOP_K = int(os.environ.get("ROUTER_TOP_K", "8"))
+# Above this score (and clear of the runner-up) a candidate is taken without asking the model
+ROUTER_MATCH_SCORE = float(os.environ.get("ROUTER_MATCH_SCORE", "0.9"))
+ROUTER_MATCH_MARGIN = 0.1
+# Below this, nothing in the knowledge base resembles the draft: create without asking
+ROUTER_MIN_SCORE = float(os.environ.get("ROUTER_MIN_SCORE", "0.2"))
+INDEX_LOAD_WORKERS = 8
+# Changes are written out at most this often, from a background thread
+PERSIST_DELAY_SECONDS = 2.0
+
+MINHASH_PERMUTATIONS = 64
+SHINGLE_SIZE = 3
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# Fixed coefficients so signatures stay comparable across restarts
+_COEFFICIENTS = [((i * 0x9E3779B1 + 0x7F4A7C15) % _PRIME | 1, (i * 0x85EBCA77 + 0xC2B2AE3D) % _PRIME)
+                 for i in range(1, MINHASH_PERMUTATIONS + 1)]
+
+_STOPWORDS = {"the", "a", "an", "and", "of", "for", "to", "in", "on", "process", "procedure", "sop", "workflow"}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def name_tokens(name: str) -> tuple:
+    """'Invoice_Processing-Workflow' -> ('invoice', 'processing'): lowercase words, no filler, crude singular."""
+    # Split camelCase and snake_case before lowercasing
+    name = re.sub(r"([a-z])([A-Z])", r"\1 \2", name or "")
+    tokens = []
+    for word in _WORD_RE.findall(name.lower()):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tuple(tokens)
+
+
+def minhash(text: str) -> list[int]:
+    words = _WORD_RE.findall(text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles if shingle]
+    if not hashes:
+        return []
+    return [min((a * h + b) % _PRIME & _MAX_HASH for h in hashes) for a, b in _COEFFICIENTS]
+
+
+def signature_similarity(a: list[int], b: list[int]) -> float:
+    """Estimated Jaccard similarity of the two texts' shingle sets."""
+    if not a or not b:
+        return 0.0
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+def name_similarity(a: tuple, b: tuple) -> float:
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    jaccard = len(set(a) & set(b)) / len(set(a) | set(b))
+    return (jaccard + difflib.SequenceMatcher(None, " ".join(a), " ".join(b)).ratio()) / 2
+
+
+class RouteMatch:
+    """`identifier` is set when the index decided alone; otherwise `candidates` (best first) go to the router."""
+
+    def __init__(self, identifier: Optional[str] = None, candidates: list = None, reason: str = ""):
+        self.identifier = identifier
+        self.candidates = candidates or []
+        self.reason = reason
+
+    @property
+    def decided(self) -> bool:
+        return self.identifier is not None or not self.candidates
+
+
+class ProcessIndex:
+    def __init__(self, path: str = PROCESS_INDEX_PATH):
+        self.path = path
+        self._signatures = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_timer = None
+        self.decided = 0
+        self.routed = 0
+        atexit.register(self.flush)
+
+    def _load(self) -> dict:
+        if self._signatures is None:
+            try:
+                with open(self.path) as f:
+                    self._signatures = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._signatures = {}
+        return self._signatures
+
+    def _save(self):
+        """Schedules a write of the index (called with the lock held); saves in the meantime share it."""
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(PERSIST_DELAY_SECONDS, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """Writes pending changes now."""
+        with self._lock:
+            if self._flush_timer is None:
+                return
+            self._flush_timer.cancel()
+            self._flush_timer = None
+            data = json.dumps(self._signatures)
+        with self._write_lock:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"⚠️ Could not write process index: {e}")
+
+    def update(self, identifier: str, sop_text: str):
+        """Records the content of a process's latest version (call after each save)."""
+        with self._lock:
+            self._load()[identifier] = minhash(sop_text)
+            self._save()
+
+    def _signatures_for(self, identifiers: list[str], load_text) -> dict:
+        """Signatures of `identifiers`; missing ones are loaded concurrently and written in one save."""
+        with self._lock:
+            signatures = {i: self._load()[i] for i in identifiers if i in self._load()}
+        missing = [i for i in identifiers if i not in signatures]
+        if missing:
+            def load(identifier):
+                company, process = identifier.split("/", 1)
+                return minhash(load_text(company, process) or "")
+
+            with ThreadPoolExecutor(max_workers=INDEX_LOAD_WORKERS) as pool:
+                loaded = dict(zip(missing, pool.map(load, missing)))
+            print(f"Router Index: indexed {len(missing)} processes.")
+            with self._lock:
+                for identifier, signature in loaded.items():
+                    # A save may have raced us with newer content
+                    self._load().setdefault(identifier, signature)
+                self._save()
+            signatures.update(loaded)
+        return signatures
+
+    def match(self, company: str, process: str, sop_text: str, identifiers: list[str], load_text) -> RouteMatch:
+        """
+        Scores every existing 'Company/Process' against the draft. `load_text(company, process)`
+        returns a process's latest SOP; it is only called for processes not yet in the index.
+        Blocking (file or storage reads on a cold index): run it in a worker thread.
+        """
+        draft_company = name_tokens(company)
+        draft_name = name_tokens(process)
+        for identifier in identifiers:
+            existing_company, existing_process = identifier.split("/", 1)
+            if name_tokens(existing_company) == draft_company and name_tokens(existing_process) == draft_name:
+                self.decided += 1
+                return RouteMatch(identifier, reason="same company and process name")
+
+        draft_signature = minhash(sop_text)
+        signatures = self._signatures_for(identifiers, load_text)
+        scored = []
+        for identifier in identifiers:
+            existing_company, existing_process = identifier.split("/", 1)
+            score = (0.5 * name_similarity(draft_name, name_tokens(existing_process))
+                     + 0.3 * signature_similarity(draft_signature, signatures[identifier])
+                     + 0.2 * (name_tokens(existing_company) == draft_company))
+            scored.append((score, identifier))
+        scored.sort(reverse=True)
+
+        if not scored or scored[0][0] < ROUTER_MIN_SCORE:
+            self.decided += 1
+            return RouteMatch(reason="no similar process")
+        runner_up = scored[1][0] if len(scored) > 1 else 0.0
+        if scored[0][0] >= ROUTER_MATCH_SCORE and scored[0][0] - runner_up >= ROUTER_MATCH_MARGIN:
+            self.decided += 1
+            return RouteMatch(scored[0][1], reason=f"near-exact match ({scored[0][0]:.2f})")
+        self.routed += 1
+        return RouteMatch(candidates=[identifier for _, identifier in scored[:ROUTER_TOP_K]],
+                          reason=f"best score {scored[0][0]:.2f}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"processes": len(self._load()), "decided_locally": self.decided, "sent_to_router": self.routed}
+
+
+process_index = ProcessIndex()
@@ -0,0 +1,127 @@
+import os
+import time
+import asyncio
+import hashlib
+import datetime
+import google.generativeai as genai
+from google.generativeai import caching
+
+# Model-side context caching for the big static prompt prefixes
+# (SOP_MULTIMODAL_PROMPT, MERGE_PROMPT, ROUTER_PROMPT, ...) and for context
+# files shared by all chunks of a request. Whenever a prefix can't be
+# cached (too small for the model, API unavailable, quota) the caller
+# silently gets None and sends the prefix inline as before.
+PROMPT_CACHE_ENABLED = os.environ.get("PROMPT_CACHE_ENABLED", "1") == "1"
+PROMPT_CACHE_TTL = int(os.environ.get("PROMPT_CACHE_TTL", "3600"))
+# Extend a handle's TTL once it is this close to expiring
+PROMPT_CACHE_REFRESH_MARGIN = int(os.environ.get("PROMPT_CACHE_REFRESH_MARGIN", "300"))
+# After a failed create, don't retry the same prefix for this long
+PROMPT_CACHE_RETRY_AFTER = 600
+
+# Explicit caches below these sizes are rejected by the API
+MIN_CACHE_TOKENS = {"gemini-2.5-pro": 4096, "gemini-2.5-flash": 1024, "gemini-2.5-flash-lite": 1024}
+DEFAULT_MIN_CACHE_TOKENS = 4096
+
+
+def _prefix_key(model_name: str, parts: list) -> str:
+    digest = hashlib.sha256(model_name.encode("utf-8"))
+    for part in parts:
+        if isinstance(part, str):
+            digest.update(b"\0text\0" + part.encode("utf-8"))
+        else:
+            digest.update(b"\0file\0" + str(getattr(part, "name", part)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _estimate_prefix_tokens(parts: list) -> int:
+    # Text only; files are counted as "big enough" since any video/PDF is
+    return sum(len(p) // 4 if isinstance(p, str) else DEFAULT_MIN_CACHE_TOKENS for p in parts)
+
+
+class PromptCacheManager:
+    """Creates, reuses and refreshes cached-content handles for static prompt prefixes."""
+
+    def __init__(self):
+        self._handles = {}
+        self._failed_until = {}
+        self._locks = {}
+        self.hits = 0
+        self.creates = 0
+        self.refreshes = 0
+        self.fallbacks = 0
+
+    def _model_for(self, handle) -> "genai.GenerativeModel":
+        return genai.GenerativeModel.from_cached_content(cached_content=handle["cached"])
+
+    async def _create(self, model_name: str, parts: list) -> dict:
+        cached = await asyncio.to_thread(
+            caching.CachedContent.create,
+            model=model_name,
+            display_name="process-miner-prefix",
+            contents=parts,
+            ttl=datetime.timedelta(seconds=PROMPT_CACHE_TTL),
+        )
+        self.creates += 1
+        return {"cached": cached, "expires": time.time() + PROMPT_CACHE_TTL}
+
+    async def _refresh(self, handle: dict) -> dict:
+        await asyncio.to_thread(handle["cached"].update, ttl=datetime.timedelta(seconds=PROMPT_CACHE_TTL))
+        self.refreshes += 1
+        handle["expires"] = time.time() + PROMPT_CACHE_TTL
+        return handle
+
+    async def get_model(self, model_name: str, prefix_parts: list):
+        """
+        Returns a GenerativeModel bound to a cached copy of `prefix_parts`,
+        or None when the prefix should be sent inline instead.
+        """
+        if not PROMPT_CACHE_ENABLED or not prefix_parts:
+            return None
+        if _estimate_prefix_tokens(prefix_parts) < MIN_CACHE_TOKENS.get(model_name, DEFAULT_MIN_CACHE_TOKENS):
+            return None
+
+        key = _prefix_key(model_name, prefix_parts)
+        if self._failed_until.get(key, 0) > time.time():
+            self.fallbacks += 1
+            return None
+
+        handle = self._handles.get(key)
+        if handle and handle["expires"] - time.time() > PROMPT_CACHE_REFRESH_MARGIN:
+            self.hits += 1
+            return self._model_for(handle)
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            handle = self._handles.get(key)
+            try:
+                if handle and handle["expires"] - time.time() > PROMPT_CACHE_REFRESH_MARGIN:
+                    self.hits += 1
+                elif handle and handle["expires"] > time.time():
+                    handle = await self._refresh(handle)
+                else:
+                    handle = await self._create(model_name, prefix_parts)
+                    self._handles[key] = handle
+                    print(f"Prompt cache: created {handle['cached'].name} for {model_name}")
+            except Exception as e:
+                print(f"⚠️ Prompt cache unavailable for {model_name}, sending prompt inline: {e}")
+                self._handles.pop(key, None)
+                self._failed_until[key] = time.time() + PROMPT_CACHE_RETRY_AFTER
+                self.fallbacks += 1
+                return None
+            return self._model_for(handle)
+
+    def invalidate(self, model_name: str, prefix_parts: list):
+        """Drops a handle the API no longer accepts (e.g. expired server-side)."""
+        self._handles.pop(_prefix_key(model_name, prefix_parts), None)
+
+    def stats(self) -> dict:
+        return {
+            "handles": len(self._handles),
+            "hits": self.hits,
+            "creates": self.creates,
+            "refreshes": self.refreshes,
+            "fallbacks": self.fallbacks,
+        }
+
+
+prompt_cache = PromptCacheManager()
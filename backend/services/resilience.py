@@ -0,0 +1,196 @@
+import os
+import re
+import time
+import random
+import asyncio
+from collections import deque
+from google.api_core import exceptions as google_exceptions
+
+# Failure handling for model calls, used by the generate scheduler:
+# - every attempt has a deadline,
+# - errors are classified: rate limits go back to the scheduler queue,
+#   transient ones (5xx, timeouts, dropped connections) are retried with
+#   jittered exponential backoff, everything else is raised at once,
+# - a per-model circuit breaker fails fast while the upstream keeps failing,
+# - a call can be hedged: if it runs past the model's recent latency
+#   percentile a second identical attempt is started and the first answer wins.
+CALL_TIMEOUT = float(os.environ.get("GEMINI_CALL_TIMEOUT", "600"))
+TRANSIENT_RETRIES = int(os.environ.get("GEMINI_TRANSIENT_RETRIES", "3"))
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 30.0
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("GEMINI_BREAKER_RESET", "30"))
+
+HEDGING_ENABLED = os.environ.get("GEMINI_HEDGING", "1") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("GEMINI_HEDGE_PERCENTILE", "0.9"))
+# Don't hedge before we know what "slow" means for a model
+HEDGE_MIN_SAMPLES = 5
+LATENCY_WINDOW = 100
+
+RATE_LIMITED = "rate_limited"
+TRANSIENT = "transient"
+FATAL = "fatal"
+
+_TRANSIENT_ERRORS = (
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.Aborted,
+    google_exceptions.Unknown,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+_SERVER_ERROR_RE = re.compile(r"\b50[0234]\b")
+
+
+class CircuitOpenError(Exception):
+    """The model failed repeatedly; calls fail fast until the breaker lets a probe through."""
+
+
+def classify(error: Exception) -> str:
+    if isinstance(error, google_exceptions.ResourceExhausted) or "429" in str(error):
+        return RATE_LIMITED
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return TRANSIENT
+    if _SERVER_ERROR_RE.search(str(error)):
+        return TRANSIENT
+    return FATAL
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full jitter: uniform in [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Opens after BREAKER_FAILURE_THRESHOLD consecutive transient failures; half-opens after the reset time."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= BREAKER_RESET_SECONDS:
+            return "half_open"
+        return "open"
+
+    def check(self):
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self.probing:
+            self.probing = True  # Let exactly one call find out whether the upstream is back
+            return
+        self.rejected += 1
+        raise CircuitOpenError(f"{self.name} circuit is open after {self.failures} consecutive failures")
+
+    def record_success(self):
+        if self.opened_at is not None:
+            print(f"✅ {self.name} circuit closed.")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= BREAKER_FAILURE_THRESHOLD:
+            if self.opened_at is None or self.probing:
+                print(f"⚠️ {self.name} circuit open for {BREAKER_RESET_SECONDS}s ({self.failures} consecutive failures).")
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release_probe(self):
+        """The probe ended without telling us anything about the upstream (e.g. a bad request)."""
+        self.probing = False
+
+
+class LatencyTracker:
+    """Recent successful call latencies of one model."""
+
+    def __init__(self):
+        self.samples = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float):
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+_breakers = {}
+_latencies = {}
+hedges = {"started": 0, "won": 0}
+
+
+def breaker(model_name: str) -> CircuitBreaker:
+    if model_name not in _breakers:
+        _breakers[model_name] = CircuitBreaker(model_name)
+    return _breakers[model_name]
+
+
+def latency(model_name: str) -> LatencyTracker:
+    if model_name not in _latencies:
+        _latencies[model_name] = LatencyTracker()
+    return _latencies[model_name]
+
+
+async def hedged(call, hedge_after, backup=None):
+    """
+    Runs `call()`; if it hasn't finished after `hedge_after` seconds, races
+    `backup()` (default: another `call()`) against it. Returns the first
+    result; raises only if both fail.
+    """
+    first = asyncio.ensure_future(call())
+    if hedge_after is None:
+        return await first
+    try:
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+    except asyncio.CancelledError:
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+
+    hedges["started"] += 1
+    second = asyncio.ensure_future((backup or call)())
+    pending = {first, second}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        hedges["won"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def stats() -> dict:
+    return {
+        "circuits": {
+            name: {"state": b.state, "consecutive_failures": b.failures, "rejected": b.rejected}
+            for name, b in _breakers.items()
+        },
+        "hedge_after": {
+            name: round(t.percentile(HEDGE_PERCENTILE), 1) if t.percentile(HEDGE_PERCENTILE) is not None else None
+            for name, t in _latencies.items()
+        },
+        "hedges": dict(hedges),
+    }
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import asyncio
+import mimetypes
+from typing import Optional
+from .upload_ingest import (
+    UPLOAD_DIR, MAX_UPLOAD_FILE_BYTES, IngestedFile, UploadTooLarge, safe_filename,
+)
+from .upload_cache import sha256_file
+
+# Resumable uploads for long recordings: the client creates an upload,
+# sends it in byte ranges (each one retried on its own) and finalizes it.
+# Parts are written straight into the final file at their offset, so on
+# finalize the pipeline gets the file where it is - no reassembly copy.
+# State is kept next to the data so an upload survives a server restart.
+RESUMABLE_PART_SIZE = int(os.environ.get("RESUMABLE_PART_SIZE", str(8 * 1024 * 1024)))
+RESUMABLE_UPLOAD_TTL = int(os.environ.get("RESUMABLE_UPLOAD_TTL", str(24 * 3600)))
+STATE_FILE = "upload.json"
+
+
+class UploadError(Exception):
+    """A part or finalize request that doesn't fit the upload's state."""
+
+    def __init__(self, message: str, status_code: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+class ResumableUpload:
+    """One file being uploaded in parts. Parts must arrive in order; `offset` is the resume point."""
+
+    def __init__(self, upload_id: str, filename: str, size: int, mime_type: str, meta: dict = None):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.mime_type = mime_type
+        self.meta = meta or {}
+        self.offset = 0
+        self.status = "uploading"
+        self.job_id = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._digest = hashlib.sha256()  # Running hash; rebuilt from disk after a restart
+        self._lock = asyncio.Lock()
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(UPLOAD_DIR, self.id)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, safe_filename(self.filename, 0))
+
+    def to_dict(self) -> dict:
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "offset": self.offset,
+            "status": self.status,
+            "job_id": self.job_id,
+            "part_size": RESUMABLE_PART_SIZE,
+        }
+
+    def _persist(self):
+        state = dict(self.to_dict(), mime_type=self.mime_type, meta=self.meta,
+                     created_at=self.created_at, updated_at=self.updated_at)
+        tmp_path = os.path.join(self.directory, STATE_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(self.directory, STATE_FILE))
+
+    @classmethod
+    def _restore(cls, upload_id: str):
+        try:
+            with open(os.path.join(UPLOAD_DIR, upload_id, STATE_FILE)) as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        upload = cls(upload_id, state["filename"], state["size"], state["mime_type"], state.get("meta"))
+        upload.status = state["status"]
+        upload.job_id = state.get("job_id")
+        upload.created_at = state["created_at"]
+        upload.updated_at = state["updated_at"]
+        # Trust the bytes on disk over the recorded offset (a part may have
+        # landed without the state being written, or vice versa)
+        on_disk = os.path.getsize(upload.path) if os.path.exists(upload.path) else 0
+        upload.offset = min(on_disk, state["offset"])
+        upload._digest = None
+        return upload
+
+    def _write_part(self, start: int, data: bytes):
+        with open(self.path, "r+b" if os.path.exists(self.path) else "wb") as f:
+            f.seek(start)
+            f.write(data)
+            f.truncate()
+        if self._digest is not None:
+            self._digest.update(data)
+        self.offset = start + len(data)
+        self.updated_at = time.time()
+        self._persist()
+
+    async def write_part(self, start: int, data: bytes, part_sha256: str = None) -> int:
+        """Writes bytes [start, start+len) and returns the new offset."""
+        async with self._lock:
+            if self.status != "uploading":
+                raise UploadError(f"Upload is {self.status}", status_code=409, offset=self.offset)
+            if start != self.offset:
+                # Out of order or a duplicate of a part we already have: tell the client where to resume
+                raise UploadError(f"Expected offset {self.offset}", status_code=409, offset=self.offset)
+            if start + len(data) > self.size:
+                raise UploadError("Part extends past the declared size", status_code=416, offset=self.offset)
+            if part_sha256 and hashlib.sha256(data).hexdigest() != part_sha256.lower():
+                raise UploadError("Part checksum mismatch", status_code=422, offset=self.offset)
+            await asyncio.to_thread(self._write_part, start, data)
+            return self.offset
+
+    async def finalize(self, sha256: str = None) -> IngestedFile:
+        """
+        Checks completeness and the whole-file checksum; returns the file's
+        descriptor. A complete upload whose file is still there is checked
+        again (its job got lost, e.g. in a restart); once its job has cleaned
+        up the file it is gone (410).
+        """
+        async with self._lock:
+            if self.status == "complete" and not os.path.exists(self.path):
+                raise UploadError("Upload was already processed; start a new upload", status_code=410)
+            if self.status not in ("uploading", "complete"):
+                raise UploadError(f"Upload is {self.status}", status_code=409, offset=self.offset)
+            if self.offset != self.size:
+                raise UploadError(f"Upload incomplete ({self.offset}/{self.size} bytes)", status_code=409, offset=self.offset)
+            if self._digest is not None:
+                digest = self._digest.hexdigest()
+            else:
+                digest = await asyncio.to_thread(sha256_file, self.path)
+            if sha256 and digest != sha256.lower():
+                raise UploadError("File checksum mismatch", status_code=422, offset=self.offset)
+            self.status = "complete"
+            self.updated_at = time.time()
+            await asyncio.to_thread(self._persist)
+            return IngestedFile(self.path, self.filename, self.mime_type, digest, self.size)
+
+    def attach_job(self, job_id: str):
+        self.job_id = job_id
+        self._persist()
+
+
+_uploads: dict = {}
+
+
+def _prune_uploads():
+    """Forgets old uploads; abandoned ones (never finalized) also lose their data."""
+    now = time.time()
+    expired = [
+        upload_id for upload_id, upload in _uploads.items()
+        if now - upload.updated_at > RESUMABLE_UPLOAD_TTL
+    ]
+    for upload_id in expired:
+        upload = _uploads.pop(upload_id)
+        if upload.status == "uploading":
+            # Finalized uploads belong to their analysis job, which cleans up itself
+            shutil.rmtree(upload.directory, ignore_errors=True)
+
+
+def create_upload(filename: str, size: int, mime_type: str = None, meta: dict = None) -> ResumableUpload:
+    _prune_uploads()
+    if size < 0:
+        raise UploadError("Invalid size")
+    if size > MAX_UPLOAD_FILE_BYTES:
+        raise UploadTooLarge(f"{filename} is larger than {MAX_UPLOAD_FILE_BYTES} bytes")
+    mime_type = mime_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    upload = ResumableUpload(uuid.uuid4().hex, filename, size, mime_type, meta)
+    os.makedirs(upload.directory, exist_ok=True)
+    open(upload.path, "wb").close()
+    upload._persist()
+    _uploads[upload.id] = upload
+    return upload
+
+
+def get_upload(upload_id: str) -> Optional[ResumableUpload]:
+    if upload_id in _uploads:
+        return _uploads[upload_id]
+    if not upload_id.isalnum():
+        return None
+    upload = ResumableUpload._restore(upload_id)
+    if upload:
+        _uploads[upload_id] = upload
+    return upload
+
+
+def parse_content_range(header: str, body_length: int, size: int = None) -> int:
+    """
+    'bytes start-end/total' -> start. A missing header means the part starts
+    at 0. `total` ('*' when unknown) must be the upload's `size`.
+    """
+    if not header:
+        return 0
+    try:
+        unit, spec = header.strip().split(" ", 1)
+        byte_range, total = spec.split("/", 1)
+        start, end = (int(v) for v in byte_range.split("-", 1))
+        total = None if total.strip() == "*" else int(total)
+    except ValueError:
+        raise UploadError(f"Malformed Content-Range: {header}")
+    if unit != "bytes" or start < 0 or end - start + 1 != body_length:
+        raise UploadError("Content-Range does not match the body")
+    if total is not None and size is not None and total != size:
+        raise UploadError(f"Content-Range total {total} does not match the upload size {size}", status_code=416)
+    return start
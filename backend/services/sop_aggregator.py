@@ -1,5 +1,17 @@
-import google.generativeai as genai
+import os
 import asyncio
+from .gemini_scheduler import generate_content, generate_content_stream, estimate_tokens
+from . import model_policy
+
+# Tree-reduction merge: partials are merged in consecutive groups whose
+# combined size stays under MERGE_INPUT_TOKEN_BUDGET, all groups of a level
+# concurrently, until one document is left. Latency grows with the depth of
+# the tree (log of the chunk count) rather than with the chunk count.
+MERGE_INPUT_TOKEN_BUDGET = int(os.environ.get("MERGE_INPUT_TOKEN_BUDGET", "120000"))
+# Upper bound on partials per merge call even when they are small
+MERGE_MAX_FAN_IN = int(os.environ.get("MERGE_MAX_FAN_IN", "4"))
+
+PARTIAL_SEPARATOR = "\n\n=== NEXT PARTIAL SOP ===\n\n"
 
 MERGE_PROMPT = """
 You are an expert Technical Writer and Solutions Architect. 
@@ -143,8 +155,62 @@ A STRICT Markdown SOP starting with a JSON Metadata block, followed by the exact
 *   (Briefly explain how the User Provided Context [if any] was utilized in this analysis. If no context was provided, state "N/A".)
 """
 
-async def merge_partial_sops(partial_sops: list[str], model_name="gemini-2.5-pro", context_str: str = "") -> str:
-    """Sends all partial SOPs to Gemini to be merged into one."""
+def _fan_in_for(token_counts: list[int], budget: int) -> int:
+    """How many partials of average size fit in one merge call (at least 2)."""
+    average = max(1, sum(token_counts) // len(token_counts))
+    return max(2, min(MERGE_MAX_FAN_IN, budget // average))
+
+
+def plan_merge_groups(token_counts: list[int], budget: int = MERGE_INPUT_TOKEN_BUDGET) -> list[list[int]]:
+    """
+    Splits partials (by index) into consecutive groups for one merge level.
+    Order is preserved so step numbering stays chronological. A group closes
+    when the next partial would push it over the budget or the fan-in.
+    """
+    fan_in = _fan_in_for(token_counts, budget)
+    groups = []
+    current, current_tokens = [], 0
+    for index, tokens in enumerate(token_counts):
+        if current and (current_tokens + tokens > budget or len(current) >= fan_in):
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+
+    if len(groups) == len(token_counts) and len(groups) > 1:
+        # Every partial is over budget on its own; pair them up anyway
+        # rather than never converging
+        print(f"⚠️ Partials exceed the merge budget ({budget} tokens), merging in pairs.")
+        groups = [list(range(i, min(i + 2, len(token_counts)))) for i in range(0, len(token_counts), 2)]
+    return groups
+
+
+async def _merge_group(partial_sops: list[str], model_name: str, context_str: str, on_text=None) -> str:
+    """One merge call over a group of partials; streamed through `on_text` when given."""
+    combined_text = PARTIAL_SEPARATOR.join(partial_sops)
+
+    context_instructions = []
+    if context_str:
+        context_instructions.append(f"\n\nUSER PROVIDED CONTEXT FOR ATTACHMENTS:\n{context_str}\n\nINSTRUCTION: Please ensure you populate Section 5.2 explaining how this context was applied.")
+
+    fallback_model = model_policy.fallback_for("merge", model_name)
+    if on_text:
+        return await generate_content_stream(model_name, context_instructions + [combined_text],
+                                             cached_prefix=[MERGE_PROMPT], on_text=on_text, fallback_model=fallback_model)
+    response = await generate_content(model_name, context_instructions + [combined_text], cached_prefix=[MERGE_PROMPT],
+                                      fallback_model=fallback_model)
+    return response.text
+
+
+async def merge_partial_sops(partial_sops: list[str], model_name: str = None, context_str: str = "",
+                             budget: int = MERGE_INPUT_TOKEN_BUDGET, on_text=None) -> str:
+    """
+    Merges partial SOPs into one. Small inputs go out in a single call;
+    larger ones are reduced level by level with bounded, concurrent calls.
+    `on_text(delta)` receives the final merge call's output as it streams.
+    """
     
     if not partial_sops:
         return ""
@@ -161,14 +227,19 @@ async def merge_partial_sops(partial_sops: list[str], model_name="gemini-2.5-pro
         # Let's stick to merge logic for now.
         return partial_sops[0]
 
-    combined_text = "\n\n=== NEXT PARTIAL SOP ===\n\n".join(partial_sops)
-    
-    prompt_with_context = MERGE_PROMPT
-    if context_str:
-        prompt_with_context += f"\n\nUSER PROVIDED CONTEXT FOR ATTACHMENTS:\n{context_str}\n\nINSTRUCTION: Please ensure you populate Section 5.2 explaining how this context was applied."
-    
-    model = genai.GenerativeModel(model_name=model_name)
-    
-    response = await model.generate_content_async([prompt_with_context, combined_text])
-    
-    return response.text
+    model_name = model_name or model_policy.model_for("merge", chunks=len(partial_sops))
+    level = list(partial_sops)
+    depth = 0
+    while len(level) > 1:
+        groups = plan_merge_groups([estimate_tokens([p]) for p in level], budget)
+        depth += 1
+        if len(groups) > 1:
+            print(f"Merge level {depth}: {len(level)} partials in {len(groups)} groups.")
+        # Context only matters for the final document's Section 5.2
+        final = len(groups) == 1
+        level = list(await asyncio.gather(*(
+            _merge_group([level[i] for i in group], model_name, context_str if final else "", on_text if final else None)
+            if len(group) > 1 else asyncio.sleep(0, result=level[group[0]])
+            for group in groups
+        )))
+    return level[0]
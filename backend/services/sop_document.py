@@ -0,0 +1,299 @@
+import re
+import json
+import threading
+from collections import OrderedDict
+
+# In-memory model of an SOP: storage metadata (the <!-- metadata:... -->
+# header), the JSON metadata block, the numbered schema sections and, per
+# section, its stages, steps and tables. One pass over the lines builds it;
+# to_markdown() gives back the exact same text, so callers can work on the
+# parts they need (routing on metadata, merging single sections, listing on
+# the header) without re-parsing the markdown with ad-hoc regexes.
+
+_STORAGE_META_RE = re.compile(r"^<!--\s*metadata:(\w+)=(.*?)\s*-->$")
+# "### 2. Open Questions", "#### 3.4 Detailed Process Workflow"
+_SECTION_RE = re.compile(r"^#{2,4}\s*([1-5](?:\.\d{1,2})?)\.?\s+\S.*$")
+# "##### Stage 2: Validation", "**Phase 1 - Intake**"
+_STAGE_RE = re.compile(r"^(?:#{4,6}\s*|\*\*)\s*(?:Stage|Phase)\s+(\d+)\s*[:.\-–]?\s*(.*?)\s*(?:\*\*)?$", re.IGNORECASE)
+# "1. Open SAP", "- **Step 3:** Post invoice", "2.1) Check totals"
+_STEP_RE = re.compile(r"^\s*(?:[-*]\s+)?(?:\*\*)?(?:Step\s+)?(\d+(?:\.\d+)*)(?:[.):]|\*\*|:\*\*)+\s*(.+)$", re.IGNORECASE)
+_TABLE_SEPARATOR_RE = re.compile(r"^\|?\s*:?-{3,}")
+
+
+def section_key(section_id: str) -> tuple:
+    return tuple(int(part) for part in section_id.split("."))
+
+
+def parse_storage_header(line: str):
+    """('processing_time', '12.5') for a storage metadata comment line, else None."""
+    match = _STORAGE_META_RE.match(line.strip())
+    return (match.group(1), match.group(2)) if match else None
+
+
+def format_storage_header(key: str, value) -> str:
+    return f"<!-- metadata:{key}={value} -->"
+
+
+def _cells(line: str) -> list[str]:
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+class Step:
+    def __init__(self, number: str, text: str):
+        self.number = number
+        self.text = text
+
+    def __repr__(self):
+        return f"Step({self.number}, {self.text[:40]!r})"
+
+
+class Stage:
+    def __init__(self, number: int, title: str):
+        self.number = number
+        self.title = title
+        self.steps = []
+
+    def __repr__(self):
+        return f"Stage({self.number}, {self.title!r}, {len(self.steps)} steps)"
+
+
+class Table:
+    def __init__(self, header: list[str]):
+        self.header = header
+        self.rows = []
+
+    def __repr__(self):
+        return f"Table({self.header}, {len(self.rows)} rows)"
+
+
+class Section:
+    """One numbered schema section; `lines` are its raw body lines (heading excluded)."""
+
+    def __init__(self, section_id: str, heading: str):
+        self.id = section_id
+        self.heading = heading
+        self.lines = []
+        self.stages = []
+        self.steps = []
+        self.tables = []
+
+    @property
+    def body(self) -> str:
+        return "\n".join(self.lines).strip()
+
+    @body.setter
+    def body(self, text: str):
+        self.lines = text.split("\n") + [""]  # Keep a blank line before the next heading
+        # Re-derive the structure of the new body
+        self.stages, self.steps, self.tables = [], [], []
+        _Parser.scan_structure(self)
+
+    def __repr__(self):
+        return f"Section({self.id}, {len(self.lines)} lines)"
+
+
+class _Parser:
+    """Single pass over the lines; tracks fences, tables and the current stage."""
+
+    @staticmethod
+    def scan_structure(section: Section):
+        stage = None
+        table = None
+        in_fence = False
+        for line in section.lines:
+            stripped = line.strip()
+            if stripped.startswith("```"):
+                in_fence = not in_fence
+                continue
+            if in_fence:
+                continue
+            table, stage = _Parser._structure_line(section, stripped, table, stage)
+
+    @staticmethod
+    def _structure_line(section: Section, stripped: str, table, stage):
+        if stripped.startswith("|"):
+            if table is None:
+                table = Table(_cells(stripped))
+                section.tables.append(table)
+            elif not _TABLE_SEPARATOR_RE.match(stripped):
+                table.rows.append(_cells(stripped))
+            return table, stage
+        stage_match = _STAGE_RE.match(stripped)
+        if stage_match:
+            stage = Stage(int(stage_match.group(1)), stage_match.group(2).strip("*: "))
+            section.stages.append(stage)
+            return None, stage
+        step_match = _STEP_RE.match(stripped)
+        if step_match:
+            step = Step(step_match.group(1), step_match.group(2).strip())
+            section.steps.append(step)
+            if stage:
+                stage.steps.append(step)
+        return None, stage
+
+
+class SOPDocument:
+    """Parsed SOP. `metadata` is the JSON block's content; `storage_meta` the storage header values."""
+
+    def __init__(self):
+        self.storage_meta = {}
+        self.metadata = {}
+        self.preamble = []
+        self.sections = []
+        # Where the JSON block sits: (section id or None for the preamble, line index)
+        self._metadata_block = None
+        self._metadata_anchor = None
+        self._trailing_newline = False
+        # "\r" when the stored header lines end in CRLF
+        self._header_cr = ""
+
+    @classmethod
+    def parse(cls, text: str) -> "SOPDocument":
+        doc = cls()
+        doc._trailing_newline = text.endswith("\n")
+        # Only "\n" separates lines: "\r", "\x0c" or "\u2028" stay in the line they are in,
+        # so to_markdown() gives back the same text
+        lines = text.split("\n")
+        if doc._trailing_newline:
+            lines.pop()
+
+        index = 0
+        while index < len(lines):
+            header = parse_storage_header(lines[index])
+            if not header:
+                break
+            doc.storage_meta[header[0]] = header[1]
+            doc._header_cr = "\r" if lines[index].endswith("\r") else ""
+            index += 1
+
+        current = None
+        target = doc.preamble
+        last_key = ()
+        in_fence = False
+        metadata_lines = None
+        table = stage = None
+        for line in lines[index:]:
+            stripped = line.strip()
+
+            if metadata_lines is not None:
+                # Inside the JSON metadata block
+                metadata_lines.append(line)
+                if stripped.startswith("```"):
+                    doc._metadata_block = metadata_lines
+                    metadata_lines = None
+                continue
+            if stripped.startswith("```"):
+                if not in_fence and not doc._metadata_block and stripped.lower().startswith("```json"):
+                    metadata_lines = [line]
+                    doc._metadata_anchor = (current.id if current else None, len(target))
+                    continue
+                in_fence = not in_fence
+                target.append(line)
+                continue
+
+            match = None if in_fence else _SECTION_RE.match(stripped)
+            # Numbered headings that don't move forward (a "### 2." inside a step list) are body text
+            if match and section_key(match.group(1)) > last_key:
+                last_key = section_key(match.group(1))
+                current = Section(match.group(1), line)
+                doc.sections.append(current)
+                target = current.lines
+                table = stage = None
+                continue
+
+            target.append(line)
+            if current is not None and not in_fence:
+                table, stage = _Parser._structure_line(current, stripped, table, stage)
+
+        if metadata_lines is not None:
+            # Unterminated block: keep it as text
+            target.extend(metadata_lines)
+            doc._metadata_anchor = None
+        if doc._metadata_block:
+            try:
+                doc.metadata = json.loads("\n".join(doc._metadata_block[1:-1]))
+            except json.JSONDecodeError:
+                doc.metadata = {}
+        return doc
+
+    def copy(self) -> "SOPDocument":
+        """Cached documents are shared; edit a copy."""
+        return SOPDocument.parse(self.to_markdown())
+
+    def section(self, section_id: str):
+        for section in self.sections:
+            if section.id == section_id:
+                return section
+        return None
+
+    def set_metadata(self, metadata: dict):
+        """Replaces the JSON block (adding one at the top if the document had none)."""
+        self.metadata = dict(metadata)
+        self._metadata_block = ["```json"] + json.dumps(self.metadata, indent=2).splitlines() + ["```"]
+        if self._metadata_anchor is None:
+            self._metadata_anchor = (None, 0)
+
+    def _lines(self, storage_meta: bool, metadata: bool) -> list[str]:
+        out = []
+        if storage_meta:
+            out.extend(format_storage_header(k, v) + self._header_cr for k, v in self.storage_meta.items())
+
+        def emit(section_id, body: list[str]):
+            if metadata and self._metadata_block and self._metadata_anchor and self._metadata_anchor[0] == section_id:
+                at = min(self._metadata_anchor[1], len(body))
+                out.extend(body[:at] + self._metadata_block + body[at:])
+            else:
+                out.extend(body)
+
+        emit(None, self.preamble)
+        for section in self.sections:
+            out.append(section.heading)
+            emit(section.id, section.lines)
+        return out
+
+    def to_markdown(self, storage_meta: bool = True, metadata: bool = True) -> str:
+        text = "\n".join(self._lines(storage_meta, metadata))
+        return text + "\n" if self._trailing_newline else text
+
+    def content(self) -> str:
+        """The SOP as the model wrote it, without the storage header."""
+        return self.to_markdown(storage_meta=False)
+
+    def __repr__(self):
+        return f"SOPDocument({self.metadata.get('process_name')!r}, {len(self.sections)} sections)"
+
+
+class DocumentCache:
+    """LRU of parsed documents per stored version. Versions are written once, so the key never goes stale."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """Returns the parsed document for `key`, calling `loader()` for the text on a miss (None if it returns None)."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        text = loader()
+        if text is None:
+            return None
+        doc = SOPDocument.parse(text)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = doc
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return doc
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+document_cache = DocumentCache()
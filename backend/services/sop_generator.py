@@ -20,7 +20,8 @@ Synthesize ALL evidence into a single, definitive, EXTREMELY COMPREHENSIVE Stand
 - **Extract Precision**: Capture exact UI element names, field labels, button text, system names visible in evidence
 - **Note Actions**: Record clicks, navigation paths, data entry sequences from videos
 - **Synthesize Sources**: Combine insights across sources - don't just summarize each file separately
-  - Example: "Step 1: Check invoice (Source: Video timestamp 2:34) against Rate Card pricing (Source: PDF page 5)"
+  - Example: "Step 1: Check invoice (Source: Video [video 2:34]) against Rate Card pricing (Source: PDF page 5)"
+- **Video Timestamps**: Always write a position in a video as `[video m:ss]` (or `[video h:mm:ss]`), e.g. `[video 2:34]`. Use this bracket format ONLY for video positions - never for times of day, cut-off times or durations.
 - **Flag Conflicts**: If sources contradict, note discrepancy with ⚠️ and add to Open Questions
 - **Zero Assumptions**: If critical information is missing or unclear, use `[TO BE CONFIRMED WITH CLIENT]`
 - **Confidence Marking**: Mark sections as ✅ High | ⚠️ Medium | ❌ Low Confidence
@@ -433,7 +434,7 @@ _(Repeat for all common exceptions observed in evidence)_
 - ❌ **File X**: `[filename.xyz]` - IGNORED - Reason: _(Unrelated to process, corrupted file, duplicate content)_
 
 **Source Conflicts Noted**:
-- ⚠️ **Discrepancy 1**: _(Video at 5:23 shows approval threshold as $10K but PDF page 12 states $15K → [TO BE CONFIRMED WITH CLIENT])_
+- ⚠️ **Discrepancy 1**: _(Video at [video 5:23] shows approval threshold as $10K but PDF page 12 states $15K → [TO BE CONFIRMED WITH CLIENT])_
 - ⚠️ **Discrepancy 2**: _(Audio mentions 3-day turnaround but workflow diagram shows 5-day timeline → [TO BE CONFIRMED WITH CLIENT])_
 
 **Discrepancies Flagged**:
@@ -0,0 +1,97 @@
+import re
+import asyncio
+from .gemini_scheduler import generate_content
+from .sop_aggregator import merge_partial_sops
+from .sop_document import SOPDocument, section_key
+from . import model_policy
+
+# Extension sessions grow by one 20-minute chunk at a time. Instead of
+# re-generating the whole (ever longer) session SOP on every chunk, both
+# documents are split into their schema sections (1, 2, 3.1-3.12, 4.1-4.13,
+# 5.x) and only the sections the new chunk actually adds something to are
+# merged by the model - concurrently. Everything else is copied as is.
+
+SECTION_MERGE_PROMPT = """
+You are an expert Technical Writer maintaining a living Standard Operating Procedure (SOP).
+You are given ONE section of the existing SOP and the same section as extracted from a NEW recording of the same process.
+
+Merge them into the updated version of that section.
+
+## RULES
+1.  **Keep** everything in the existing section that the new observations do not contradict.
+2.  **Add** new steps, systems, rules, exceptions and evidence from the new observations.
+3.  **Deduplicate**: If both describe the same thing, keep one (the more detailed) version.
+4.  **Continuity**: Step / row numbering continues from the existing section.
+5.  **Format**: Keep the existing section's Markdown structure (lists, tables, sub-headings).
+6.  Output ONLY the body of the section - no section heading, no commentary, no code fences around it.
+"""
+
+# Minimum number of schema sections for a document to be merged section by section
+MIN_STRUCTURED_SECTIONS = 8
+
+_EMPTY_BODY_RE = re.compile(r"^(not observed|not applicable|n/?a|none|tbd|no [a-z ]+ (observed|identified|provided))\.?$")
+
+
+def _normalize(body: str) -> str:
+    text = re.sub(r"[*_`>#|\-]+", " ", body).lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def has_content(body: str) -> bool:
+    """False for empty sections and placeholders like 'Not Observed' / 'N/A'."""
+    normalized = _normalize(body)
+    return bool(normalized) and not _EMPTY_BODY_RE.match(normalized)
+
+
+async def _merge_section(section_id: str, prev_body: str, new_body: str, model_name: str, context_str: str) -> str:
+    instructions = [f"SECTION: {section_id}"]
+    if context_str and section_id.startswith("5"):
+        instructions.append(f"USER PROVIDED CONTEXT FOR ATTACHMENTS:\n{context_str}")
+    request = f"=== EXISTING SECTION ===\n{prev_body}\n\n=== NEW OBSERVATIONS ===\n{new_body}"
+    response = await generate_content(model_name, instructions + [request], cached_prefix=[SECTION_MERGE_PROMPT],
+                                      fallback_model=model_policy.fallback_for("section_merge", model_name))
+    return response.text.strip()
+
+
+async def merge_session_sop(prev_sop: str, new_sop: str, model_name: str = None, context_str: str = "",
+                            on_text=None) -> str:
+    """
+    Folds a new chunk's SOP into the running session SOP section by section.
+    Falls back to a whole-document merge when either side doesn't follow the schema.
+    """
+    prev_doc = SOPDocument.parse(prev_sop)
+    new_doc = SOPDocument.parse(new_sop)
+    if len(prev_doc.sections) < MIN_STRUCTURED_SECTIONS or len(new_doc.sections) < MIN_STRUCTURED_SECTIONS:
+        print("Section merge: SOP doesn't follow the schema, merging whole documents.")
+        return await merge_partial_sops([prev_sop, new_sop], model_name=model_name, context_str=context_str, on_text=on_text)
+    model_name = model_name or model_policy.model_for("section_merge")
+
+    # The session keeps its metadata; keys the new chunk adds are filled in
+    if new_doc.metadata:
+        prev_doc.set_metadata({**new_doc.metadata, **prev_doc.metadata})
+
+    to_merge = []
+    for new in new_doc.sections:
+        prev = prev_doc.section(new.id)
+        if new.id == "1" or not has_content(new.body):
+            continue  # Metadata is handled above; empty means the chunk didn't touch it
+        if prev is None:
+            prev_doc.sections.append(new)
+        elif not has_content(prev.body):
+            prev.body = new.body
+        elif _normalize(prev.body) != _normalize(new.body):
+            to_merge.append((prev, new))
+    prev_doc.sections.sort(key=lambda s: section_key(s.id))
+
+    print(f"Section merge: {len(to_merge)} of {len(new_doc.sections)} sections changed, "
+          f"merging {', '.join(prev.id for prev, _ in to_merge) or 'none'}.")
+    bodies = await asyncio.gather(*(
+        _merge_section(prev.id, prev.body, new.body, model_name, context_str) for prev, new in to_merge
+    ))
+    for (prev, _), body in zip(to_merge, bodies):
+        prev.body = body
+
+    result = prev_doc.content()
+    if on_text:
+        on_text(result)
+    return result
@@ -1,28 +1,49 @@
 import os
 import time
-from datetime import datetime
+import json
+import base64
+import threading
+from datetime import datetime, timedelta
 from typing import Optional
 from dotenv import load_dotenv
+from .kb_index import kb_index, KB_INDEX_ENABLED, KB_DIR
+from .supabase_catalog import SupabaseCatalog
+from .process_index import process_index
+from . import version_store
+from .sop_document import SOPDocument, document_cache, parse_storage_header, format_storage_header
 
 load_dotenv()
 
-KB_DIR = "knowledge_base"
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 BUCKET_NAME = "sops"
 
-# Initialize Supabase Client if keys exist
-supabase_client = None
-if SUPABASE_URL and SUPABASE_KEY:
-    try:
-        from supabase import create_client, Client
-        supabase_client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-        print("✅ Supabase Client Initialized")
-    except Exception as e:
-        print(f"⚠️ Failed to init Supabase: {e}")
+# Supabase client is created on first use and shared (its HTTP connections are pooled)
+_supabase_client = None
+_supabase_failed = False
+_supabase_lock = threading.Lock()
+
+def _get_supabase_client():
+    global _supabase_client, _supabase_failed
+    if _supabase_client is None and not _supabase_failed and SUPABASE_URL and SUPABASE_KEY:
+        with _supabase_lock:
+            if _supabase_client is None and not _supabase_failed:
+                try:
+                    from supabase import create_client
+                    _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+                    print("✅ Supabase Client Initialized")
+                except Exception as e:
+                    _supabase_failed = True
+                    print(f"⚠️ Failed to init Supabase: {e}")
+    return _supabase_client
+
+def _bucket():
+    return _get_supabase_client().storage.from_(BUCKET_NAME)
+
+catalog = SupabaseCatalog(_bucket)
 
 def use_cloud_storage():
-    return supabase_client is not None
+    return _get_supabase_client() is not None
 
 # --- Common Utils ---
 
@@ -30,6 +51,12 @@ def sanitize_name(name: str) -> str:
     """Sanitizes strings to be safe for filenames."""
     return "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).strip()
 
+def _with_storage_header(content: str, processing_time: float) -> str:
+    # Content read back from storage may already carry a header; never stack them
+    doc = SOPDocument.parse(content)
+    doc.storage_meta = {"processing_time": processing_time} if processing_time > 0 else {}
+    return doc.to_markdown()
+
 # --- Local Filesystem Implementation ---
 
 def _local_init():
@@ -43,6 +70,13 @@ def _local_save(company: str, process_name: str, content: str, processing_time:
     if not os.path.exists(company_dir):
         os.makedirs(company_dir)
         
+    content = _with_storage_header(content, processing_time)
+    if KB_INDEX_ENABLED:
+        # Version allocation, write and index update in one transaction
+        file_path = kb_index.save_version(company_clean, sanitize_name(process_name), company_dir, content, processing_time)
+        _local_compact_previous(file_path, content)
+        return file_path
+
     # Get Version
     base_filename = f"{company_clean}_{sanitize_name(process_name)}"
     max_v = 0
@@ -55,17 +89,29 @@ def _local_save(company: str, process_name: str, content: str, processing_time:
     
     filename = f"{base_filename}_v{max_v + 1}.md"
     file_path = os.path.join(company_dir, filename)
-    
-    if processing_time > 0:
-         content = f"<!-- metadata:processing_time={processing_time} -->\n{content}"
          
     with open(file_path, "w", encoding="utf-8") as f:
         f.write(content)
+    _local_compact_previous(file_path, content)
     return file_path
 
+def _local_compact_previous(file_path: str, content: str):
+    """The version before the one just saved becomes a delta against it (unless it is a snapshot)."""
+    previous = version_store.version_path(file_path, version_store.version_of(file_path) - 1)
+    try:
+        size = version_store.compact_local_file(previous, content)
+    except Exception as e:
+        # The full copy stays; history is still readable
+        print(f"⚠️ Could not delta-compress {previous}: {e}")
+        return
+    if size is not None and KB_INDEX_ENABLED:
+        kb_index.set_stored_size(previous, size)
+
 def _local_list():
     docs = []
     if not os.path.exists(KB_DIR): return docs
+    if KB_INDEX_ENABLED:
+        return kb_index.list_documents()
     
     for company in os.listdir(KB_DIR):
         c_path = os.path.join(KB_DIR, company)
@@ -75,14 +121,14 @@ def _local_list():
                     try:
                         path = os.path.join(c_path, f)
                         stats = os.stat(path)
-                        created = datetime.fromtimestamp(stats.st_ctime).strftime("%Y-%m-%d %H:%M")
+                        created = datetime.fromtimestamp(stats.st_mtime).strftime("%Y-%m-%d %H:%M")
                         
                         # Metadata read
                         proc_time = 0
                         with open(path, 'r') as file:
-                            line = file.readline().strip()
-                            if "metadata:processing_time" in line:
-                                proc_time = float(line.split("=")[1].replace(" -->", ""))
+                            header = parse_storage_header(file.readline())
+                            if header and header[0] == "processing_time":
+                                proc_time = float(header[1])
                                 
                         docs.append({
                             "id": path,
@@ -97,57 +143,57 @@ def _local_list():
     docs.sort(key=lambda x: x['date'], reverse=True)
     return docs
 
+def _local_path(path: str) -> Optional[str]:
+    """
+    Path of a stored document, from a full path (internal usage) or one
+    relative to KB_DIR (API usage). None for anything outside KB_DIR
+    ('../', absolute paths, symlinks out).
+    """
+    full_path = path if path.startswith(KB_DIR + os.sep) else os.path.join(KB_DIR, path)
+    kb_root = os.path.realpath(KB_DIR)
+    if not os.path.realpath(full_path).startswith(kb_root + os.sep):
+        return None
+    return full_path
+
 def _local_read(path: str) -> Optional[str]:
-    # Handle both full paths (internal usage) and relative paths (API usage)
-    if path.startswith(KB_DIR):
-        full_path = path
-    else:
-        full_path = os.path.join(KB_DIR, path)
-        
-    if os.path.exists(full_path):
+    full_path = _local_path(path)
+    if full_path and os.path.isfile(full_path):
         with open(full_path, 'r', encoding='utf-8') as f:
-            return f.read()
+            return version_store.resolve(full_path, f.read(), _local_read_raw)
     return None
 
+def _local_read_raw(full_path: str) -> Optional[str]:
+    try:
+        with open(full_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
 # --- Supabase Implementation ---
 
 def _supabase_save(company: str, process_name: str, content: str, processing_time: float) -> str:
     company_clean = sanitize_name(company)
-    base_filename = f"{company_clean}_{sanitize_name(process_name)}"
-    
-    # 1. List files to find ID
-    # Simpler: Just rely on timestamp or random ID? No, user wants versioning.
-    # We have to list bucket contents starting with prefix.
+    process_clean = sanitize_name(process_name)
     # Path in bucket: {company}/{filename}
-    
     try:
-        max_v = 0
-        res = supabase_client.storage.from_(BUCKET_NAME).list(company_clean)
-        # res is a list of dicts or objects
-        for file in res:
-             name = file['name'] # type: ignore
-             if name.startswith(base_filename) and name.endswith(".md"):
-                 try:
-                    v = int(name.rsplit("_v", 1)[1].replace(".md", ""))
-                    max_v = max(max_v, v)
-                 except: continue
-                 
-        next_v = max_v + 1
-        filename = f"{base_filename}_v{next_v}.md"
+        next_v = catalog.next_version(company_clean, process_clean)
+        filename = f"{company_clean}_{process_clean}_v{next_v}.md"
         path = f"{company_clean}/{filename}"
         
-        if processing_time > 0:
-             content = f"<!-- metadata:processing_time={processing_time} -->\n{content}"
+        content = _with_storage_header(content, processing_time)
+        data = content.encode('utf-8')
         
         # Upload
-        supabase_client.storage.from_(BUCKET_NAME).upload(
+        _bucket().upload(
             path,
-            content.encode('utf-8'),
+            data,
             {"content-type": "text/markdown"}
         )
+        catalog.record(company_clean, process_clean, next_v, path, processing_time, len(data))
+        _supabase_compact_previous(path, content)
         
         # Get Public URL
-        public_url = supabase_client.storage.from_(BUCKET_NAME).get_public_url(path)
+        public_url = _bucket().get_public_url(path)
         return public_url
         
     except Exception as e:
@@ -155,75 +201,47 @@ def _supabase_save(company: str, process_name: str, content: str, processing_tim
         return "error_saving_to_cloud"
 
 def _supabase_list():
-    docs = []
     try:
-        # We need to list folders first? Supabase list accepts folder path.
-        # Root list might return folders if empty path?
-        # Supabase storage doesn't really have folders, just paths.
-        # But `.list()` on root returns top level items.
-        
-        root_items = supabase_client.storage.from_(BUCKET_NAME).list()
-        
-        for item in root_items:
-            # If it's a folder (no metadata/id usually, or is_metadata check)
-            # Actually Supabase returns folders as items with id=None sometimes or mimetype
-            # Let's assume structure is Company/File.md
-            
-            # Recursive check or just explicit knowledge of companies?
-            # We implemented `list()` on root. It returns top-level folders?
-            # Let's try iterating.
-            
-            company_name = item['name']
-            
-            # List inside company folder
-            files = supabase_client.storage.from_(BUCKET_NAME).list(company_name)
-            
-            for f in files:
-                fname = f['name']
-                if fname.endswith(".md"):
-                    created_at = f.get('created_at', '')
-                    # Cleanup date format 2023-10-10T...
-                    if created_at:
-                        created_at = created_at.split('T')[0]
-                    
-                    # We can't peek content easily for metadata without downloading
-                    # So we skip processing_time for list view in Cloud mode for efficiency
-                    
-                    try:
-                        docs.append({
-                            "id": f"{company_name}/{fname}", # Store relative path as ID
-                            "company": company_name,
-                            "filename": fname,
-                            "name": fname.rsplit("_v", 1)[0].replace(f"{company_name}_", ""),
-                            "version": "v" + fname.rsplit("_v", 1)[1].replace(".md", ""),
-                            "date": created_at,
-                            "processing_time": 0 # Not available without extra read
-                        })
-                    except: continue
-                    
-        docs.sort(key=lambda x: x['date'], reverse=True)
-        return docs
-        
+        # One manifest download instead of a list call per company folder
+        return catalog.list_documents()
     except Exception as e:
         print(f"Supabase List Error: {e}")
         return []
 
-def _supabase_read(path: str) -> Optional[str]:
+def _supabase_compact_previous(path: str, content: str):
+    previous = version_store.version_path(path, version_store.version_of(path) - 1)
+    try:
+        stored = _supabase_read_raw(previous)
+        delta = version_store.compact(previous, stored, content) if stored is not None else None
+        if delta is not None:
+            _bucket().update(previous, delta.encode('utf-8'), {"content-type": "text/markdown"})
+    except Exception as e:
+        print(f"⚠️ Could not delta-compress {previous}: {e}")
+
+def _supabase_read_raw(path: str) -> Optional[str]:
     try:
         # Path is "Company/File.md"
-        data = supabase_client.storage.from_(BUCKET_NAME).download(path)
+        data = _bucket().download(path)
         return data.decode('utf-8')
     except Exception as e:
         print(f"Supabase Read Error: {e}")
         return None
 
+def _supabase_read(path: str) -> Optional[str]:
+    return version_store.resolve(path, _supabase_read_raw(path), _supabase_read_raw)
+
 # --- Main Interface ---
 
 def save_next_version(company: str, process_name: str, content: str, processing_time: float = 0.0) -> str:
     if use_cloud_storage():
-        return _supabase_save(company, process_name, content, processing_time)
+        path = _supabase_save(company, process_name, content, processing_time)
+        if path == "error_saving_to_cloud":
+            return path
     else:
-        return _local_save(company, process_name, content, processing_time)
+        path = _local_save(company, process_name, content, processing_time)
+    # The router index follows every save, so matching never has to load it
+    process_index.update(f"{sanitize_name(company)}/{sanitize_name(process_name)}", content)
+    return path
 
 def list_all_documents():
     if use_cloud_storage():
@@ -231,6 +249,73 @@ def list_all_documents():
     else:
         return _local_list()
 
+def encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        key = None
+    if not isinstance(key, list) or len(key) != 2:
+        raise ValueError("Invalid cursor")
+    return key
+
+def _day_start(day: str) -> datetime:
+    return datetime.strptime(day, "%Y-%m-%d")
+
+def _version_number(doc: dict) -> int:
+    return int(doc["version"][1:]) if doc["version"][1:].isdigit() else 0
+
+def _page_in_memory(docs: list[dict], company, process, date_from, date_to, latest_only, newest_first, limit, after):
+    """Filter/sort/page an already-loaded listing (manifest or filesystem scan) the same way the index does."""
+    if company:
+        docs = [d for d in docs if d["company"] == sanitize_name(company)]
+    if process:
+        docs = [d for d in docs if d["name"] == sanitize_name(process)]
+    if date_from:
+        docs = [d for d in docs if d["date"][:10] >= date_from]
+    if date_to:
+        docs = [d for d in docs if d["date"][:10] <= date_to]
+    if latest_only:
+        latest = {}
+        for d in docs:
+            key = (d["company"], d["name"])
+            if key not in latest or _version_number(d) > _version_number(latest[key]):
+                latest[key] = d
+        docs = list(latest.values())
+    docs = sorted(docs, key=lambda d: (d["date"], d["id"]), reverse=newest_first)
+    if after:
+        after = tuple(after)
+        docs = [d for d in docs if ((d["date"], d["id"]) < after if newest_first else (d["date"], d["id"]) > after)]
+    page = docs[:limit]
+    last = [page[-1]["date"], page[-1]["id"]] if len(docs) > limit else None
+    return page, last
+
+def query_documents(company: str = None, process: str = None, date_from: str = None, date_to: str = None,
+                    latest_only: bool = False, sort: str = "newest", limit: int = 50, cursor: str = None) -> dict:
+    """
+    One page of the document listing, filtered and sorted by the storage
+    backend. Dates are YYYY-MM-DD (both ends inclusive). Pass the returned
+    `next_cursor` back to get the following page; it is None on the last one.
+    """
+    newest_first = sort != "oldest"
+    after = decode_cursor(cursor) if cursor else None
+    if not use_cloud_storage() and KB_INDEX_ENABLED:
+        if not os.path.exists(KB_DIR):
+            return {"documents": [], "next_cursor": None}
+        docs, last = kb_index.query(
+            company=sanitize_name(company) if company else None,
+            process=sanitize_name(process) if process else None,
+            created_from=_day_start(date_from).timestamp() if date_from else None,
+            created_to=(_day_start(date_to) + timedelta(days=1)).timestamp() if date_to else None,
+            latest_only=latest_only, newest_first=newest_first, limit=limit, after=after,
+        )
+    else:
+        docs, last = _page_in_memory(list_all_documents(), company, process, date_from, date_to,
+                                     latest_only, newest_first, limit, after)
+    return {"documents": docs, "next_cursor": encode_cursor(last) if last else None}
+
 def read_document(path: str) -> Optional[str]:
     # Check if path looks like a Supabase URL or relative path
     # If using cloud, we expect path to be 'Company/File.md'
@@ -242,6 +327,28 @@ def read_document(path: str) -> Optional[str]:
     else:
         return _local_read(path)
 
+def document_fingerprint(path: str) -> Optional[dict]:
+    """{"sha256", "created"} of a stored version from the local index, without reading it; None if not indexed."""
+    if use_cloud_storage() or not KB_INDEX_ENABLED:
+        return None
+    full_path = _local_path(path)
+    row = kb_index.get(full_path) if full_path else None
+    return {"sha256": row["sha256"], "created": row["created"]} if row and row["sha256"] else None
+
+def read_sop_document(path: str) -> Optional[SOPDocument]:
+    """Parsed SOP for a stored version, cached (treat as read-only; use .copy() to edit)."""
+    if use_cloud_storage():
+        # Cloud versions are written once, the path identifies the content
+        return document_cache.get(("cloud", path), lambda: _supabase_read(path))
+    full_path = _local_path(path)
+    if not full_path:
+        return None
+    try:
+        stats = os.stat(full_path)
+    except OSError:
+        return None
+    return document_cache.get((full_path, stats.st_mtime_ns, stats.st_size), lambda: _local_read(full_path))
+
 # Stub for compatibility (not critical for Cloud)
 def init_knowledge_base():
     if not use_cloud_storage(): _local_init()
@@ -250,31 +357,18 @@ def get_latest_version(company_dir, base_name):
     return 0 # Not used externally much
 
 def load_latest_sop(company: str, process_name: str) -> Optional[str]:
-    """Loads the latest version of the SOP if it exists."""
+    """Loads the latest version of the SOP if it exists (without the storage header)."""
     if use_cloud_storage():
         # Cloud Logic
-        company_clean = sanitize_name(company)
-        base_filename = f"{company_clean}_{sanitize_name(process_name)}"
         try:
-            max_v = 0
-            latest_file = None
-            res = supabase_client.storage.from_(BUCKET_NAME).list(company_clean)
-            for file in res:
-                 name = file['name']
-                 if name.startswith(base_filename) and name.endswith(".md"):
-                     try:
-                        v = int(name.rsplit("_v", 1)[1].replace(".md", ""))
-                        if v > max_v:
-                            max_v = v
-                            latest_file = name
-                     except: continue
-            
-            if latest_file:
-                path = f"{company_clean}/{latest_file}"
-                return _supabase_read(path)
+            latest = catalog.latest(sanitize_name(company), sanitize_name(process_name))
+            if latest:
+                doc = read_sop_document(latest["path"])
+                return doc.content() if doc else None
+            return None
+        except Exception as e:
+            print(f"Supabase Read Error: {e}")
             return None
-        except:
-             return None
     else:
         # Local Logic
         company_clean = sanitize_name(company)
@@ -284,6 +378,12 @@ def load_latest_sop(company: str, process_name: str) -> Optional[str]:
         
         if not os.path.exists(company_dir):
             return None
+
+        if KB_INDEX_ENABLED:
+            latest = kb_index.latest(company_clean, process_clean)
+            if not latest: return None
+            doc = read_sop_document(latest["path"])
+            return doc.content() if doc else None
             
         max_v = 0
         for filename in os.listdir(company_dir):
@@ -296,45 +396,23 @@ def load_latest_sop(company: str, process_name: str) -> Optional[str]:
         if max_v == 0: return None
         
         file_path = os.path.join(company_dir, f"{base_filename}_v{max_v}.md")
-        return _local_read(file_path)
+        doc = read_sop_document(file_path)
+        return doc.content() if doc else None
 
 def get_all_process_identifiers() -> list[str]:
     """Returns a list of 'Company/ProcessName' string for all existing processes."""
     identifiers = []
     if use_cloud_storage():
-         # Cloud Logic
+        # Cloud Logic
         try:
-            # We assume folder structure: Company/
-            root_items = supabase_client.storage.from_(BUCKET_NAME).list()
-            for item in root_items:
-                company = item['name']
-                # List files in company
-                files = supabase_client.storage.from_(BUCKET_NAME).list(company)
-                seen = set()
-                for f in files:
-                    fname = f['name']
-                    if fname.endswith(".md") and "_v" in fname:
-                        try:
-                            # Org_Process_vN.md
-                            base = fname.rsplit("_v", 1)[0]
-                            # base is Company_Process
-                            # We want to extract Process.
-                            # But wait, sanitize_name might have removed separators?
-                            # Our convention: "{company_clean}_{process_clean}"
-                            # This is tricky to reverse if we don't know where the split is.
-                            # But generally name_part.replace(f"{company}_", "") works if company matches.
-                            
-                            process_part = base.replace(f"{company}_", "")
-                            full_id = f"{company}/{process_part}"
-                            if full_id not in seen:
-                                identifiers.append(full_id)
-                                seen.add(full_id)
-                        except: continue
-        except:
-            pass
+            identifiers = catalog.process_identifiers()
+        except Exception as e:
+            print(f"Supabase List Error: {e}")
     else:
         # Local Logic
         if not os.path.exists(KB_DIR): return []
+        if KB_INDEX_ENABLED:
+            return kb_index.process_identifiers()
         for company in os.listdir(KB_DIR):
             c_path = os.path.join(KB_DIR, company)
             if os.path.isdir(c_path):
@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+# Catalog of the SOP versions stored in the Supabase bucket. Each save writes
+# a small record object for its version under _catalog/ (a new object per
+# version, so concurrent saves can't overwrite each other), and the records
+# are folded into one manifest object so readers don't download them one by
+# one. The manifest remembers the newest record it has folded in, so a
+# refresh is one manifest download plus a newest-first listing of _catalog/
+# that stops there (usually a single page), instead of listing the root and
+# then every company folder. Only a bucket with no manifest at all is
+# rebuilt by listing the folders concurrently; any other read error is raised.
+MANIFEST_PATH = "_manifest.json"
+RECORDS_FOLDER = "_catalog"
+# Records are re-listed this far behind the watermark, for saves that were
+# still committing when the watermark was taken
+RECORDS_WATERMARK_SLACK = 60.0
+# Other workers may have saved since we last read the manifest
+MANIFEST_TTL = float(os.environ.get("SUPABASE_MANIFEST_TTL", "30"))
+SUPABASE_LIST_WORKERS = int(os.environ.get("SUPABASE_LIST_WORKERS", "8"))
+LIST_PAGE_SIZE = 1000
+
+
+def _parse_version_name(company: str, filename: str):
+    if not filename.endswith(".md") or "_v" not in filename:
+        return None
+    base, version = filename[:-3].rsplit("_v", 1)
+    try:
+        version = int(version)
+    except ValueError:
+        return None
+    process = base[len(company) + 1:] if base.startswith(f"{company}_") else base
+    return process, version
+
+
+def _is_not_found(error: Exception) -> bool:
+    detail = error.args[0] if error.args else None
+    if isinstance(detail, dict):
+        status = str(detail.get("statusCode") or detail.get("status") or "")
+        text = f"{detail.get('error', '')} {detail.get('message', '')}"
+    else:
+        status, text = str(getattr(error, "status", "") or ""), str(error)
+    return status == "404" or "not found" in text.lower()
+
+
+def _record_name(path: str) -> str:
+    # Sanitized company names have no '.', so the first one separates it from the file name
+    return path.replace("/", ".", 1) + ".json"
+
+
+def _parse_time(value: str):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+class SupabaseCatalog:
+    """Manifest-backed view of the bucket. `bucket_getter()` returns the storage bucket API (lazily created client)."""
+
+    def __init__(self, bucket_getter):
+        self._bucket = bucket_getter
+        self._entries = None
+        # created_at of the newest record the manifest covers
+        self._records_through = None
+        self._loaded_at = 0.0
+        self._lock = threading.RLock()
+
+    # --- manifest I/O ---
+
+    def _download(self):
+        """The manifest ({"versions": [...], "records_through": ...}), or None when there is no manifest."""
+        try:
+            data = self._bucket().download(MANIFEST_PATH)
+        except Exception as e:
+            if _is_not_found(e):
+                return None
+            raise
+        return json.loads(data.decode("utf-8"))
+
+    def _download_record(self, name: str) -> dict:
+        return json.loads(self._bucket().download(f"{RECORDS_FOLDER}/{name}").decode("utf-8"))
+
+    def _list_records(self, since) -> list[dict]:
+        """Listings of the records created after `since` (minus the slack; every record when None), newest first."""
+        since = _parse_time(since) if since else None
+        cutoff = since.timestamp() - RECORDS_WATERMARK_SLACK if since else None
+        items, offset = [], 0
+        while True:
+            page = self._bucket().list(RECORDS_FOLDER, {"limit": LIST_PAGE_SIZE, "offset": offset,
+                                                        "sortBy": {"column": "created_at", "order": "desc"}})
+            fresh = [item for item in page if cutoff is None or not _parse_time(item.get("created_at") or "")
+                     or _parse_time(item["created_at"]).timestamp() >= cutoff]
+            items.extend(fresh)
+            if len(page) < LIST_PAGE_SIZE or len(fresh) < len(page):
+                return items
+            offset += LIST_PAGE_SIZE
+
+    def _merge_records(self, entries: list[dict], since, all_records: bool = False):
+        """
+        `entries` updated with the records since `since` they don't cover yet
+        (every record with `all_records`). Returns (entries, whether any record
+        was read, created_at of the newest record seen).
+        """
+        by_path = {e["path"]: e for e in entries}
+        listed = [item for item in self._list_records(None if all_records else since) if item["name"].endswith(".json")]
+        times = [item["created_at"] for item in listed if _parse_time(item.get("created_at") or "")]
+        newest = max(times, key=lambda t: _parse_time(t), default=None)
+        if since and (newest is None or _parse_time(since) > _parse_time(newest)):
+            newest = since
+        known = set() if all_records else {_record_name(path) for path in by_path}
+        pending = [item["name"] for item in listed if item["name"] not in known]
+        if not pending:
+            return entries, False, newest
+        with ThreadPoolExecutor(max_workers=SUPABASE_LIST_WORKERS) as pool:
+            for record in pool.map(self._download_record, pending):
+                by_path[record["path"]] = record
+        return list(by_path.values()), True, newest
+
+    def _upload(self, entries: list[dict], records_through):
+        body = json.dumps({"versions": entries, "records_through": records_through,
+                           "updated_at": time.time()}).encode("utf-8")
+        self._bucket().upload(MANIFEST_PATH, body, {"content-type": "application/json", "upsert": "true"})
+
+    def _list_folder(self, folder: str = "") -> list[dict]:
+        items, offset = [], 0
+        while True:
+            page = self._bucket().list(folder, {"limit": LIST_PAGE_SIZE, "offset": offset})
+            items.extend(page)
+            if len(page) < LIST_PAGE_SIZE:
+                return items
+            offset += LIST_PAGE_SIZE
+
+    def rebuild(self) -> list[dict]:
+        """Entries of a bucket without a manifest, from listing every company folder concurrently."""
+        companies = [item["name"] for item in self._list_folder() if item["name"] not in (MANIFEST_PATH, RECORDS_FOLDER)]
+        with ThreadPoolExecutor(max_workers=SUPABASE_LIST_WORKERS) as pool:
+            listings = list(pool.map(self._list_folder, companies))
+
+        entries = []
+        for company, files in zip(companies, listings):
+            for f in files:
+                parsed = _parse_version_name(company, f["name"])
+                if not parsed:
+                    continue
+                entries.append({
+                    "company": company,
+                    "process": parsed[0],
+                    "version": parsed[1],
+                    "path": f"{company}/{f['name']}",
+                    "filename": f["name"],
+                    "created": f.get("created_at") or "",
+                    "processing_time": 0,  # Not known without reading the file
+                    "size": (f.get("metadata") or {}).get("size", 0),
+                })
+        print(f"Supabase catalog: rebuilt manifest from {len(companies)} folders ({len(entries)} versions).")
+        return entries
+
+    def _write_manifest(self, entries: list[dict], records_through):
+        # Only a cache of the records: a manifest written from an older read
+        # also has an older watermark, so readers list the missing records again
+        try:
+            self._upload(entries, records_through)
+        except Exception as e:
+            print(f"⚠️ Could not write Supabase manifest: {e}")
+
+    def entries(self, refresh: bool = False) -> list[dict]:
+        with self._lock:
+            if refresh or self._entries is None or time.time() - self._loaded_at > MANIFEST_TTL:
+                manifest = self._download()
+                rebuilt = manifest is None
+                if rebuilt:
+                    manifest = {"versions": self.rebuild()}
+                since = manifest.get("records_through")
+                # Records carry what a rebuild can't know (processing time), so they win
+                entries, added, records_through = self._merge_records(manifest["versions"], since, all_records=rebuilt)
+                if rebuilt or added or records_through != since:
+                    self._write_manifest(entries, records_through)
+                self._entries = entries
+                self._records_through = records_through
+                self._loaded_at = time.time()
+            return self._entries
+
+    # --- queries ---
+
+    def latest(self, company: str, process: str):
+        versions = [e for e in self.entries() if e["company"] == company and e["process"] == process]
+        return max(versions, key=lambda e: e["version"]) if versions else None
+
+    def next_version(self, company: str, process: str) -> int:
+        with self._lock:
+            latest = [e["version"] for e in self.entries(refresh=True)
+                      if e["company"] == company and e["process"] == process]
+            return max(latest, default=0) + 1
+
+    def record(self, company: str, process: str, version: int, path: str, processing_time: float, size: int):
+        """Writes the record of a saved version, then folds it into the manifest."""
+        entry = {
+            "company": company,
+            "process": process,
+            "version": version,
+            "path": path,
+            "filename": path.rsplit("/", 1)[-1],
+            "created": datetime.now(timezone.utc).isoformat(),
+            "processing_time": processing_time,
+            "size": size,
+        }
+        self._bucket().upload(f"{RECORDS_FOLDER}/{_record_name(path)}", json.dumps(entry).encode("utf-8"),
+                              {"content-type": "application/json", "upsert": "true"})
+        with self._lock:
+            # next_version() has just refreshed; readers pick up other workers' records from _catalog/
+            entries = [e for e in self.entries() if e["path"] != path] + [entry]
+            self._entries = entries
+            self._write_manifest(entries, self._records_through)
+
+    def list_documents(self) -> list[dict]:
+        docs = [{
+            "id": e["path"],
+            "company": e["company"],
+            "filename": e["filename"],
+            "name": e["process"],
+            "version": f"v{e['version']}",
+            "date": e["created"][:16].replace("T", " "),
+            "processing_time": e["processing_time"],
+        } for e in self.entries()]
+        docs.sort(key=lambda x: x["date"], reverse=True)
+        return docs
+
+    def process_identifiers(self) -> list[str]:
+        seen = {}
+        for e in self.entries():
+            if e["filename"].startswith(f"{e['company']}_"):
+                seen.setdefault(f"{e['company']}/{e['process']}", None)
+        return list(seen)
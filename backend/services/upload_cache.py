@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
+from datetime import datetime
+
+# Content-addressed cache of files already uploaded to Gemini:
+#   sha256 of the local bytes -> remote file name (+ expiry)
+# Repeat evidence (the same rate card PDF, a re-analysed recording) skips
+# both the upload and the server-side processing wait.
+GEMINI_FILE_CACHE_ENABLED = os.environ.get("GEMINI_FILE_CACHE_ENABLED", "1") == "1"
+GEMINI_FILE_CACHE_PATH = os.environ.get("GEMINI_FILE_CACHE_PATH", os.path.join("uploads", "gemini_file_cache.json"))
+GEMINI_FILE_CACHE_MAX_ENTRIES = int(os.environ.get("GEMINI_FILE_CACHE_MAX_ENTRIES", "500"))
+# Gemini caps a project's stored files (20 GB); stay well below it
+GEMINI_FILE_CACHE_MAX_BYTES = int(os.environ.get("GEMINI_FILE_CACHE_MAX_BYTES", str(15 * 1024 ** 3)))
+# Remote files expire 48h after upload; stop handing them out a bit earlier
+GEMINI_FILE_TTL_SECONDS = 48 * 3600
+EXPIRY_SAFETY_MARGIN = 2 * 3600
+# Changes are written out at most this often, from a background thread
+PERSIST_DELAY_SECONDS = 2.0
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def sha256_file(path: str) -> str:
+    """Streaming SHA-256 of a local file (constant memory)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_and_hash(src, dest_path: str) -> tuple[str, int]:
+    """Copies a file object to disk in fixed-size blocks, hashing on the way. Returns (sha256, size)."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(dest_path, "wb+") as out:
+        for block in iter(lambda: src.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+            out.write(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def _expiry_of(g_file) -> float:
+    expiration = getattr(g_file, "expiration_time", None)
+    if isinstance(expiration, datetime):
+        return expiration.timestamp()
+    return time.time() + GEMINI_FILE_TTL_SECONDS
+
+
+class GeminiFileCache:
+    """Persistent LRU map of content hash -> remote Gemini file, with hit/miss counters."""
+
+    def __init__(self, path: str = GEMINI_FILE_CACHE_PATH, max_entries: int = GEMINI_FILE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = GEMINI_FILE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flush_timer = None
+        self._entries = self._load()
+        atexit.register(self.flush)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _persist(self):
+        """Schedules a write of the entries (called with the lock held); changes in the meantime share it."""
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(PERSIST_DELAY_SECONDS, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """Writes pending changes now."""
+        with self._lock:
+            if self._flush_timer is None:
+                return
+            self._flush_timer.cancel()
+            self._flush_timer = None
+            data = json.dumps(self._entries)
+        with self._write_lock:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"⚠️ Could not write upload cache: {e}")
+
+    def get(self, sha256: str):
+        """Returns the cache entry for this content if its remote file is still valid."""
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry and entry["expires_at"] - EXPIRY_SAFETY_MARGIN > time.time():
+                self.hits += 1
+                entry["last_used"] = time.time()
+                self._persist()
+                return dict(entry)
+            if entry:
+                # Close to expiry: the remote copy dies on its own, just forget it
+                self.expirations += 1
+                del self._entries[sha256]
+                self._persist()
+            self.misses += 1
+            return None
+
+    def put(self, sha256: str, g_file) -> list[str]:
+        """Records an uploaded file. Returns remote names evicted to make room (caller deletes them)."""
+        with self._lock:
+            self._entries[sha256] = {
+                "name": g_file.name,
+                "uri": getattr(g_file, "uri", None),
+                "mime_type": getattr(g_file, "mime_type", None),
+                "size_bytes": int(getattr(g_file, "size_bytes", 0) or 0),
+                "expires_at": _expiry_of(g_file),
+                "last_used": time.time(),
+            }
+            evicted = self._evict()
+            self._persist()
+            return evicted
+
+    def discard(self, sha256: str):
+        """Forgets an entry whose remote file turned out to be gone."""
+        with self._lock:
+            if self._entries.pop(sha256, None):
+                self._persist()
+
+    def owns(self, remote_name: str) -> bool:
+        with self._lock:
+            return any(e["name"] == remote_name for e in self._entries.values())
+
+    def _evict(self) -> list[str]:
+        evicted = []
+        by_age = sorted(self._entries.items(), key=lambda kv: kv[1]["last_used"])
+        total_bytes = sum(e["size_bytes"] for e in self._entries.values())
+        for sha256, entry in by_age:
+            if len(self._entries) <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            del self._entries[sha256]
+            total_bytes -= entry["size_bytes"]
+            evicted.append(entry["name"])
+            self.evictions += 1
+        return evicted
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(e["size_bytes"] for e in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+file_cache = GeminiFileCache()
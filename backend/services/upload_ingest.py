@@ -0,0 +1,230 @@
+import os
+import re
+import uuid
+import shutil
+import hashlib
+import asyncio
+import mimetypes
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# Uploads are spooled into one directory per request, so identically named
+# files (every extension chunk is recording_<ms>.webm) never overwrite each
+# other mid-analysis, and the whole directory goes away with the job.
+UPLOAD_DIR = "uploads"
+INGEST_BLOCK_SIZE = 1024 * 1024
+MAX_UPLOAD_FILE_BYTES = int(os.environ.get("MAX_UPLOAD_FILE_BYTES", str(5 * 1024 ** 3)))
+MAX_UPLOAD_REQUEST_BYTES = int(os.environ.get("MAX_UPLOAD_REQUEST_BYTES", str(10 * 1024 ** 3)))
+# Non-file form fields (file_contexts, session_id, ...) are small
+MAX_FORM_FIELD_BYTES = 1024 * 1024
+# Keep request directories after the job (debugging)
+KEEP_UPLOADS = os.environ.get("KEEP_UPLOADS", "0") == "1"
+
+_UNSAFE_CHARS_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class UploadTooLarge(Exception):
+    """An upload exceeded MAX_UPLOAD_FILE_BYTES or MAX_UPLOAD_REQUEST_BYTES."""
+
+
+class MalformedUpload(Exception):
+    """The request body isn't the multipart form it should be."""
+
+
+class IngestedFile:
+    """One upload spooled to disk: where it is, what it was called, and what it contains."""
+
+    def __init__(self, path: str, filename: str, mime_type: str, sha256: str, size: int):
+        self.path = path
+        self.filename = filename
+        self.mime_type = mime_type
+        self.sha256 = sha256
+        self.size = size
+
+    def to_dict(self) -> dict:
+        return {"path": self.path, "filename": self.filename, "mime_type": self.mime_type,
+                "sha256": self.sha256, "size": self.size}
+
+    def __repr__(self):
+        return f"IngestedFile({self.filename!r}, {self.size} bytes, {self.sha256[:12]})"
+
+
+def safe_filename(filename: str, index: int) -> str:
+    """Client names are untrusted: drop directories and odd characters, prefix with the upload's position."""
+    name = _UNSAFE_CHARS_RE.sub("_", os.path.basename(filename or "")).strip("._") or "upload"
+    return f"{index:02d}_{name}"
+
+
+def new_request_dir(base_dir: str = UPLOAD_DIR) -> str:
+    request_dir = os.path.join(base_dir, uuid.uuid4().hex)
+    os.makedirs(request_dir, exist_ok=True)
+    return request_dir
+
+
+def _write_block(out, digest, block: bytes):
+    digest.update(block)
+    out.write(block)
+
+
+async def _spool(upload, dest_path: str, budget: int) -> tuple[str, int]:
+    """Copies one UploadFile to disk block by block, hashing as it goes. Returns (sha256, size)."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(dest_path, "wb") as out:
+        while True:
+            block = await upload.read(INGEST_BLOCK_SIZE)
+            if not block:
+                break
+            size += len(block)
+            if size > MAX_UPLOAD_FILE_BYTES:
+                raise UploadTooLarge(f"{upload.filename} is larger than {MAX_UPLOAD_FILE_BYTES} bytes")
+            if size > budget:
+                raise UploadTooLarge(f"Request is larger than {MAX_UPLOAD_REQUEST_BYTES} bytes")
+            await asyncio.to_thread(_write_block, out, digest, block)
+    return digest.hexdigest(), size
+
+
+async def ingest_uploads(files: list, request_dir: str) -> list[IngestedFile]:
+    """
+    Spools UploadFiles into `request_dir` without blocking the event loop.
+    Size limits are checked before writing (when the client declared sizes)
+    and again while streaming; on any failure the directory is removed.
+    """
+    ingested = []
+    remaining = MAX_UPLOAD_REQUEST_BYTES
+    try:
+        declared = [getattr(f, "size", None) for f in files]
+        if any(size and size > MAX_UPLOAD_FILE_BYTES for size in declared):
+            raise UploadTooLarge(f"A file is larger than {MAX_UPLOAD_FILE_BYTES} bytes")
+        if sum(size or 0 for size in declared) > MAX_UPLOAD_REQUEST_BYTES:
+            raise UploadTooLarge(f"Request is larger than {MAX_UPLOAD_REQUEST_BYTES} bytes")
+
+        for index, upload in enumerate(files):
+            dest_path = os.path.join(request_dir, safe_filename(upload.filename, index))
+            sha256, size = await _spool(upload, dest_path, remaining)
+            remaining -= size
+            mime_type = upload.content_type or mimetypes.guess_type(upload.filename or "")[0] or "application/octet-stream"
+            ingested.append(IngestedFile(dest_path, upload.filename, mime_type, sha256, size))
+    except BaseException:
+        discard_request_dir(request_dir, force=True)
+        raise
+    return ingested
+
+
+class _PartEvents:
+    """MultipartParser callbacks; they run inside parser.write(), so they only record what happened."""
+
+    def __init__(self):
+        self.events = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda data, start, end: self._add("_header_field", data[start:end]),
+            "on_header_value": lambda data, start, end: self._add("_header_value", data[start:end]),
+            "on_header_end": self._header_end,
+            "on_headers_finished": lambda: self.events.append(("begin", self._headers)),
+            "on_part_data": lambda data, start, end: self.events.append(("data", bytes(data[start:end]))),
+            "on_part_end": lambda: self.events.append(("end", None)),
+        }
+
+    def _add(self, name: str, data: bytes):
+        setattr(self, name, getattr(self, name) + data)
+
+    def _part_begin(self):
+        self._headers = {}
+
+    def _header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+
+async def ingest_multipart(request, request_dir: str, file_field: str = "files") -> tuple[list[IngestedFile], dict]:
+    """
+    Streams a multipart/form-data request straight into `request_dir`, so the
+    size limits apply before anything is buffered (a declared Content-Length
+    over the limit is refused before reading at all) and each file is
+    written once. Returns the `file_field` files and the other fields as
+    strings. On any failure the directory is removed.
+    """
+    try:
+        declared = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        discard_request_dir(request_dir, force=True)
+        raise MalformedUpload("Invalid Content-Length header")
+    if declared > MAX_UPLOAD_REQUEST_BYTES:
+        discard_request_dir(request_dir, force=True)
+        raise UploadTooLarge(f"Request is larger than {MAX_UPLOAD_REQUEST_BYTES} bytes")
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        discard_request_dir(request_dir, force=True)
+        raise MalformedUpload("Expected a multipart/form-data body")
+
+    parts = _PartEvents()
+    parser = MultipartParser(params[b"boundary"], parts.callbacks())
+    ingested, fields = [], {}
+    received = 0
+    out = field = None
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_UPLOAD_REQUEST_BYTES:
+                raise UploadTooLarge(f"Request is larger than {MAX_UPLOAD_REQUEST_BYTES} bytes")
+            parser.write(chunk)
+            for kind, value in parts.events:
+                if kind == "begin":
+                    _, disposition = parse_options_header(value.get(b"content-disposition", b""))
+                    name = disposition.get(b"name", b"").decode("utf-8", "replace")
+                    filename = disposition.get(b"filename")
+                    if filename is not None and name == file_field:
+                        filename = filename.decode("utf-8", "replace")
+                        mime_type = value.get(b"content-type", b"").decode("latin-1") \
+                            or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                        dest_path = os.path.join(request_dir, safe_filename(filename, len(ingested)))
+                        out = (open(dest_path, "wb"), hashlib.sha256(), IngestedFile(dest_path, filename, mime_type, "", 0))
+                    else:
+                        field = (name, bytearray())
+                elif kind == "data" and out:
+                    handle, digest, ingested_file = out
+                    ingested_file.size += len(value)
+                    if ingested_file.size > MAX_UPLOAD_FILE_BYTES:
+                        raise UploadTooLarge(f"{ingested_file.filename} is larger than {MAX_UPLOAD_FILE_BYTES} bytes")
+                    await asyncio.to_thread(_write_block, handle, digest, value)
+                elif kind == "data" and field:
+                    field[1].extend(value)
+                    if len(field[1]) > MAX_FORM_FIELD_BYTES:
+                        raise UploadTooLarge(f"Form field {field[0]!r} is larger than {MAX_FORM_FIELD_BYTES} bytes")
+                elif kind == "end" and out:
+                    handle, digest, ingested_file = out
+                    handle.close()
+                    ingested_file.sha256 = digest.hexdigest()
+                    ingested.append(ingested_file)
+                    out = None
+                elif kind == "end" and field:
+                    fields[field[0]] = field[1].decode("utf-8", "replace")
+                    field = None
+            parts.events.clear()
+        parser.finalize()
+        if out or field:
+            raise MalformedUpload("Request body ended in the middle of a part")
+    except MultipartParseError as e:
+        if out:
+            out[0].close()
+        discard_request_dir(request_dir, force=True)
+        raise MalformedUpload(str(e))
+    except BaseException:
+        if out:
+            out[0].close()
+        discard_request_dir(request_dir, force=True)
+        raise
+    return ingested, fields
+
+
+def discard_request_dir(request_dir: str, force: bool = False):
+    """Removes a request's spooled uploads and everything derived from them (chunks, proxies)."""
+    if KEEP_UPLOADS and not force:
+        return
+    shutil.rmtree(request_dir, ignore_errors=True)
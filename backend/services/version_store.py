@@ -0,0 +1,197 @@
+import os
+import re
+import sys
+import json
+import difflib
+from typing import Callable, Optional
+from .sop_document import parse_storage_header, format_storage_header
+
+# Consecutive versions of a process (an extension session saves one every
+# 20 minutes) differ by a few sections, so only the latest version and a
+# snapshot every SNAPSHOT_INTERVAL versions are stored in full. Every other
+# version keeps its file name but holds a reverse delta against the next
+# version:
+#   <!-- metadata:processing_time=12.5 -->   (its storage header, kept readable)
+#   <!-- metadata:delta_base=7 -->
+#   [[0, 40], "new line\n", [52, 9], ...]    ([start, count] copies base lines)
+# Reading the latest version is a plain file read; an older one applies at
+# most SNAPSHOT_INTERVAL - 1 deltas, walking forward to a full copy.
+VERSION_DELTAS_ENABLED = os.environ.get("VERSION_DELTAS_ENABLED", "1") == "1"
+SNAPSHOT_INTERVAL = max(1, int(os.environ.get("VERSION_SNAPSHOT_INTERVAL", "10")))
+DELTA_KEY = "delta_base"
+
+_VERSION_RE = re.compile(r"_v(\d+)\.md$")
+
+
+def version_of(path: str) -> Optional[int]:
+    match = _VERSION_RE.search(path)
+    return int(match.group(1)) if match else None
+
+
+def version_path(path: str, version: int) -> str:
+    """The path of another version of the same process ('.../Acme_Billing_v3.md', 4 -> '.../Acme_Billing_v4.md')."""
+    return _VERSION_RE.sub(f"_v{version}.md", path)
+
+
+def is_snapshot(version: int) -> bool:
+    return (version - 1) % SNAPSHOT_INTERVAL == 0
+
+
+def _split_header(text: str):
+    """(storage header lines, delta base version or None, rest of the text)."""
+    header, base = [], None
+    lines = text.split("\n")
+    index = 0
+    while index < len(lines):
+        parsed = parse_storage_header(lines[index])
+        if not parsed:
+            break
+        if parsed[0] == DELTA_KEY:
+            base = int(parsed[1])
+        else:
+            header.append(lines[index])
+        index += 1
+    return header, base, "\n".join(lines[index:])
+
+
+def delta_base(text: str) -> Optional[int]:
+    """The version a stored delta applies to; None for a full copy."""
+    return _split_header(text)[1]
+
+
+def make_delta(target: str, base: str, base_version: int) -> str:
+    """Stored form of `target` as edits of `base` (version `base_version`)."""
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2 - i1])
+        elif j2 > j1:
+            ops.append("".join(target_lines[j1:j2]))
+    header = _split_header(target)[0]
+    return "\n".join(header + [format_storage_header(DELTA_KEY, base_version), json.dumps(ops, ensure_ascii=False)])
+
+
+def apply_delta(delta: str, base: str) -> str:
+    ops = json.loads(_split_header(delta)[2])
+    base_lines = base.splitlines(keepends=True)
+    out = []
+    for op in ops:
+        if isinstance(op, str):
+            out.append(op)
+        else:
+            start, count = op
+            out.extend(base_lines[start:start + count])
+    return "".join(out)
+
+
+def resolve(path: str, text: Optional[str], read_raw: Callable[[str], Optional[str]]) -> Optional[str]:
+    """
+    Full content of the version stored at `path` (`text` is its stored form).
+    Follows delta bases forward until a full copy; `read_raw` reads a stored version.
+    """
+    chain = []
+    seen = set()
+    while text is not None:
+        base = delta_base(text)
+        if base is None:
+            break
+        if base in seen:
+            raise ValueError(f"Delta cycle at {path}")
+        seen.add(base)
+        chain.append(text)
+        path = version_path(path, base)
+        text = read_raw(path)
+    if text is None:
+        if chain:
+            print(f"⚠️ Version store: missing base {path} for a stored delta")
+        return None
+    for delta in reversed(chain):
+        text = apply_delta(delta, text)
+    return text
+
+
+def compact(path: str, full_text: str, newer_text: str) -> Optional[str]:
+    """
+    Stored form for the version at `path` once the next version (`newer_text`,
+    full content) is saved: a delta, or None to keep the full copy (snapshots,
+    or when the delta wouldn't be smaller).
+    """
+    version = version_of(path)
+    if not VERSION_DELTAS_ENABLED or version is None or is_snapshot(version) or delta_base(full_text) is not None:
+        return None
+    delta = make_delta(full_text, newer_text, version + 1)
+    return delta if len(delta) < len(full_text) else None
+
+
+def compact_local_file(path: str, newer_text: str) -> Optional[int]:
+    """Rewrites a local full copy as a delta against the next version. Returns the new size, or None if unchanged."""
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            full_text = f.read()
+        stats = os.stat(path)
+    except OSError:
+        return None
+    delta = compact(path, full_text, newer_text)
+    if delta is None:
+        return None
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(delta)
+    os.replace(tmp_path, path)
+    # The listing dates versions by modification time
+    os.utime(path, ns=(stats.st_atime_ns, stats.st_mtime_ns))
+    return len(delta.encode("utf-8"))
+
+
+def _read_local(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def compact_local_tree(kb_dir: str) -> tuple[int, int]:
+    """Delta-compresses every stored version of every process. Returns (bytes before, bytes after)."""
+    before = after = 0
+    for company in sorted(os.listdir(kb_dir)):
+        company_dir = os.path.join(kb_dir, company)
+        if not os.path.isdir(company_dir):
+            continue
+        processes = {}
+        for filename in os.listdir(company_dir):
+            version = version_of(filename)
+            if version is not None:
+                processes.setdefault(_VERSION_RE.sub("", filename), []).append(version)
+        for base_name, versions in processes.items():
+            versions.sort()
+            # Newest first: each version is compacted against the full text of the next one
+            newer_text = None
+            newer_version = None
+            for version in reversed(versions):
+                path = os.path.join(company_dir, f"{base_name}_v{version}.md")
+                stored = _read_local(path)
+                size = os.path.getsize(path)
+                before += size
+                full_text = resolve(path, stored, _read_local)
+                if newer_text is not None and newer_version == version + 1 and delta_base(stored) is None:
+                    size = compact_local_file(path, newer_text) or size
+                after += size
+                newer_text, newer_version = full_text, version
+    return before, after
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["compact"]:
+        print("Usage: python -m services.version_store compact")
+        sys.exit(1)
+    from .kb_index import kb_index, KB_DIR
+    if not os.path.isdir(KB_DIR):
+        print(f"No knowledge base at {KB_DIR}")
+        sys.exit(1)
+    before, after = compact_local_tree(KB_DIR)
+    kb_index.rebuild(KB_DIR)
+    print(f"Compacted {KB_DIR}: {before} -> {after} bytes")
@@ -1,16 +1,59 @@
 import os
+import csv
+import glob
+import json
+import bisect
+import asyncio
 import subprocess
 import math
+from concurrent.futures import ThreadPoolExecutor
 
-CHUNK_DURATION = 1200  # 20 minutes in seconds
+CHUNK_DURATION = 1200  # 20 minutes in seconds (upper bound per chunk)
+
+# Adaptive chunk sizing: a chunk is as long as possible while staying under
+# both the upload size target and the model token budget.
+TARGET_CHUNK_BYTES = int(os.environ.get("TARGET_CHUNK_BYTES", str(500 * 1024 * 1024)))
+CHUNK_TOKEN_BUDGET = int(os.environ.get("CHUNK_TOKEN_BUDGET", "400000"))
+MAX_CHUNK_DURATION = float(os.environ.get("MAX_CHUNK_DURATION", str(CHUNK_DURATION)))
+MIN_CHUNK_DURATION = float(os.environ.get("MIN_CHUNK_DURATION", "120"))
+# Seconds each chunk re-includes from the end of the previous one, so steps
+# spanning a boundary are seen whole by at least one chunk. 0 disables.
+CHUNK_OVERLAP = float(os.environ.get("CHUNK_OVERLAP", "0"))
+
+# Gemini samples video at (up to) 1 frame per second with a fixed per-frame
+# cost (resolution changes bytes, not tokens), plus a flat audio rate.
+# The scheduler's TPM estimates use the same rates.
+VIDEO_TOKENS_PER_FRAME = int(os.environ.get("VIDEO_TOKENS_PER_FRAME", "258"))
+AUDIO_TOKENS_PER_SECOND = 32
+# A second of recording with sound at the 1 fps sampling rate
+VIDEO_TOKENS_PER_SECOND = VIDEO_TOKENS_PER_FRAME + AUDIO_TOKENS_PER_SECOND
+
+# Parallel cuts in the fallback path (each ffmpeg is its own process)
+SPLIT_WORKERS = int(os.environ.get("SPLIT_WORKERS", str(os.cpu_count() or 2)))
+
+# Proxy transcoding: re-encode chunks to a small, UI-legible rendition before
+# upload. "auto" keeps the proxy only when it is materially smaller,
+# "force" always uses it, "off" disables the stage.
+VIDEO_PROXY_MODE = os.environ.get("VIDEO_PROXY_MODE", "auto")
+VIDEO_PROXY_PROFILE = os.environ.get("VIDEO_PROXY_PROFILE", "ui-720p")
+# Keep the proxy only if it is at most this fraction of the original size
+PROXY_MIN_RATIO = float(os.environ.get("PROXY_MIN_RATIO", "0.7"))
+PROXY_PROFILES = {
+    # Screen text stays readable at 720p; Gemini samples 1 fps anyway
+    "ui-720p": {"height": 720, "fps": 5, "crf": 30},
+    "ui-1080p": {"height": 1080, "fps": 5, "crf": 32},
+    "ui-540p": {"height": 540, "fps": 2, "crf": 28},
+}
+# x264 is multi-threaded itself, so run a few encodes side by side and split the cores between them
+PROXY_WORKERS = int(os.environ.get("PROXY_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
 
 def get_video_duration(video_path: str) -> float:
     """Returns the duration of the video in seconds."""
     cmd = [
-        "ffprobe", 
-        "-v", "error", 
-        "-show_entries", "format=duration", 
-        "-of", "default=noprint_wrappers=1:nokey=1", 
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
         video_path
     ]
     result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
@@ -19,42 +62,308 @@ def get_video_duration(video_path: str) -> float:
     except ValueError:
         raise Exception(f"Could not determine video duration. Error: {result.stderr}")
 
-def split_video(video_path: str, output_dir: str) -> list[str]:
-    """Splits video into 20-minute chunks and returns list of file paths."""
+def probe_video(video_path: str) -> dict:
+    """Returns duration, size, bitrate, resolution, fps and audio presence of a video."""
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration,size,bit_rate:stream=codec_type,width,height,avg_frame_rate",
+        "-of", "json",
+        video_path
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        data = json.loads(result.stdout)
+        fmt = data.get("format", {})
+        duration = float(fmt["duration"])
+    except (ValueError, KeyError):
+        raise Exception(f"Could not probe video. Error: {result.stderr}")
+
+    size = int(fmt.get("size") or os.path.getsize(video_path))
+    info = {
+        "duration": duration,
+        "size": size,
+        "bit_rate": int(fmt.get("bit_rate") or (size * 8 / duration if duration else 0)),
+        "width": 0,
+        "height": 0,
+        "fps": 0.0,
+        "has_audio": False,
+    }
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and not info["width"]:
+            info["width"] = stream.get("width") or 0
+            info["height"] = stream.get("height") or 0
+            try:
+                num, den = stream.get("avg_frame_rate", "0/1").split("/")
+                info["fps"] = float(num) / float(den) if float(den) else 0.0
+            except ValueError:
+                pass
+        elif stream.get("codec_type") == "audio":
+            info["has_audio"] = True
+    return info
+
+def estimate_tokens_per_second(info: dict) -> float:
+    """Approximate model tokens consumed per second of this video."""
+    sampled_fps = min(info["fps"], 1.0) if info["fps"] else 1.0
+    tokens = sampled_fps * VIDEO_TOKENS_PER_FRAME
+    if info["has_audio"]:
+        tokens += AUDIO_TOKENS_PER_SECOND
+    return tokens
+
+def plan_chunk_duration(info: dict) -> float:
+    """
+    Picks the chunk length from the upload size target and the token budget,
+    then evens it out so the last chunk is not a tiny remainder.
+    """
+    bytes_per_second = info["size"] / info["duration"] if info["duration"] else 0
+    limits = [MAX_CHUNK_DURATION]
+    if bytes_per_second:
+        limits.append(TARGET_CHUNK_BYTES / bytes_per_second)
+    limits.append(CHUNK_TOKEN_BUDGET / estimate_tokens_per_second(info))
+    # The overlap is paid by every chunk, so leave room for it
+    chunk = max(MIN_CHUNK_DURATION, min(limits) - CHUNK_OVERLAP)
+
+    num_chunks = math.ceil(info["duration"] / chunk)
+    return info["duration"] / num_chunks
+
+def get_keyframe_times(video_path: str) -> list[float]:
+    """Keyframe timestamps of the first video stream (packet flags only, no decoding)."""
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        video_path
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    times = []
+    for line in result.stdout.splitlines():
+        parts = line.split(",")
+        if len(parts) >= 2 and "K" in parts[1]:
+            try:
+                times.append(float(parts[0]))
+            except ValueError:
+                continue
+    return sorted(times)
+
+def _snap_to_keyframe(t: float, keyframes: list[float]) -> float:
+    """Latest keyframe at or before t (stream copy can only start on one)."""
+    if not keyframes:
+        return t
+    i = bisect.bisect_right(keyframes, t)
+    return keyframes[i - 1] if i else keyframes[0]
+
+def plan_overlapping_segments(duration: float, chunk_duration: float, overlap: float, keyframes: list[float]) -> list[tuple[float, float]]:
+    """Keyframe-aligned (start, end) pairs where each chunk re-includes `overlap` seconds of the previous one."""
+    num_chunks = math.ceil(duration / chunk_duration)
+    boundaries = [0.0] + [_snap_to_keyframe(i * chunk_duration, keyframes) for i in range(1, num_chunks)] + [duration]
+    plan = []
+    for i in range(num_chunks):
+        start = boundaries[i]
+        if i > 0 and overlap > 0:
+            start = _snap_to_keyframe(max(0.0, start - overlap), keyframes)
+        plan.append((start, boundaries[i + 1]))
+    return plan
+
+def _remove_stale_parts(output_dir: str, base_name: str, ext: str):
+    for old in glob.glob(os.path.join(glob.escape(output_dir), f"{glob.escape(base_name)}_part*{ext}")):
+        os.remove(old)
+
+def _split_single_pass(video_path: str, output_dir: str, base_name: str, ext: str, segment_time: float) -> list[dict]:
+    """
+    Cuts every chunk in ONE read of the input using ffmpeg's segment muxer.
+    With stream copy the muxer can only cut on keyframes, so each segment
+    starts on the first keyframe at or after its nominal boundary; the real
+    boundaries are read back from the segment list.
+    """
+    pattern = os.path.join(output_dir, f"{base_name}_part%d{ext}")
+    segment_list = os.path.join(output_dir, f"{base_name}_segments.csv")
+    cmd = [
+        "ffmpeg",
+        "-i", video_path,
+        "-map", "0",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(segment_time),
+        "-segment_start_number", "1",
+        "-segment_list", segment_list,
+        "-segment_list_type", "csv",
+        "-reset_timestamps", "1",
+        "-y",
+        pattern
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    segments = []
+    try:
+        with open(segment_list, newline="") as f:
+            for row in csv.reader(f):
+                if len(row) < 3:
+                    continue
+                segments.append({
+                    "path": os.path.join(output_dir, row[0]),
+                    "start": float(row[1]),
+                    "end": float(row[2]),
+                })
+    finally:
+        if os.path.exists(segment_list):
+            os.remove(segment_list)
+    return segments
+
+def _cut_segment(video_path: str, chunk_path: str, start_time: float, duration: float):
+    # -ss before -i seeks in the input (jumps to the nearest keyframe)
+    # instead of decoding everything up to `start_time`.
+    cmd = [
+        "ffmpeg",
+        "-ss", str(start_time),
+        "-i", video_path,
+        "-t", str(duration),
+        "-map", "0",
+        "-c", "copy",  # Fast copy without re-encoding
+        "-avoid_negative_ts", "make_zero",
+        "-y",          # Overwrite output
+        chunk_path
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def _split_parallel_seek(video_path: str, output_dir: str, base_name: str, ext: str, plan: list[tuple[float, float]]) -> list[dict]:
+    """Cuts the planned (start, end) ranges with one input-seeking ffmpeg each, in parallel."""
+    segments = [
+        {"path": os.path.join(output_dir, f"{base_name}_part{i+1}{ext}"), "start": start, "end": end}
+        for i, (start, end) in enumerate(plan)
+    ]
+
+    with ThreadPoolExecutor(max_workers=SPLIT_WORKERS) as pool:
+        futures = [
+            pool.submit(_cut_segment, video_path, seg["path"], seg["start"], seg["end"] - seg["start"])
+            for seg in segments
+        ]
+        for future in futures:
+            future.result()
+    return segments
+
+def split_video_segments(video_path: str, output_dir: str) -> list[dict]:
+    """
+    Splits video into chunks sized by upload bytes and token budget (at most
+    MAX_CHUNK_DURATION each), optionally overlapping by CHUNK_OVERLAP seconds.
+    Returns [{"path", "start", "end"}] with offsets (seconds) into the original video.
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    duration = get_video_duration(video_path)
+    info = probe_video(video_path)
+    duration = info["duration"]
     file_name = os.path.basename(video_path)
     base_name, ext = os.path.splitext(file_name)
-    
-    chunks = []
-    
-    # If video is shorter than chunk limit, return original
-    if duration <= CHUNK_DURATION:
-        return [video_path]
 
-    num_chunks = math.ceil(duration / CHUNK_DURATION)
-    
-    print(f"Video duration: {duration}s. Splitting into {num_chunks} chunks...")
+    chunk_duration = plan_chunk_duration(info)
 
-    for i in range(num_chunks):
-        start_time = i * CHUNK_DURATION
-        chunk_path = os.path.join(output_dir, f"{base_name}_part{i+1}{ext}")
-        
-        # ffmpeg command to slice
-        cmd = [
-            "ffmpeg",
-            "-i", video_path,
-            "-ss", str(start_time),
-            "-t", str(CHUNK_DURATION),
-            "-c", "copy",  # Fast copy without re-encoding
-            "-y",          # Overwrite output
-            chunk_path
-        ]
-        
+    # If the whole video fits in one chunk, return original
+    if chunk_duration >= duration:
+        return [{"path": video_path, "start": 0.0, "end": duration}]
+
+    print(f"Video duration: {duration}s ({info['width']}x{info['height']} @ {info['fps']:.1f}fps, "
+          f"{info['size'] / 1e6:.0f}MB). Splitting into ~{math.ceil(duration / chunk_duration)} chunks of {chunk_duration:.0f}s...")
+    _remove_stale_parts(output_dir, base_name, ext)
+
+    if CHUNK_OVERLAP > 0:
+        plan = plan_overlapping_segments(duration, chunk_duration, CHUNK_OVERLAP, get_keyframe_times(video_path))
+        segments = _split_parallel_seek(video_path, output_dir, base_name, ext, plan)
+    else:
+        try:
+            segments = _split_single_pass(video_path, output_dir, base_name, ext, chunk_duration)
+            if not segments:
+                raise Exception("segment muxer produced no output")
+        except Exception as e:
+            print(f"⚠️ Single-pass split failed ({e}). Falling back to parallel seek cuts.")
+            _remove_stale_parts(output_dir, base_name, ext)
+            num_chunks = math.ceil(duration / chunk_duration)
+            plan = [(i * chunk_duration, min(duration, (i + 1) * chunk_duration)) for i in range(num_chunks)]
+            segments = _split_parallel_seek(video_path, output_dir, base_name, ext, plan)
+
+    for seg in segments:
+        print(f"Created chunk: {seg['path']} ({seg['start']:.1f}s - {seg['end']:.1f}s)")
+    return segments
+
+def split_video(video_path: str, output_dir: str) -> list[str]:
+    """Splits video into adaptively sized chunks and returns list of file paths."""
+    return [seg["path"] for seg in split_video_segments(video_path, output_dir)]
+
+async def split_videos_async(video_paths: list[str], output_dir: str) -> list[list[dict]]:
+    """Splits several uploaded videos concurrently (ffmpeg runs outside the event loop)."""
+    return list(await asyncio.gather(*(
+        asyncio.to_thread(split_video_segments, path, output_dir) for path in video_paths
+    )))
+
+def _proxy_worthwhile(info: dict, profile: dict) -> bool:
+    """A proxy can only help if the source is bigger or faster than the profile."""
+    return info["height"] > profile["height"] or info["fps"] > profile["fps"] * 1.5
+
+def transcode_proxy(chunk_path: str, profile_name: str = None, threads: int = 0) -> dict:
+    """
+    Re-encodes one chunk to the proxy profile and decides whether to use it.
+    Returns {"path", "profile", "original_bytes", "proxy_bytes", "used"}.
+    """
+    profile_name = profile_name or VIDEO_PROXY_PROFILE
+    profile = PROXY_PROFILES[profile_name]
+    original_bytes = os.path.getsize(chunk_path)
+    report = {"path": chunk_path, "profile": profile_name, "original_bytes": original_bytes, "proxy_bytes": None, "used": False}
+
+    if VIDEO_PROXY_MODE != "force":
+        try:
+            info = probe_video(chunk_path)
+        except Exception as e:
+            # The proxy is optional: upload the original chunk
+            print(f"⚠️ Could not probe {chunk_path} for a proxy: {e}")
+            return report
+        if not _proxy_worthwhile(info, profile):
+            return report
+
+    base_name, _ = os.path.splitext(chunk_path)
+    proxy_path = f"{base_name}_proxy.mp4"
+    cmd = [
+        "ffmpeg",
+        "-i", chunk_path,
+        "-map", "0:v:0", "-map", "0:a?",
+        "-vf", f"scale=-2:'min({profile['height']},ih)',fps={profile['fps']}",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", str(profile["crf"]),
+        "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "64k", "-ac", "1",
+        "-movflags", "+faststart",
+        "-threads", str(threads),
+        "-y",
+        proxy_path
+    ]
+    try:
         subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        chunks.append(chunk_path)
-        print(f"Created chunk: {chunk_path}")
+    except subprocess.CalledProcessError as e:
+        print(f"⚠️ Proxy transcode failed for {chunk_path}: {e}")
+        return report
+
+    proxy_bytes = os.path.getsize(proxy_path)
+    report["proxy_bytes"] = proxy_bytes
+    if VIDEO_PROXY_MODE == "force" or proxy_bytes <= original_bytes * PROXY_MIN_RATIO:
+        report.update({"path": proxy_path, "used": True})
+    else:
+        os.remove(proxy_path)
+    return report
+
+def transcode_proxies(chunk_paths: list[str], profile_name: str = None) -> list[dict]:
+    """Transcodes chunks in parallel across cores. Returns one report per chunk, in order."""
+    if VIDEO_PROXY_MODE == "off" or not chunk_paths:
+        return [{"path": p, "profile": None, "original_bytes": os.path.getsize(p), "proxy_bytes": None, "used": False} for p in chunk_paths]
+
+    workers = min(PROXY_WORKERS, len(chunk_paths))
+    threads_per_encode = max(1, (os.cpu_count() or 2) // workers)
+    # Threads are enough here: each worker just waits on its own ffmpeg process
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        reports = list(pool.map(lambda p: transcode_proxy(p, profile_name, threads_per_encode), chunk_paths))
+
+    for r in reports:
+        if r["used"]:
+            print(f"Proxy ({r['profile']}): {os.path.basename(r['path'])} {r['original_bytes'] / 1e6:.1f}MB -> {r['proxy_bytes'] / 1e6:.1f}MB")
+    return reports
 
-    return chunks
+async def transcode_proxies_async(chunk_paths: list[str], profile_name: str = None) -> list[dict]:
+    return await asyncio.to_thread(transcode_proxies, chunk_paths, profile_name)
@@ -0,0 +1,49 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from services import ai_service, gemini_files
+from services.upload_cache import GeminiFileCache
+
+
+@pytest.fixture
+def fake_remote(monkeypatch, tmp_path):
+    """Remote file API replaced by counters; a one-entry cache so every new upload evicts."""
+    deleted = []
+    uploads = iter(range(1, 1000))
+
+    async def upload_and_wait(path, mime_type=None):
+        return SimpleNamespace(name=f"files/{next(uploads)}", state=SimpleNamespace(name="ACTIVE"), size_bytes=1)
+
+    async def delete(name):
+        deleted.append(name)
+
+    monkeypatch.setattr(gemini_files, "upload_and_wait_async", upload_and_wait)
+    monkeypatch.setattr(gemini_files, "delete_file_async", delete)
+    monkeypatch.setattr(gemini_files, "file_cache", GeminiFileCache(str(tmp_path / "cache.json"), max_entries=1))
+    monkeypatch.setattr(gemini_files, "_in_use", gemini_files.Counter())
+    return deleted
+
+
+def test_evicted_file_is_deleted_on_last_release(fake_remote):
+    async def run():
+        first = await gemini_files.upload_file_cached("a.mp4", sha256="a")
+        second = await gemini_files.upload_file_cached("b.mp4", sha256="b")
+        assert fake_remote == []  # first was evicted but is still in use
+        await gemini_files.release_file_async(first)
+        assert fake_remote == [first.name]
+        await gemini_files.release_file_async(second)
+        assert fake_remote == [first.name]  # second is still cached
+
+    asyncio.run(run())
+
+
+def test_failed_generation_releases_the_chunk_file(fake_remote, monkeypatch, tmp_path):
+    async def failing_generate_content(*args, **kwargs):
+        raise RuntimeError("model down")
+
+    monkeypatch.setattr(ai_service, "generate_content", failing_generate_content)
+    chunk = tmp_path / "chunk.mp4"
+    chunk.write_bytes(b"video")
+    with pytest.raises(RuntimeError):
+        asyncio.run(ai_service.generate_sop_for_chunk(str(chunk), 0, 1, "prompt"))
+    assert sum(gemini_files._in_use.values()) == 0
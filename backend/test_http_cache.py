@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+from services.http_cache import not_modified, make_etag
+
+ETAG = make_etag("ab" * 32, "raw")
+
+
+def _request(**headers):
+    return SimpleNamespace(headers=headers)
+
+
+def test_not_modified_matches_if_none_match():
+    assert not_modified(_request(**{"if-none-match": ETAG}), ETAG)
+    assert not_modified(_request(**{"if-none-match": f'"other", {ETAG}'}), ETAG)
+    assert not_modified(_request(**{"if-none-match": "*"}), ETAG)
+    # Weak comparison: a W/ tag (e.g. after a proxy recompressed the body) still matches
+    assert not_modified(_request(**{"if-none-match": f"W/{ETAG}"}), ETAG)
+
+
+def test_not_modified_needs_the_same_representation():
+    assert not not_modified(_request(), ETAG)
+    assert not not_modified(_request(**{"if-none-match": make_etag("ab" * 32)}), ETAG)
+    assert not not_modified(_request(**{"if-none-match": '"other"'}), ETAG)
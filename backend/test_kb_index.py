@@ -0,0 +1,59 @@
+import os
+import pytest
+from services.kb_index import KBIndex
+from services.storage_service import encode_cursor, decode_cursor
+
+
+def _write(kb_dir, company, filename, data: bytes):
+    company_dir = kb_dir / company
+    company_dir.mkdir(exist_ok=True)
+    (company_dir / filename).write_bytes(data)
+
+
+def test_first_use_indexes_the_knowledge_base_and_skips_unreadable_files(tmp_path):
+    kb_dir = tmp_path / "kb"
+    kb_dir.mkdir()
+    _write(kb_dir, "Acme", "Acme_Billing_v1.md", b"<!-- metadata:processing_time=4.5 -->\n# Billing\n")
+    _write(kb_dir, "Acme", "Acme_Billing_v2.md", b"\xff\xfe not utf-8")
+    # The index file lives elsewhere; the rebuild must still scan kb_dir
+    index = KBIndex(str(kb_dir), str(tmp_path / "index" / "kb.sqlite"))
+
+    latest = index.latest("Acme", "Billing")
+    assert latest["version"] == 1
+    assert latest["processing_time"] == 4.5
+    assert [doc["filename"] for doc in index.list_documents()] == ["Acme_Billing_v1.md"]
+
+
+def _index_with_versions(tmp_path, count: int) -> KBIndex:
+    kb_dir = tmp_path / "kb"
+    kb_dir.mkdir()
+    for version in range(1, count + 1):
+        _write(kb_dir, "Acme", f"Acme_Billing_v{version}.md", f"# Billing v{version}\n".encode())
+        # Versions 2 and up share a timestamp; the path breaks the tie
+        created = 1_700_000_000 + min(version, 2)
+        os.utime(kb_dir / "Acme" / f"Acme_Billing_v{version}.md", (created, created))
+    return KBIndex(str(kb_dir), str(tmp_path / "kb.sqlite"))
+
+
+def _pages(index: KBIndex, **kwargs) -> list[list[str]]:
+    pages, after = [], None
+    while True:
+        docs, after = index.query(limit=2, after=after, **kwargs)
+        pages.append([doc["version"] for doc in docs])
+        if after is None:
+            return pages
+
+
+def test_query_cursor_pages_through_every_version_once(tmp_path):
+    index = _index_with_versions(tmp_path, 5)
+    assert _pages(index) == [["v5", "v4"], ["v3", "v2"], ["v1"]]
+    assert _pages(index, newest_first=False) == [["v1", "v2"], ["v3", "v4"], ["v5"]]
+    assert _pages(index, latest_only=True) == [["v5"]]
+
+
+def test_cursor_round_trip_and_invalid_cursors():
+    key = [1_700_000_002.0, "knowledge_base/Acme/Acme_Billing_v3.md"]
+    assert decode_cursor(encode_cursor(key)) == key
+    for cursor in ("not base64!", encode_cursor({"a": 1}), encode_cursor([1])):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
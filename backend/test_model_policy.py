@@ -0,0 +1,33 @@
+import asyncio
+from types import SimpleNamespace
+from services import model_policy, sop_aggregator
+
+
+def _merge_model(monkeypatch, partials: int) -> str:
+    """The model merge_partial_sops picks for `partials` partials."""
+    used = []
+
+    async def fake_generate_content(model_name, contents, **kwargs):
+        used.append(model_name)
+        return SimpleNamespace(text="merged")
+
+    monkeypatch.setattr(sop_aggregator, "generate_content", fake_generate_content)
+    asyncio.run(sop_aggregator.merge_partial_sops([f"## 1. Part {i}" for i in range(partials)]))
+    return used[0]
+
+
+def test_merge_small_rule_applies_to_small_jobs(monkeypatch):
+    monkeypatch.setitem(model_policy.STAGE_MODELS, "merge", "gemini-2.5-pro")
+    monkeypatch.setitem(model_policy.STAGE_MODELS, "merge:small", "gemini-2.5-flash")
+    assert _merge_model(monkeypatch, 2) == "gemini-2.5-flash"
+    assert _merge_model(monkeypatch, model_policy.SMALL_JOB_CHUNKS + 1) == "gemini-2.5-pro"
+
+
+def test_default_rules_cover_small_jobs_and_documents(monkeypatch):
+    monkeypatch.setattr(model_policy, "STAGE_MODELS", dict(model_policy.DEFAULT_STAGE_MODELS))
+    assert model_policy.model_for("extraction", chunks=1) == "gemini-2.5-flash"
+    assert model_policy.model_for("extraction", evidence="video", chunks=1) == "gemini-2.5-flash"
+    assert model_policy.model_for("extraction", evidence="video",
+                                  chunks=model_policy.SMALL_JOB_CHUNKS + 1) == "gemini-2.5-pro"
+    assert model_policy.model_for("extraction", evidence="document") == "gemini-2.5-flash"
+    assert model_policy.model_for("merge", chunks=2) == "gemini-2.5-flash"
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+import pytest
+from services import resilience
+from services.resilience import CircuitBreaker, CircuitOpenError, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def _open(breaker):
+    for _ in range(BREAKER_FAILURE_THRESHOLD):
+        breaker.check()
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("m")
+    for _ in range(BREAKER_FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+    breaker.record_success()  # A success resets the count
+    for _ in range(BREAKER_FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    assert breaker.rejected == 1
+
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("m")
+    _open(breaker)
+    clock[0] += BREAKER_RESET_SECONDS
+    assert breaker.state == "half_open"
+    breaker.check()  # The probe
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.check()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker("m")
+    _open(breaker)
+    clock[0] += BREAKER_RESET_SECONDS
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock[0] += BREAKER_RESET_SECONDS - 1
+    assert breaker.state == "open"  # The reset time starts over
+
+
+def test_released_probe_can_be_retried(clock):
+    breaker = CircuitBreaker("m")
+    _open(breaker)
+    clock[0] += BREAKER_RESET_SECONDS
+    breaker.check()
+    breaker.release_probe()  # e.g. the probe was a bad request
+    breaker.check()
+    assert breaker.state == "half_open"
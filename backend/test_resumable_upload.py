@@ -0,0 +1,58 @@
+import asyncio
+import hashlib
+import pytest
+from services import resumable_upload
+from services.resumable_upload import ResumableUpload, UploadError, parse_content_range
+
+
+def test_parse_content_range():
+    assert parse_content_range(None, 10) == 0
+    assert parse_content_range("bytes 0-9/100", 10, size=100) == 0
+    assert parse_content_range("bytes 90-99/*", 10, size=100) == 90
+
+
+@pytest.mark.parametrize("header, status_code", [
+    ("bytes 0-9", 400),             # No total
+    ("bytes a-9/100", 400),
+    ("items 0-9/100", 400),
+    ("bytes 0-19/100", 400),        # Range is longer than the body
+    ("bytes 0-9/200", 416),         # Total isn't the upload's size
+])
+def test_parse_content_range_rejects(header, status_code):
+    with pytest.raises(UploadError) as error:
+        parse_content_range(header, 10, size=100)
+    assert error.value.status_code == status_code
+
+
+@pytest.fixture
+def upload(monkeypatch, tmp_path):
+    monkeypatch.setattr(resumable_upload, "UPLOAD_DIR", str(tmp_path))
+    upload = ResumableUpload("u1", "rec.webm", 10, "video/webm")
+    (tmp_path / "u1").mkdir()
+    return upload
+
+
+def _status(coroutine) -> int:
+    with pytest.raises(UploadError) as error:
+        asyncio.run(coroutine)
+    return error.value.status_code
+
+
+def test_write_part_appends_in_order(upload):
+    assert asyncio.run(upload.write_part(0, b"01234", hashlib.sha256(b"01234").hexdigest())) == 5
+    assert asyncio.run(upload.write_part(5, b"56789")) == 10
+    with open(upload.path, "rb") as f:
+        assert f.read() == b"0123456789"
+    restored = ResumableUpload._restore("u1")
+    assert restored.offset == 10
+
+
+def test_write_part_rejects_what_doesnt_fit(upload):
+    asyncio.run(upload.write_part(0, b"01234"))
+    assert _status(upload.write_part(0, b"01234")) == 409       # Duplicate part
+    assert _status(upload.write_part(7, b"789")) == 409         # Gap
+    assert _status(upload.write_part(5, b"567890")) == 416      # Past the declared size
+    assert _status(upload.write_part(5, b"56789", "0" * 64)) == 422
+    assert upload.offset == 5
+    upload.status = "complete"
+    assert _status(upload.write_part(5, b"56789")) == 409
@@ -0,0 +1,83 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from services import gemini_scheduler
+from services.gemini_scheduler import TokenBucket, GenerationScheduler
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """gemini_scheduler's monotonic clock, advanced by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(gemini_scheduler, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_token_bucket_refills_continuously(clock):
+    bucket = TokenBucket(60)  # one token per second
+    bucket.consume(60)
+    assert bucket.time_until(1) == pytest.approx(1.0)
+    clock[0] += 0.5
+    assert bucket.time_until(1) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket.time_until(1) == 0.0
+    clock[0] += 3600
+    assert bucket.level == pytest.approx(1.0)  # Not refilled until asked
+    bucket.time_until(1)
+    assert bucket.level == 60  # Capped at capacity
+
+
+def test_token_bucket_caps_requests_at_capacity(clock):
+    bucket = TokenBucket(60)
+    # A call larger than the whole budget waits for a full bucket, not forever
+    assert bucket.time_until(1000) == 0.0
+    bucket.consume(1000)
+    assert bucket.level == 0
+    assert bucket.time_until(1000) == pytest.approx(60.0)
+
+
+def test_token_bucket_adjust_settles_estimates(clock):
+    bucket = TokenBucket(600)
+    bucket.consume(100)
+    bucket.adjust(250)  # Used 250 more than estimated
+    assert bucket.level == pytest.approx(250)
+    bucket.adjust(-10_000)  # Overestimate: refunded, but never above capacity
+    assert bucket.level == 600
+
+
+def test_scheduler_serves_owners_round_robin():
+    scheduler = GenerationScheduler()
+    order = []
+
+    async def call(owner, index):
+        await scheduler.lane("m").acquire(owner, 1)
+        order.append(f"{owner}{index}")
+
+    async def run():
+        await asyncio.gather(*(call("a", i) for i in range(3)), call("b", 0))
+
+    asyncio.run(run())
+    assert order == ["a0", "b0", "a1", "a2"]
+
+
+def test_scheduler_waits_out_a_penalty():
+    scheduler = GenerationScheduler()
+
+    async def run():
+        scheduler.penalize("m", 0.05)
+        assert scheduler.stats()["m"]["cooling_down"]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await scheduler.acquire("m", 1)
+        return loop.time() - started
+
+    assert asyncio.run(run()) >= 0.04
+    assert not scheduler.stats()["m"]["cooling_down"]
+
+
+def test_scheduler_settle_charges_the_real_usage(clock):
+    scheduler = GenerationScheduler()
+    lane = scheduler.lane("gemini-2.5-pro")
+    lane.tpm.consume(1000)
+    scheduler.settle("gemini-2.5-pro", estimated=1000, actual=5000)
+    assert scheduler.stats()["gemini-2.5-pro"]["tpm_available"] == lane.tpm.capacity - 5000
@@ -0,0 +1,29 @@
+import pytest
+from services import sop_aggregator
+from services.sop_aggregator import plan_merge_groups
+
+
+@pytest.fixture(autouse=True)
+def fan_in(monkeypatch):
+    monkeypatch.setattr(sop_aggregator, "MERGE_MAX_FAN_IN", 8)
+
+
+def test_partials_that_fit_merge_in_one_call():
+    assert plan_merge_groups([100] * 4, budget=1000) == [[0, 1, 2, 3]]
+
+
+def test_groups_close_at_the_token_budget():
+    assert plan_merge_groups([400, 400, 400], budget=1000) == [[0, 1], [2]]
+    # A large partial fills its group; order is kept
+    assert plan_merge_groups([100, 900, 100, 100], budget=1000) == [[0, 1], [2, 3]]
+
+
+def test_groups_close_at_the_fan_in(monkeypatch):
+    monkeypatch.setattr(sop_aggregator, "MERGE_MAX_FAN_IN", 2)
+    assert plan_merge_groups([1] * 5, budget=1000) == [[0, 1], [2, 3], [4]]
+
+
+def test_partials_over_budget_are_merged_in_pairs():
+    # Singleton groups would never converge
+    assert plan_merge_groups([2000, 2000, 2000], budget=1000) == [[0, 1], [2]]
+    assert plan_merge_groups([2000], budget=1000) == [[0]]
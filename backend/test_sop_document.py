@@ -0,0 +1,39 @@
+from services.sop_document import SOPDocument
+
+SOP = (
+    "<!-- metadata:processing_time=12.5 -->\n"
+    "```json\n"
+    '{"company_name": "Acme", "process_name": "Billing"}\n'
+    "```\n"
+    "## 1. Overview\n"
+    "Monthly invoice run.\n"
+    "\n"
+    "## 3. Process Workflow\n"
+    "##### Stage 1: Intake\n"
+    "1. Open SAP\n"
+    "2. Post invoice\n"
+)
+
+
+def test_round_trip_is_exact():
+    for text in (SOP, SOP.rstrip("\n"), ""):
+        assert SOPDocument.parse(text).to_markdown() == text
+
+
+def test_round_trip_keeps_crlf_and_unicode_line_separators():
+    text = (SOP.replace("\n", "\r\n")
+            + "Note:\u2028see the appendix\x0cpage break\u2029end\x1c\x85\r\n"
+            + "\r\n"
+            + "## 4. Exceptions\r\n"
+            + "Lone\rcarriage return")
+    doc = SOPDocument.parse(text)
+    assert doc.to_markdown() == text
+    assert [section.id for section in doc.sections] == ["1", "3", "4"]
+    assert doc.metadata["process_name"] == "Billing"
+    assert [step.text for step in doc.section("3").steps] == ["Open SAP", "Post invoice"]
+
+
+def test_body_setter_keeps_unicode_line_separators():
+    doc = SOPDocument.parse(SOP)
+    doc.section("1").body = "Line one\u2028still line one"
+    assert "Line one\u2028still line one" in doc.to_markdown()
@@ -0,0 +1,26 @@
+from services.idle_trimmer import remap_timestamps, build_time_map
+
+
+def test_video_marker_is_shifted_by_chunk_offset():
+    text = "Step 1: Open SAP (Source: Video [video 2:34])"
+    assert remap_timestamps(text, offset=1200) == "Step 1: Open SAP (Source: Video [video 22:34])"
+
+
+def test_video_marker_follows_idle_trim_map():
+    # 0-60s kept, 60-360s idle (removed), rest kept
+    time_map = build_time_map([(0, 60), (360, 1200)])
+    assert remap_timestamps("[video 1:30]", time_map=time_map) == "[video 6:30]"
+
+
+def test_time_of_day_passes_through_unchanged():
+    text = (
+        "| Daily cut-off time | 17:00 |\n"
+        "Start time: 09:30, report due @ 8:15:00\n"
+        "Video timestamp 2:34 (no marker)\n"
+        "Step 4 (Source: Video [video 0:45])"
+    )
+    remapped = remap_timestamps(text, offset=1200)
+    assert "| Daily cut-off time | 17:00 |" in remapped
+    assert "Start time: 09:30, report due @ 8:15:00" in remapped
+    assert "Video timestamp 2:34 (no marker)" in remapped
+    assert "[video 20:45]" in remapped
@@ -0,0 +1,14 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from services import upload_ingest
+
+
+def test_non_numeric_content_length_is_a_malformed_upload(tmp_path):
+    request_dir = tmp_path / "request"
+    request_dir.mkdir()
+    request = SimpleNamespace(headers={"content-length": "abc", "content-type": "multipart/form-data; boundary=x"})
+
+    with pytest.raises(upload_ingest.MalformedUpload):
+        asyncio.run(upload_ingest.ingest_multipart(request, str(request_dir)))
+    assert not request_dir.exists()
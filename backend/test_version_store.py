@@ -0,0 +1,64 @@
+import os
+from services import version_store
+from services.version_store import make_delta, apply_delta, delta_base, resolve, compact, compact_local_tree
+
+HEADER = "<!-- metadata:processing_time=12.5 -->"
+
+
+def _sop(changed_step: int) -> str:
+    steps = [f"{i}. Step {i}{' (revised)' if i == changed_step else ''}\n" for i in range(1, 60)]
+    return HEADER + "\n# Billing\n" + "".join(steps)
+
+
+def test_delta_round_trip_keeps_the_storage_header():
+    old, new = _sop(3), _sop(40)
+    delta = make_delta(old, new, 2)
+    assert delta.startswith(HEADER + "\n")
+    assert delta_base(delta) == 2
+    assert len(delta) < len(old)
+    assert apply_delta(delta, new) == old
+
+
+def test_resolve_follows_deltas_to_the_full_copy():
+    v1, v2, v3 = _sop(1), _sop(2), _sop(3)
+    stored = {
+        "kb/Acme/Acme_Billing_v1.md": make_delta(v1, v2, 2),
+        "kb/Acme/Acme_Billing_v2.md": make_delta(v2, v3, 3),
+        "kb/Acme/Acme_Billing_v3.md": v3,
+    }
+    path = "kb/Acme/Acme_Billing_v1.md"
+    assert resolve(path, stored[path], stored.get) == v1
+    assert resolve("kb/Acme/Acme_Billing_v3.md", v3, stored.get) == v3
+    # A missing base can't be resolved
+    del stored["kb/Acme/Acme_Billing_v2.md"]
+    assert resolve(path, stored[path], stored.get) is None
+
+
+def test_compact_keeps_snapshots_and_existing_deltas(monkeypatch):
+    monkeypatch.setattr(version_store, "SNAPSHOT_INTERVAL", 10)
+    delta = compact("Acme_Billing_v2.md", _sop(2), _sop(3))
+    assert delta_base(delta) == 3
+    assert compact("Acme_Billing_v11.md", _sop(2), _sop(3)) is None  # Snapshot
+    assert compact("Acme_Billing_v2.md", delta, _sop(3)) is None
+    monkeypatch.setattr(version_store, "VERSION_DELTAS_ENABLED", False)
+    assert compact("Acme_Billing_v2.md", _sop(2), _sop(3)) is None
+
+
+def test_compact_local_tree_keeps_every_version_readable(monkeypatch, tmp_path):
+    monkeypatch.setattr(version_store, "SNAPSHOT_INTERVAL", 10)
+    company_dir = tmp_path / "Acme"
+    company_dir.mkdir()
+    versions = {version: _sop(version) for version in range(1, 5)}
+    for version, text in versions.items():
+        (company_dir / f"Acme_Billing_v{version}.md").write_text(text, encoding="utf-8")
+    mtime = os.stat(company_dir / "Acme_Billing_v2.md").st_mtime_ns
+
+    before, after = compact_local_tree(str(tmp_path))
+
+    assert after < before
+    for version, text in versions.items():
+        path = str(company_dir / f"Acme_Billing_v{version}.md")
+        stored = version_store._read_local(path)
+        assert delta_base(stored) == (version + 1 if version in (2, 3) else None)
+        assert resolve(path, stored, version_store._read_local) == text
+    assert os.stat(company_dir / "Acme_Billing_v2.md").st_mtime_ns == mtime
@@ -103,29 +103,107 @@ function cycleRecording() {
 // We'll use a global flag
 let isLooping = true;
 
+const API_URL = 'http://localhost:8000';
+// Each request (create / part / finalize) is retried on its own, so a
+// network hiccup costs one part instead of the whole 20-minute recording.
+const UPLOAD_MAX_RETRIES = 6;
+
+async function sha256Hex(buffer) {
+    const digest = await crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+// The server no longer has the upload (expired, restarted, already processed)
+class UploadGone extends Error {}
+
+async function withRetry(label, fn) {
+    for (let attempt = 0; ; attempt++) {
+        try {
+            return await fn();
+        } catch (err) {
+            if (err instanceof UploadGone || attempt >= UPLOAD_MAX_RETRIES) throw err;
+            // Exponential backoff with jitter, capped at 30s
+            const delay = Math.min(30000, 1000 * 2 ** attempt) * (0.5 + Math.random());
+            console.warn(`${label} failed, retrying in ${Math.round(delay)}ms`, err);
+            await new Promise(resolve => setTimeout(resolve, delay));
+        }
+    }
+}
+
 async function uploadChunk(blob) {
-    const formData = new FormData();
+    // Keep recording while this chunk uploads
+    if (isLooping && recorder.stream.active) {
+        recorder.start();
+        timer = setTimeout(cycleRecording, CHUNK_DURATION_MS);
+    }
+
     // Name it with timestamp
     const filename = `recording_${Date.now()}.webm`;
-    formData.append('files', blob, filename);
     // Add Session Context if needed (TODO)
 
     try {
         console.log('Uploading chunk...', filename, blob.size);
-        const response = await fetch('http://localhost:8000/analyze', {
-            method: 'POST',
-            body: formData
-        });
-        console.log('Upload complete', response.status);
+        const fileHash = await sha256Hex(await blob.arrayBuffer());
+        let job;
+        try {
+            job = await sendUpload(blob, filename, fileHash);
+        } catch (err) {
+            if (!(err instanceof UploadGone)) throw err;
+            console.warn('Server lost the upload, starting over', err);
+            job = await sendUpload(blob, filename, fileHash);
+        }
+        console.log('Upload complete', job.job_id);
     } catch (err) {
         console.error('Upload failed', err);
     }
+}
 
-    // If we want to loop, we restart here
-    if (isLooping && recorder.stream.active) {
-        recorder.start();
-        timer = setTimeout(cycleRecording, CHUNK_DURATION_MS);
+// create -> parts -> finalize; resolves to the analysis job
+async function sendUpload(blob, filename, fileHash) {
+    const upload = await withRetry('Create upload', async () => {
+        const form = new FormData();
+        form.append('filename', filename);
+        form.append('size', String(blob.size));
+        form.append('content_type', 'video/webm');
+        const response = await fetch(`${API_URL}/uploads`, { method: 'POST', body: form });
+        if (!response.ok) throw new Error(`Create upload failed: ${response.status}`);
+        return response.json();
+    });
+
+    let offset = 0;
+    while (offset < blob.size) {
+        const part = await blob.slice(offset, offset + upload.part_size).arrayBuffer();
+        const partHash = await sha256Hex(part);
+        const start = offset;
+        offset = await withRetry(`Part at ${start}`, async () => {
+            const response = await fetch(`${API_URL}/uploads/${upload.upload_id}`, {
+                method: 'PUT',
+                headers: {
+                    'Content-Range': `bytes ${start}-${start + part.byteLength - 1}/${blob.size}`,
+                    'X-Part-SHA256': partHash
+                },
+                body: part
+            });
+            if (response.status === 409) {
+                // Server is at a different offset (e.g. an earlier attempt did land): resume there
+                const { detail } = await response.json();
+                return detail.offset;
+            }
+            if (response.status === 404 || response.status === 410) throw new UploadGone(`Part upload failed: ${response.status}`);
+            if (!response.ok) throw new Error(`Part upload failed: ${response.status}`);
+            return (await response.json()).offset;
+        });
     }
+
+    // The backend verifies the file and queues the analysis, answering with a job ID
+    return withRetry('Finalize upload', async () => {
+        const form = new FormData();
+        form.append('sha256', fileHash);
+        const response = await fetch(`${API_URL}/uploads/${upload.upload_id}/finalize`, { method: 'POST', body: form });
+        if (response.status === 404 || response.status === 410) throw new UploadGone(`Finalize failed: ${response.status}`);
+        if (!response.ok) throw new Error(`Finalize failed: ${response.status}`);
+        return response.json();
+    });
 }
 
 // Update stopRecording to kill loop
@@ -10,6 +10,7 @@ function App() {
 
   // State matching child components
   const [sopContent, setSopContent] = useState<string>('');
+  const [partialSop, setPartialSop] = useState<string>('');
   const [processingTime, setProcessingTime] = useState<number | undefined>(undefined);
   const [isLoading, setIsLoading] = useState<boolean>(false);
   const [refreshTrigger, setRefreshTrigger] = useState<number>(0);
@@ -24,6 +25,7 @@ function App() {
   // Handlers matching VideoUploadProps
   const handleSopGenerated = (sop: string, time?: number) => {
     setSopContent(sop);
+    setPartialSop('');
     setProcessingTime(time);
     setIsLoading(false);
     setRefreshTrigger(prev => prev + 1); // Refresh sidebar
@@ -112,6 +114,7 @@ function App() {
                 {/* Main VideoUpload Component */}
                 <VideoUpload
                   onSopGenerated={handleSopGenerated}
+                  onPartialSop={setPartialSop}
                   isLoading={isLoading}
                   setIsLoading={setIsLoading}
                 />
@@ -130,6 +133,12 @@ function App() {
                 <p className="text-gray-400 max-w-md text-center">
                   Deconstructing video, identifying actions, and synthesizing documentation...
                 </p>
+                {/* Live preview while the final SOP is being written */}
+                {partialSop && (
+                  <div className="w-full mt-10">
+                    <SOPViewer content={partialSop} isStreaming />
+                  </div>
+                )}
               </div>
             )}
 
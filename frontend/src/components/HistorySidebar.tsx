@@ -16,32 +16,36 @@ interface HistorySidebarProps {
     refreshTrigger: number;
 }
 
+const PAGE_SIZE = 100;
+
 const HistorySidebar: React.FC<HistorySidebarProps> = ({ onSelectDoc, refreshTrigger }) => {
-    const [groupedDocs, setGroupedDocs] = useState<Record<string, Document[]>>({});
+    const [docs, setDocs] = useState<Document[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [latestOnly, setLatestOnly] = useState(false);
     const [expandedCompanies, setExpandedCompanies] = useState<Record<string, boolean>>({});
     const [loading, setLoading] = useState(false);
 
     useEffect(() => {
         fetchHistory();
-    }, [refreshTrigger]);
+    }, [refreshTrigger, latestOnly]);
 
-    const fetchHistory = async () => {
+    const fetchHistory = async (cursor?: string) => {
         setLoading(true);
         try {
             const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
-            const res = await fetch(`${API_URL}/documents`);
+            const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+            if (latestOnly) params.set('latest_only', 'true');
+            if (cursor) params.set('cursor', cursor);
+            const res = await fetch(`${API_URL}/documents?${params}`);
             const data = await res.json();
-            // Group by company
-            const groups: Record<string, Document[]> = {};
-            data.documents.forEach((doc: Document) => {
-                if (!groups[doc.company]) groups[doc.company] = [];
-                groups[doc.company].push(doc);
-            });
-            setGroupedDocs(groups);
+            const loaded: Document[] = cursor ? [...docs, ...data.documents] : data.documents;
+            setDocs(loaded);
+            setNextCursor(data.next_cursor);
 
             // Auto expand if only one company
-            if (Object.keys(groups).length === 1) {
-                setExpandedCompanies({ [Object.keys(groups)[0]]: true });
+            const companies = new Set(loaded.map(doc => doc.company));
+            if (!cursor && companies.size === 1) {
+                setExpandedCompanies({ [loaded[0].company]: true });
             }
         } catch (e) {
             console.error("Failed to fetch history", e);
@@ -50,6 +54,13 @@ const HistorySidebar: React.FC<HistorySidebarProps> = ({ onSelectDoc, refreshTri
         }
     };
 
+    // Group by company
+    const groupedDocs: Record<string, Document[]> = {};
+    docs.forEach(doc => {
+        if (!groupedDocs[doc.company]) groupedDocs[doc.company] = [];
+        groupedDocs[doc.company].push(doc);
+    });
+
     const toggleCompany = (company: string) => {
         setExpandedCompanies(prev => ({
             ...prev,
@@ -61,12 +72,12 @@ const HistorySidebar: React.FC<HistorySidebarProps> = ({ onSelectDoc, refreshTri
         try {
             const relativePath = `${doc.company}/${doc.filename}`;
             const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
-            const res = await fetch(`${API_URL}/document?path=${encodeURIComponent(relativePath)}`);
+            // Versions never change: the browser serves repeat opens from its cache
+            const res = await fetch(`${API_URL}/document/raw?path=${encodeURIComponent(relativePath)}`);
 
             if (!res.ok) throw new Error("Failed to load");
 
-            const data = await res.json();
-            onSelectDoc(data.content, doc.processing_time);
+            onSelectDoc(await res.text(), doc.processing_time);
         } catch (e) {
             console.error("Error loading doc", e);
         }
@@ -79,10 +90,19 @@ const HistorySidebar: React.FC<HistorySidebarProps> = ({ onSelectDoc, refreshTri
                     <History className="w-5 h-5 text-indigo-600" />
                     <h2>Process History</h2>
                 </div>
+                <label className="flex items-center gap-2 mt-2 text-xs text-slate-500 cursor-pointer">
+                    <input
+                        type="checkbox"
+                        checked={latestOnly}
+                        onChange={e => setLatestOnly(e.target.checked)}
+                        className="accent-indigo-600"
+                    />
+                    Latest version only
+                </label>
             </div>
 
             <div className="flex-1 overflow-y-auto p-2">
-                {loading && <div className="text-center p-4 text-slate-400 text-sm">Loading...</div>}
+                {loading && docs.length === 0 && <div className="text-center p-4 text-slate-400 text-sm">Loading...</div>}
 
                 {!loading && Object.keys(groupedDocs).length === 0 && (
                     <div className="text-center p-8 text-slate-400 text-sm">
@@ -128,6 +148,16 @@ const HistorySidebar: React.FC<HistorySidebarProps> = ({ onSelectDoc, refreshTri
                         )}
                     </div>
                 ))}
+
+                {nextCursor && (
+                    <button
+                        onClick={() => fetchHistory(nextCursor)}
+                        disabled={loading}
+                        className="w-full p-2 mt-1 text-xs font-medium text-indigo-600 hover:bg-slate-100 rounded-lg transition-colors disabled:text-slate-400"
+                    >
+                        {loading ? 'Loading...' : 'Load more'}
+                    </button>
+                )}
             </div>
         </div>
     );
@@ -9,9 +9,10 @@ import remarkGfm from 'remark-gfm';
 interface SOPViewerProps {
     content: string;
     processingTime?: number;
+    isStreaming?: boolean;
 }
 
-const SOPViewer: React.FC<SOPViewerProps> = ({ content, processingTime }) => {
+const SOPViewer: React.FC<SOPViewerProps> = ({ content, processingTime, isStreaming }) => {
     const [copied, setCopied] = useState(false);
 
     if (!content) return null;
@@ -57,7 +58,9 @@ const SOPViewer: React.FC<SOPViewerProps> = ({ content, processingTime }) => {
                                     </span>
                                 )}
                             </div>
-                            <p className="text-xs text-slate-500 font-medium">AI-Synthesized Documentation</p>
+                            <p className="text-xs text-slate-500 font-medium">
+                                {isStreaming ? 'Writing… (preview, may still change)' : 'AI-Synthesized Documentation'}
+                            </p>
                         </div>
                     </div>
                     <div className="flex items-center gap-2">
@@ -70,6 +73,7 @@ const SOPViewer: React.FC<SOPViewerProps> = ({ content, processingTime }) => {
                         </button>
                         <button
                             onClick={handleDownload}
+                            disabled={isStreaming}
                             className="flex items-center gap-2 px-4 py-2 text-sm font-medium text-white bg-slate-900 hover:bg-slate-800 rounded-lg transition-all shadow-lg shadow-slate-900/10"
                         >
                             <Download className="w-4 h-4" />
@@ -4,14 +4,16 @@ import { twMerge } from 'tailwind-merge';
 
 interface VideoUploadProps {
     onSopGenerated: (sop: string, time?: number) => void;
+    onPartialSop?: (partial: string) => void;
     isLoading: boolean;
     setIsLoading: (loading: boolean) => void;
 }
 
-const VideoUpload: React.FC<VideoUploadProps> = ({ onSopGenerated, isLoading, setIsLoading }) => {
+const VideoUpload: React.FC<VideoUploadProps> = ({ onSopGenerated, onPartialSop, isLoading, setIsLoading }) => {
     const [error, setError] = useState<string | null>(null);
     const [dragActive, setDragActive] = useState(false);
     const [selectedFiles, setSelectedFiles] = useState<{ file: File; context: string }[]>([]);
+    const [progressMessage, setProgressMessage] = useState<string | null>(null);
 
     const handleDrag = useCallback((e: React.DragEvent) => {
         e.preventDefault();
@@ -61,7 +63,9 @@ const VideoUpload: React.FC<VideoUploadProps> = ({ onSopGenerated, isLoading, se
                 throw new Error(`Error: ${response.statusText}`);
             }
 
-            const data = await response.json();
+            // /analyze only queues the job; follow its progress over SSE
+            const { job_id } = await response.json();
+            const data = await followJob(API_URL, job_id);
             if (['success', 'created', 'updated'].includes(data.status)) {
                 onSopGenerated(data.sop, data.processing_time);
                 setSelectedFiles([]); // Clear on success
@@ -71,10 +75,57 @@ const VideoUpload: React.FC<VideoUploadProps> = ({ onSopGenerated, isLoading, se
         } catch (err) {
             setError(err instanceof Error ? err.message : 'Upload failed');
         } finally {
+            setProgressMessage(null);
+            onPartialSop?.('');
             setIsLoading(false);
         }
     };
 
+    const followJob = (apiUrl: string, jobId: string): Promise<any> => {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`${apiUrl}/jobs/${jobId}/events`);
+            let partial = '';
+
+            // SOP text as the model writes it; the final result replaces it
+            source.addEventListener('delta', (e) => {
+                const event = JSON.parse((e as MessageEvent).data);
+                partial = event.reset ? event.text : partial + event.text;
+                onPartialSop?.(partial);
+            });
+
+            source.addEventListener('progress', (e) => {
+                const event = JSON.parse((e as MessageEvent).data);
+                if (event.message) setProgressMessage(event.message);
+            });
+            source.addEventListener('completed', (e) => {
+                source.close();
+                resolve(JSON.parse((e as MessageEvent).data).data.result);
+            });
+            source.addEventListener('failed', (e) => {
+                source.close();
+                reject(new Error(JSON.parse((e as MessageEvent).data).message || 'Analysis failed'));
+            });
+            source.onerror = async () => {
+                // Stream dropped (proxy timeout etc.) - fall back to polling the job
+                source.close();
+                try {
+                    while (true) {
+                        const res = await fetch(`${apiUrl}/jobs/${jobId}`);
+                        if (!res.ok) throw new Error(`Error: ${res.statusText}`);
+                        const job = await res.json();
+                        if (job.message) setProgressMessage(job.message);
+                        if (job.partial_text) onPartialSop?.(job.partial_text);
+                        if (job.status === 'completed') return resolve(job.result);
+                        if (job.status === 'failed') return reject(new Error(job.error || 'Analysis failed'));
+                        await new Promise(r => setTimeout(r, 3000));
+                    }
+                } catch (err) {
+                    reject(err);
+                }
+            };
+        });
+    };
+
     const handleDrop = useCallback((e: React.DragEvent) => {
         e.preventDefault();
         e.stopPropagation();
@@ -217,6 +268,9 @@ const VideoUpload: React.FC<VideoUploadProps> = ({ onSopGenerated, isLoading, se
                     <p className="text-slate-500 font-medium max-w-md text-center">
                         Synthesizing insights from {selectedFiles.length} evidence sources. Please wait.
                     </p>
+                    {progressMessage && (
+                        <p className="mt-4 text-sm font-semibold text-blue-600">{progressMessage}</p>
+                    )}
                 </div>
             )}
         </div>